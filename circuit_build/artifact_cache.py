@@ -0,0 +1,137 @@
+"""Artifact cache shared between circuits, used for the deterministic phases.
+
+The key of each artifact is computed from the command line of the rule, the environment
+configuration, and the digests of the input files, so that the outputs of the phases
+can be reused by other circuits built with the same inputs and parameters.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shlex
+import shutil
+from dataclasses import dataclass
+from pathlib import Path
+
+from circuit_build.provenance import file_digest
+
+L = logging.getLogger(__name__)
+
+COMPLETE_FILE = ".complete"
+
+
+@dataclass(frozen=True)
+class CacheOptions:
+    """Artifact cache used by a job.
+
+    Attributes:
+        inputs: paths of the files or directories used by the command, or their placeholders.
+        cache_dir: cache directory, or None to use the artifact cache given in the command line.
+    """
+
+    inputs: list
+    cache_dir: str | Path | None = None
+
+
+def artifact_key_prefix(command, env_config, inputs):
+    """Return the part of the key that can be computed before the execution of the job.
+
+    The paths of the inputs are replaced in the command by placeholders,
+    so that the key doesn't depend on the location of the files, but only on their content.
+
+    Args:
+        command (list): command to be executed as a list of strings.
+        env_config (dict): environment configuration of the command.
+        inputs (list): paths of the files or directories used by the command.
+    """
+    command = " ".join(map(str, command))
+    for n, path in enumerate(inputs):
+        command = command.replace(str(path), f"<input{n}>")
+    h = hashlib.sha256()
+    h.update(command.encode())
+    h.update(json.dumps(env_config, sort_keys=True).encode())
+    return h.hexdigest()
+
+
+def artifact_key(key_prefix, inputs):
+    """Return the key of the artifact, considering the content of the inputs."""
+    h = hashlib.sha256(key_prefix.encode())
+    for path in inputs:
+        # inputs that aren't local paths are considered only through the command line
+        h.update(f"{file_digest(path) or ''};".encode())
+    return h.hexdigest()
+
+
+def _link(src, dst):
+    """Hard-link src to dst, or copy it if hard links aren't supported."""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def _link_path(src, dst):
+    """Hard-link the file or directory src to dst."""
+    src, dst = Path(src), Path(dst)
+    if src.is_dir():
+        shutil.copytree(src, dst, copy_function=_link, dirs_exist_ok=True)
+    else:
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        if dst.exists():
+            dst.unlink()
+        _link(src, dst)
+
+
+def fetch(cache_dir, key, outputs):
+    """Link the cached artifact to the outputs, and return True if it's found in the cache."""
+    artifact_dir = Path(cache_dir, key)
+    if not (artifact_dir / COMPLETE_FILE).exists():
+        L.info("Artifact %s not found in %s", key, cache_dir)
+        return False
+    for n, output in enumerate(outputs):
+        _link_path(artifact_dir / str(n), output)
+    L.info("Artifact %s linked from %s", key, cache_dir)
+    return True
+
+
+def store(cache_dir, key, outputs):
+    """Store the outputs in the cache, if the artifact doesn't exist already."""
+    artifact_dir = Path(cache_dir, key)
+    if (artifact_dir / COMPLETE_FILE).exists():
+        return
+    # write to a temporary directory, then rename it to be safe with concurrent builds
+    tmp_dir = Path(cache_dir, f".{key}.{os.getpid()}.tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+    for n, output in enumerate(outputs):
+        _link_path(output, tmp_dir / str(n))
+    (tmp_dir / COMPLETE_FILE).touch()
+    try:
+        tmp_dir.rename(artifact_dir)
+    except OSError:
+        # the same artifact has been stored by another process in the meantime
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    else:
+        L.info("Artifact %s stored in %s", key, cache_dir)
+
+
+def build_artifact_cache_cmd(cmd, cache_dir, key_prefix, inputs):
+    """Wrap the command to link the outputs from the cache, or to store them after the execution.
+
+    Args:
+        cmd (str): command to be executed, already wrapped and redirected to the log file.
+        cache_dir (str): path to the artifact cache directory.
+        key_prefix (str): key prefix returned by :func:`artifact_key_prefix`.
+        inputs (list): paths of the files or directories used by the command.
+    """
+    options = " ".join(
+        [
+            f"--cache-dir {shlex.quote(str(cache_dir))}",
+            f"--key {key_prefix}",
+            *(f"--input {shlex.quote(str(path))}" for path in inputs),
+        ]
+    )
+    fetch_cmd = f"circuit-build -v artifact-cache fetch {options} {{output}}"
+    store_cmd = f"circuit-build -v artifact-cache store {options} {{output}}"
+    return f"if {fetch_cmd} >{{log}} 2>&1; then true; else {cmd} && {store_cmd} >>{{log}} 2>&1; fi"
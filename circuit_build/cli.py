@@ -1,17 +1,20 @@
 """Cli module."""
 
 import contextlib
+import functools
 import importlib.resources
 import json
 import logging
 import subprocess
 import sys
+from dataclasses import dataclass, fields
 from datetime import datetime
-from functools import partial
 from pathlib import Path
 
 import click
 
+from circuit_build import artifact_cache, sbatch
+from circuit_build.provenance import restore_mtimes, update_provenance
 from circuit_build.utils import clean_slurm_env
 
 L = logging.getLogger()
@@ -40,24 +43,30 @@ def _index(args, *opts):
     return indices[0]
 
 
-def _build_cmd(
-    base_cmd, *, args, bioname, modules, timestamp, cluster_config, skip_check_git=False
-):
+def _snakemake_config(*, bioname, modules, timestamp, cluster_config, options):
+    """Return the configuration passed to Snakemake with the ``--config`` option."""
     # force the timestamp to the same value in different executions of snakemake
-    extra_args = [
-        "--config",
-        f"bioname={bioname}",
-        f"timestamp={timestamp}",
-        f"cluster_config={cluster_config}",
-    ]
+    config = {"bioname": bioname, "timestamp": timestamp, "cluster_config": cluster_config}
     if modules:
         # serialize the list of strings with json to be backward compatible with Snakemake:
         # snakemake >= 5.28.0 loads config using yaml.BaseLoader,
         # snakemake < 5.28.0 loads config using eval.
-        extra_args += [f'modules={json.dumps(modules, separators=(",", ":"))}']
+        config["modules"] = json.dumps(modules, separators=(",", ":"))
+    if options.artifact_cache_dir:
+        config["artifact_cache"] = Path(options.artifact_cache_dir).absolute()
+    if options.use_sbatch:
+        config["sbatch"] = 1
+    return config
+
+
+def _build_cmd(base_cmd, *, args, config, sbatch_profile_dir=None, skip_check_git=False):
+    extra_args = ["--config", *(f"{key}={value}" for key, value in config.items())]
     if skip_check_git:
         extra_args += ["skip_check_git=1"]
-    if _index(args, "--cores", "--jobs", "-j") is None:
+    if sbatch_profile_dir:
+        # the number of jobs submitted at the same time is defined in the profile
+        extra_args += ["--profile", str(sbatch_profile_dir)]
+    elif _index(args, "--cores", "--jobs", "-j") is None:
         extra_args += ["--jobs", "8"]
     if _index(args, "--printshellcmds", "-p") is None:
         extra_args += ["--printshellcmds"]
@@ -100,6 +109,80 @@ def _run_report_process(cmd, filepath: Path, errorcode=4):
     return 0
 
 
+def _run_extra_processes(cmd, log_dir: Path, options):
+    """Save the summary and the report to file if requested, and return the exit code."""
+    exit_code = 0
+    if options.with_summary:
+        # snakemake with the --summary/--detailed-summary option does not execute the workflow
+        filepath = log_dir / "summary.tsv"
+        L.info("Creating report in %s", filepath)
+        exit_code += _run_summary_process(cmd=cmd, filepath=filepath)
+    if options.with_report:
+        # snakemake with the --report option does not execute the workflow
+        filepath = log_dir / "report.html"
+        L.info("Creating summary in %s", filepath)
+        exit_code += _run_report_process(cmd=cmd, filepath=filepath)
+    return exit_code
+
+
+@dataclass(frozen=True)
+class _RunOptions:
+    """Optional features of the ``run`` command."""
+
+    with_summary: bool = False
+    with_report: bool = False
+    content_hash: bool = False
+    artifact_cache_dir: str | None = None
+    use_sbatch: bool = False
+
+
+def _run_options(func):
+    """Add the options of the optional features, passed to the command as ``options``."""
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        options = _RunOptions(
+            **{field.name: kwargs.pop(field.name) for field in fields(_RunOptions)}
+        )
+        return func(*args, options=options, **kwargs)
+
+    wrapper = click.option(
+        "--sbatch",
+        "use_sbatch",
+        is_flag=True,
+        help=(
+            "Submit the jobs with sbatch instead of allocating them with salloc, using the "
+            "Snakemake profile written in `logs/<timestamp>/sbatch_profile`."
+        ),
+    )(wrapper)
+    wrapper = click.option(
+        "--artifact-cache",
+        "artifact_cache_dir",
+        required=False,
+        type=click.Path(file_okay=False),
+        help=(
+            "Path to a cache directory shared between circuits, used to link the outputs "
+            "of the deterministic phases instead of computing them again."
+        ),
+    )(wrapper)
+    wrapper = click.option(
+        "--content-hash",
+        is_flag=True,
+        help=(
+            "Use the content of the files instead of the modification times to decide "
+            "which jobs should be executed again, keeping track of the provenance "
+            "in `logs/provenance.json`."
+        ),
+    )(wrapper)
+    wrapper = click.option(
+        "--with-report", is_flag=True, help="Save a report in `logs/<timestamp>/report.html`."
+    )(wrapper)
+    wrapper = click.option(
+        "--with-summary", is_flag=True, help="Save a summary in `logs/<timestamp>/summary.tsv`."
+    )(wrapper)
+    return wrapper
+
+
 @click.group()
 @click.version_option()
 @click.option("-v", "--verbose", count=True, default=0, help="-v for INFO, -vv for DEBUG")
@@ -158,12 +241,7 @@ Examples:\n
     default=".",
     show_default=True,
 )
-@click.option(
-    "--with-summary", is_flag=True, help="Save a summary in `logs/<timestamp>/summary.tsv`."
-)
-@click.option(
-    "--with-report", is_flag=True, help="Save a report in `logs/<timestamp>/report.html`."
-)
+@_run_options
 @click.pass_context
 def run(
     ctx,
@@ -173,8 +251,7 @@ def run(
     modules: list,
     snakefile: str,
     directory: str,
-    with_summary: bool,
-    with_report: bool,
+    options: _RunOptions,
 ):
     """Run a circuit-build task.
 
@@ -194,26 +271,37 @@ def run(
             directory,
         ]
         timestamp = f"{datetime.now():%Y%m%dT%H%M%S}"
-        build_cmd = partial(
+        sbatch_profile_dir = None
+        if options.use_sbatch:
+            sbatch_profile_dir = Path(directory, "logs", timestamp, "sbatch_profile").absolute()
+            sbatch.write_profile(
+                sbatch_profile_dir,
+                cluster_config=cluster_config,
+                log_dir=Path(directory, "logs", timestamp, "sbatch"),
+            )
+        build_cmd = functools.partial(
             _build_cmd,
             base_cmd,
             args=args,
-            bioname=bioname,
-            modules=modules,
-            timestamp=timestamp,
-            cluster_config=cluster_config,
+            config=_snakemake_config(
+                bioname=bioname,
+                modules=modules,
+                timestamp=timestamp,
+                cluster_config=cluster_config,
+                options=options,
+            ),
+            sbatch_profile_dir=sbatch_profile_dir,
         )
+        if options.content_hash:
+            restored = restore_mtimes(directory)
+            L.info("Restored modification time of %s unchanged outputs", len(restored))
         exit_code = _run_snakemake_process(cmd=build_cmd())
-        if with_summary:
-            # snakemake with the --summary/--detailed-summary option does not execute the workflow
-            filepath = Path(f"{directory}/logs/{timestamp}/summary.tsv")
-            L.info("Creating report in %s", filepath)
-            exit_code += _run_summary_process(cmd=build_cmd(skip_check_git=True), filepath=filepath)
-        if with_report:
-            # snakemake with the --report option does not execute the workflow
-            filepath = Path(f"{directory}/logs/{timestamp}/report.html")
-            L.info("Creating summary in %s", filepath)
-            exit_code += _run_report_process(cmd=build_cmd(skip_check_git=True), filepath=filepath)
+        if options.content_hash:
+            # the provenance of the completed jobs is saved even if the workflow failed
+            update_provenance(directory)
+        exit_code += _run_extra_processes(
+            build_cmd(skip_check_git=True), Path(directory, "logs", timestamp), options
+        )
 
     # cumulative exit code given by the union of the exit codes, only for internal use
     #   0: success
@@ -221,3 +309,54 @@ def run(
     #   2: summary process failed
     #   4: report process failed
     sys.exit(exit_code)
+
+
+@cli.group(name="artifact-cache", hidden=True)
+def artifact_cache_group():
+    """Fetch or store the artifacts in the cache, only for internal use."""
+
+
+def _artifact_cache_options(func):
+    func = click.argument("outputs", nargs=-1, required=True)(func)
+    func = click.option("--input", "inputs", multiple=True, help="Input path.")(func)
+    func = click.option("--key", "key_prefix", required=True, help="Key prefix.")(func)
+    func = click.option("--cache-dir", required=True, help="Cache directory.")(func)
+    return func
+
+
+@artifact_cache_group.command()
+@_artifact_cache_options
+def fetch(cache_dir, key_prefix, inputs, outputs):
+    """Link the outputs from the cache, and exit with code 1 if they aren't found."""
+    key = artifact_cache.artifact_key(key_prefix, inputs)
+    if not artifact_cache.fetch(cache_dir, key, outputs):
+        sys.exit(1)
+
+
+@artifact_cache_group.command()
+@_artifact_cache_options
+def store(cache_dir, key_prefix, inputs, outputs):
+    """Store the outputs in the cache."""
+    key = artifact_cache.artifact_key(key_prefix, inputs)
+    artifact_cache.store(cache_dir, key, outputs)
+
+
+@cli.group(name="sbatch", hidden=True)
+def sbatch_group():
+    """Submit the jobs with sbatch and check their status, only for internal use."""
+
+
+@sbatch_group.command()
+@click.option("--cluster-config", required=True, help="Path to cluster config.")
+@click.option("--log-dir", required=True, help="Directory of the output of the Slurm jobs.")
+@click.argument("jobscript")
+def submit(cluster_config, log_dir, jobscript):
+    """Submit the jobscript written by Snakemake, and print the id of the Slurm job."""
+    click.echo(sbatch.submit(jobscript, cluster_config=cluster_config, log_dir=log_dir))
+
+
+@sbatch_group.command()
+@click.argument("jobid")
+def status(jobid):
+    """Print the status of the Slurm job: running, success or failed."""
+    click.echo(sbatch.job_status(jobid))
@@ -1,5 +1,9 @@
 """Utilities to build the commands to execute the Snakemake rules."""
 
+import logging
+import re
+import shlex
+from dataclasses import dataclass
 from pathlib import Path
 
 from circuit_build.constants import (
@@ -8,36 +12,56 @@ from circuit_build.constants import (
     APPTAINER_MODULEPATH,
     APPTAINER_MODULES,
     APPTAINER_OPTIONS,
+    DASK_CLUSTER_SCRIPT,
+    DASK_MEMORY_ENV_VARS,
+    DASK_MEMORY_SPILL_POLICY,
     ENV_CONFIG,
     ENV_TYPE_APPTAINER,
     ENV_TYPE_MODULE,
     ENV_TYPE_VENV,
+    OMP_BIND_ENV_VARS,
+    SALLOC_RESOURCES_OPTIONS,
+    SLURM_MEMORY_UNITS,
     SPACK_MODULEPATH,
+    THREADS_ENV_VARS,
 )
-from circuit_build.utils import redirect_to_file
+from circuit_build.utils import redirect_to_file, script_path
 
-
-def _escape_single_quotes(value):
-    """Return the given string after escaping the single quote character."""
-    return value.replace("'", "'\\''")
+L = logging.getLogger(__name__)
 
 
-def _unset_threads_vars(cmd):
-    """Unset the THREADS env variables because they may interfere with jobs.
+@dataclass(frozen=True)
+class CommandOptions:
+    """Options used to wrap the command of a job.
 
-    They are automatically set by Snakemake, depending on the `threads` configuration,
-    see https://snakemake.readthedocs.io/en/stable/snakefiles/rules.html#threads
-    and https://github.com/snakemake/snakemake/blob/e9f67318/snakemake/shell.py#L216-L221
+    Attributes:
+        pre_cmd: optional command to be executed before the command, in the same environment
+            but outside of the Slurm allocation.
+        post_cmd: optional command to be executed after the command, in the same environment
+            but outside of the Slurm allocation.
+        sbatch: True if the job has been submitted with sbatch, and the command should be
+            executed in the existing allocation instead of allocating it with salloc.
+        condition: optional shell condition tested after pre_cmd and outside of the Slurm
+            allocation. If the condition is false, the command is not executed, and no
+            allocation is requested.
+        loop: optional shell loop clause in the form ``name in values``. The command is
+            executed for each value with a separate job step in the same Slurm allocation,
+            with the variable ``name`` exported, and the loop stops at the first failure.
+        single_task: True if the command should be executed with one task using all the CPUs
+            allocated on the node, instead of one process for each task of the allocation.
     """
-    env_vars = [
-        "GOTO_NUM_THREADS",
-        "MKL_NUM_THREADS",
-        "NUMEXPR_NUM_THREADS",
-        "OMP_NUM_THREADS",
-        "OPENBLAS_NUM_THREADS",
-        "VECLIB_MAXIMUM_THREADS",
-    ]
-    return f"unset {' '.join(env_vars)} && {cmd}"
+
+    pre_cmd: list | None = None
+    post_cmd: list | None = None
+    sbatch: bool = False
+    condition: str | None = None
+    loop: str | None = None
+    single_task: bool = False
+
+
+def _escape_single_quotes(value):
+    """Return the given string after escaping the single quote character."""
+    return value.replace("'", "'\\''")
 
 
 def _get_source_file(path):
@@ -52,7 +76,7 @@ def _get_source_file(path):
     return path
 
 
-def _get_slurm_config(cluster_config, slurm_env):
+def get_slurm_config(cluster_config, slurm_env):
     """Return the slurm configuration corresponding to slurm_env."""
     if not slurm_env or not cluster_config:
         return {}
@@ -65,34 +89,232 @@ def _get_slurm_config(cluster_config, slurm_env):
     return {"jobname": slurm_env, **selected}
 
 
-def _with_slurm(cmd, cluster_config):
-    """Wrap the command with slurm/salloc."""
-    if cluster_config:
+def is_dask_managed(cluster_config, slurm_env):
+    """Return True if the jobs of slurm_env are executed with a Dask cluster started in advance."""
+    dask_config = get_slurm_config(cluster_config, slurm_env).get("dask", {})
+    return bool(dask_config.get("managed"))
+
+
+def _with_loop(cmd, loop):
+    """Wrap the command with a shell loop, exporting the variable and stopping at the first failure.
+
+    The exit code is checked on a separate line, because the command may end with a heredoc.
+    """
+    if not loop:
+        return cmd
+    name = loop.split()[0]
+    return f"for {loop}; do\nexport {name} && {cmd}\n[ $? -eq 0 ] || exit 1\ndone"
+
+
+def _with_slurm(cmd, cluster_config, options=None):
+    """Wrap the command with slurm/salloc, binding the tasks to the CPUs if requested.
+
+    If the job has been submitted with sbatch, the command is executed with srun
+    in the existing allocation.
+
+    If a loop is given, the loop is executed in the allocation, with one srun step for each value.
+    """
+    options = options or CommandOptions()
+    if not cluster_config:
+        return _with_loop(cmd, options.loop)
+    srun = ["srun"]
+    if cpu_bind := cluster_config.get("cpu_bind"):
+        srun.append(f"--cpu-bind={cpu_bind}")
+    if options.single_task:
+        # the variable is expanded in the allocation
+        srun.append("--ntasks=1 --cpus-per-task=$SLURM_CPUS_ON_NODE")
+    cmd = _escape_single_quotes(cmd)
+    cmd = f"{' '.join(srun)} sh -c '{cmd}'"
+    cmd = _with_loop(cmd, options.loop)
+    if not cluster_config.get("sbatch"):
+        if options.loop or options.single_task:
+            cmd = f"sh -c '{_escape_single_quotes(cmd)}'"
         jobname = cluster_config["jobname"]
         salloc = cluster_config["salloc"]
-        cmd = _escape_single_quotes(cmd)
-        cmd = f"salloc -J {jobname} {salloc} srun sh -c '{cmd}'"
+        cmd = f"salloc -J {jobname} {salloc} {cmd}"
     return cmd
 
 
+def _parse_memory_mb(value):
+    """Return the memory in MB from a Slurm memory specification, using MB as default unit."""
+    match = re.fullmatch(r"(\d+)([KMGT]?)B?", value.strip(), flags=re.IGNORECASE)
+    if not match:
+        raise ValueError(f"Invalid memory specification: {value}")
+    number, unit = match.groups()
+    return int(number) * SLURM_MEMORY_UNITS[unit.upper()] // SLURM_MEMORY_UNITS["M"]
+
+
+def _parse_salloc(salloc):
+    """Return the resources requested with the given salloc parameters.
+
+    Only the options needed to compute the resources of each task are considered,
+    and the returned dict may contain the keys: mem, mem_per_cpu, ntasks, ntasks_per_node,
+    cpus_per_task, nodes.
+    """
+    result = {}
+    tokens = iter(shlex.split(salloc or ""))
+    for token in tokens:
+        if token.startswith("--") and "=" in token:
+            option, value = token.split("=", 1)
+        elif token in SALLOC_RESOURCES_OPTIONS:
+            option, value = token, next(tokens, "")
+        elif token[:2] in SALLOC_RESOURCES_OPTIONS:
+            option, value = token[:2], token[2:]
+        else:
+            continue
+        if option in SALLOC_RESOURCES_OPTIONS:
+            result[SALLOC_RESOURCES_OPTIONS[option]] = value
+    return result
+
+
+def _get_allocation(cluster_config):
+    """Return the number of nodes, tasks, CPUs per task, and the memory in MB of the allocation.
+
+    The memory is None if it cannot be derived from the salloc parameters.
+    """
+    resources = _parse_salloc(cluster_config.get("salloc"))
+    nodes = int(resources.get("nodes", "1").split("-")[0])
+    ntasks = int(resources.get("ntasks", nodes * int(resources.get("ntasks_per_node", "1"))))
+    cpus_per_task = int(resources.get("cpus_per_task", "1"))
+    mem_mb = None
+    if "mem" in resources:
+        # --mem=0 requests all the memory of the nodes, that is unknown here
+        mem_mb = _parse_memory_mb(resources["mem"]) * nodes or None
+    elif "mem_per_cpu" in resources:
+        mem_mb = _parse_memory_mb(resources["mem_per_cpu"]) * cpus_per_task * ntasks or None
+    return nodes, ntasks, cpus_per_task, mem_mb
+
+
+def _get_task_memory_mb(cluster_config):
+    """Return the memory in MB available to each task of the allocation, or None if unknown.
+
+    The tasks are assumed to be distributed evenly across the allocated nodes.
+    """
+    try:
+        _, ntasks, _, mem_mb = _get_allocation(cluster_config)
+    except ValueError:
+        L.warning("Unable to parse the memory from salloc: %s", cluster_config.get("salloc"))
+        return None
+    return mem_mb // max(ntasks, 1) if mem_mb else None
+
+
+def get_slurm_resources(cluster_config, slurm_env):
+    """Return the resources allocated to the jobs of slurm_env, to be declared in the rules.
+
+    The returned dict may contain the keys: slurm_env, nodes, cpus, mem_mb, and it's empty
+    if the jobs are not executed with Slurm, so that the default resources of Snakemake are used.
+    See https://snakemake.readthedocs.io/en/stable/snakefiles/rules.html#resources
+    """
+    slurm_config = get_slurm_config(cluster_config, slurm_env)
+    if not slurm_config:
+        return {}
+    try:
+        nodes, ntasks, cpus_per_task, mem_mb = _get_allocation(slurm_config)
+    except ValueError:
+        L.warning("Unable to parse the resources from salloc: %s", slurm_config.get("salloc"))
+        return {}
+    resources = {"slurm_env": slurm_env, "nodes": nodes, "cpus": ntasks * cpus_per_task}
+    if mem_mb:
+        resources["mem_mb"] = mem_mb
+    return resources
+
+
+def _get_worker_memory_limit(cluster_config):
+    """Return the memory limit of the Dask workers in managed mode, or None if unknown.
+
+    If not specified, the memory limit of the workers is the memory available to each task.
+    """
+    dask_config = cluster_config.get("dask", {})
+    if not dask_config.get("managed"):
+        return None
+    memory_limit = dask_config.get("memory_limit")
+    if memory_limit is None:
+        task_memory_mb = _get_task_memory_mb(cluster_config)
+        memory_limit = f"{task_memory_mb}MiB" if task_memory_mb else None
+    return memory_limit
+
+
+def _with_dask_cluster(cmd, cluster_config):
+    """Wrap the command to be executed with a Dask cluster started in the Slurm allocation."""
+    if not cluster_config.get("dask", {}).get("managed"):
+        return cmd
+    args = [
+        "python",
+        script_path(DASK_CLUSTER_SCRIPT),
+        "--log-path {log}",
+        f"--memory-limit {_get_worker_memory_limit(cluster_config) or 'auto'}",
+        shlex.quote(cmd),
+    ]
+    return " ".join(map(str, args))
+
+
+def _get_dask_env_vars(cluster_config):
+    """Return the environment variables used to configure the memory of the Dask workers.
+
+    In managed mode, when the memory limit of the workers is known, the workers spill
+    the data to the local disk instead of being restarted when the memory usage is high.
+    The spill policy is not applied to the workers started by the tools with dask-mpi,
+    because their memory limit isn't set by circuit-build.
+    The values in the dask section of the cluster config have higher precedence.
+    """
+    dask_config = cluster_config.get("dask", {})
+    values = {}
+    if _get_worker_memory_limit(cluster_config):
+        values.update(DASK_MEMORY_SPILL_POLICY)
+    values.update({key: dask_config[key] for key in DASK_MEMORY_ENV_VARS if key in dask_config})
+    return {DASK_MEMORY_ENV_VARS[key]: str(value) for key, value in values.items()}
+
+
+def _get_threads_env_vars(cluster_config):
+    """Return the environment variables with the number of threads of each process.
+
+    The variables are set by Snakemake depending on the `threads` declaration of the rule,
+    see https://snakemake.readthedocs.io/en/stable/snakefiles/rules.html#threads
+    but in a Slurm allocation each task should use the CPUs requested with ``--cpus-per-task``,
+    or the CPUs of the node shared between the tasks requested with ``--ntasks-per-node``.
+
+    If the number of threads cannot be derived from the allocation, the variables are None,
+    and they should be unset to let the libraries use the CPUs assigned to each task.
+    """
+    if not cluster_config:
+        threads = "{threads}"
+    else:
+        resources = _parse_salloc(cluster_config.get("salloc"))
+        if "cpus_per_task" in resources:
+            threads = resources["cpus_per_task"]
+        elif "ntasks_per_node" in resources:
+            # the number of CPUs of each node is known only in the allocation
+            threads = f"$(( SLURM_CPUS_ON_NODE / {int(resources['ntasks_per_node'])} ))"
+        else:
+            threads = None
+    env_vars = dict.fromkeys(THREADS_ENV_VARS, threads)
+    if cluster_config.get("cpu_bind"):
+        # bind also the threads of each task to the cores assigned by Slurm
+        env_vars.update(OMP_BIND_ENV_VARS)
+    return env_vars
+
+
 def _with_env_vars(cmd, env_config, cluster_config):
     """Wrap the command with exporting the environment variables if needed."""
     env_vars = {
+        **_get_threads_env_vars(cluster_config),
         **env_config.get("env_vars", {}),
+        **_get_dask_env_vars(cluster_config),
         **cluster_config.get("env_vars", {}),
     }
-    if env_vars:
-        variables = " ".join(f"{k}={v}" for k, v in env_vars.items())
+    if variables := " ".join(f"{k}={v}" for k, v in env_vars.items() if v is not None):
         cmd = f"export {variables} && {cmd}"
+    if unset := " ".join(k for k, v in env_vars.items() if v is None):
+        cmd = f"unset {unset} && {cmd}"
     return cmd
 
 
-def build_module_cmd(cmd, env_config, cluster_config):
+def build_module_cmd(cmd, env_config, cluster_config, options=None):
     """Wrap the command with modules."""
     modulepath = env_config.get("modulepath", SPACK_MODULEPATH)
     modules = env_config["modules"]
     cmd = _with_env_vars(cmd, env_config, cluster_config)
-    cmd = _with_slurm(cmd, cluster_config)
+    cmd = _with_slurm(cmd, cluster_config, options)
     return " && ".join(
         [
             ". /etc/profile.d/modules.sh",
@@ -106,17 +328,17 @@ def build_module_cmd(cmd, env_config, cluster_config):
     )
 
 
-def build_apptainer_cmd(cmd, env_config, cluster_config):
+def build_apptainer_cmd(cmd, env_config, cluster_config, options=None):
     """Wrap the command with apptainer/singularity."""
     modulepath = env_config.get("modulepath", APPTAINER_MODULEPATH)
     modules = env_config.get("modules", APPTAINER_MODULES)
-    options = env_config.get("options", APPTAINER_OPTIONS)
+    apptainer_options = env_config.get("options", APPTAINER_OPTIONS)
     executable = env_config.get("executable", APPTAINER_EXECUTABLE)
     image = Path(APPTAINER_IMAGEPATH, env_config["image"])
     # the current working directory is used also inside the container
-    cmd = f'{executable} exec {options} {image} bash <<EOF\ncd "$(pwd)" && {cmd}\nEOF\n'
+    cmd = f'{executable} exec {apptainer_options} {image} bash <<EOF\ncd "$(pwd)" && {cmd}\nEOF\n'
     cmd = _with_env_vars(cmd, env_config, cluster_config)
-    cmd = _with_slurm(cmd, cluster_config)
+    cmd = _with_slurm(cmd, cluster_config, options)
     cmd = " && ".join(
         [
             ". /etc/profile.d/modules.sh",
@@ -130,12 +352,12 @@ def build_apptainer_cmd(cmd, env_config, cluster_config):
     return cmd
 
 
-def build_venv_cmd(cmd, env_config, cluster_config):
+def build_venv_cmd(cmd, env_config, cluster_config, options=None):
     """Wrap the command with an existing virtual environment, or source a custom file."""
     source = _get_source_file(env_config["path"])
     cmd = f". {source} && {cmd}"
     cmd = _with_env_vars(cmd, env_config, cluster_config)
-    cmd = _with_slurm(cmd, cluster_config)
+    cmd = _with_slurm(cmd, cluster_config, options)
     modulepath = env_config.get("modulepath", SPACK_MODULEPATH)
     modules = env_config.get("modules")
     if modules:
@@ -153,7 +375,7 @@ def build_venv_cmd(cmd, env_config, cluster_config):
     return cmd
 
 
-def build_command(cmd, env_config, env_name, cluster_config, slurm_env=None):
+def build_command(cmd, env_config, env_name, cluster_config, slurm_env=None, options=None):
     """Wrap and return the command string to be executed.
 
     Args:
@@ -161,22 +383,40 @@ def build_command(cmd, env_config, env_name, cluster_config, slurm_env=None):
         env_config (dict): environment configuration.
         env_name (str): key in env_config.
         cluster_config (dict): cluster configuration.
-        slurm_env (str): key in cluster_config.
+        slurm_env (str): key in cluster_config. If the ``dask`` section of the selected
+            configuration enables the managed mode, the command is executed with a Dask
+            cluster started in the Slurm allocation.
+        options (CommandOptions): optional commands executed before and after cmd,
+            the condition and the loop to execute cmd, and how the Slurm allocation is obtained.
     """
+    options = options or CommandOptions()
     selected_env_config = env_config[env_name]
-    selected_cluster_config = _get_slurm_config(cluster_config, slurm_env)
+    selected_cluster_config = get_slurm_config(cluster_config, slurm_env)
+    if options.sbatch and selected_cluster_config:
+        selected_cluster_config["sbatch"] = True
     func = {
         ENV_TYPE_MODULE: build_module_cmd,
         ENV_TYPE_APPTAINER: build_apptainer_cmd,
         ENV_TYPE_VENV: build_venv_cmd,
     }[selected_env_config["env_type"]]
-    cmd = " ".join(map(str, cmd))
-    cmd = func(
-        cmd=cmd,
-        env_config=selected_env_config,
-        cluster_config=selected_cluster_config,
-    )
-    cmd = _unset_threads_vars(cmd)
+    cmds = {
+        key: func(
+            cmd=_with_dask_cluster(" ".join(map(str, c)), cc),
+            env_config=selected_env_config,
+            cluster_config=cc,
+            options=o,
+        )
+        for key, c, cc, o in [
+            ("pre", options.pre_cmd, {}, None),
+            ("main", cmd, selected_cluster_config, options),
+            ("post", options.post_cmd, {}, None),
+        ]
+        if c is not None
+    }
+    if options.condition:
+        # the condition is tested before requesting the allocation
+        cmds["main"] = f"if {options.condition}; then\n{cmds['main']}\nfi"
+    cmd = " && ".join(cmds.values())
     cmd = redirect_to_file(cmd)
     return cmd
 
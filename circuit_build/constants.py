@@ -2,6 +2,7 @@
 
 PACKAGE_NAME = "circuit_build"
 SCHEMAS_DIR = "snakemake/schemas"
+SCRIPTS_DIR = "snakemake/scripts"
 
 INDEX_SUCCESS_FILE = "meta_data.json"
 SPACK_MODULEPATH = "/gpfs/bbp.cscs.ch/ssd/apps/bsd/modules/_meta"
@@ -40,6 +41,80 @@ ENV_VARS_DASK_DEFAULT = {
     "DASK_DISTRIBUTED__COMM__TIMEOUTS__CONNECT": "200000ms",  # Time for handshake
 }
 
+# local disk of the compute node where the astrocyte morphologies are staged before finalization
+DEFAULT_STAGING_DIR = "${TMPDIR:-/tmp}"
+
+# variables used to set the number of threads of each process
+THREADS_ENV_VARS = [
+    "GOTO_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+]
+# variables used to bind the OpenMP threads when the Slurm tasks are bound to the CPUs
+OMP_BIND_ENV_VARS = {
+    "OMP_PROC_BIND": "close",
+    "OMP_PLACES": "cores",
+}
+# memory settings of the workers that can be defined in the dask section of the cluster config
+DASK_MEMORY_ENV_VARS = {
+    "memory_target": "DASK_DISTRIBUTED__WORKER__MEMORY__TARGET",
+    "memory_spill": "DASK_DISTRIBUTED__WORKER__MEMORY__SPILL",
+    "memory_pause": "DASK_DISTRIBUTED__WORKER__MEMORY__PAUSE",
+    "memory_terminate": "DASK_DISTRIBUTED__WORKER__MEMORY__TERMINATE",
+}
+DASK_CLUSTER_SCRIPT = "dask_cluster.py"
+# memory settings used when the memory of the workers is known, to spill to the local disk
+DASK_MEMORY_SPILL_POLICY = {
+    "memory_target": 0.60,
+    "memory_spill": 0.70,
+    "memory_pause": 0.85,
+    "memory_terminate": 0.95,
+}
+# salloc options used to compute the resources of each task
+SALLOC_RESOURCES_OPTIONS = {
+    "--mem": "mem",
+    "--mem-per-cpu": "mem_per_cpu",
+    "-n": "ntasks",
+    "--ntasks": "ntasks",
+    "--ntasks-per-node": "ntasks_per_node",
+    "-c": "cpus_per_task",
+    "--cpus-per-task": "cpus_per_task",
+    "-N": "nodes",
+    "--nodes": "nodes",
+}
+# multipliers of the units accepted by Slurm for the memory, in bytes
+SLURM_MEMORY_UNITS = {"K": 1 << 10, "M": 1 << 20, "": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+# states of the jobs submitted with sbatch that aren't completed yet, including the jobs requeued
+# by Slurm, see https://slurm.schedmd.com/sacct.html#SECTION_JOB-STATE-CODES
+# The other states, like PREEMPTED or NODE_FAIL, are considered failures and the jobs are retried.
+SLURM_RUNNING_STATES = {
+    "CONFIGURING",
+    "COMPLETING",
+    "PENDING",
+    "REQUEUED",
+    "REQUEUE_FED",
+    "REQUEUE_HOLD",
+    "RESIZING",
+    "RUNNING",
+    "SIGNALING",
+    "STAGE_OUT",
+    "SUSPENDED",
+}
+SLURM_SUCCESS_STATES = {"COMPLETED"}
+# key of the cluster config defining the groups of rules executed in the same sbatch allocation
+CLUSTER_CONFIG_GROUPS = "__groups__"
+# default options of the Snakemake profile used to submit the jobs with sbatch
+SBATCH_PROFILE_OPTIONS = {
+    "jobs": 500,
+    "retries": 2,
+    "latency-wait": 60,
+    "max-jobs-per-second": 5,
+    "max-status-checks-per-second": 1,
+}
+
 ENV_CONFIG = {
     "brainbuilder": {
         "env_type": ENV_TYPE_MODULE,
@@ -156,3 +231,19 @@ SPYKFUNC_RULES = {
         ],
     },
 }
+
+# Sections of the recipe used by each rule, used to decide which rules should be executed again
+# when the recipe is modified. If None, all the sections of the recipe are considered.
+RECIPE_SECTIONS = {
+    "touchdetector": [
+        "InterBoutonInterval",
+        "NeuronTypes",
+        "SpineLengths",
+        "TouchRules",
+    ],
+    "spykfunc_s2s": [
+        "InitialBoutonDistance",
+        "TouchRules",
+    ],
+    "spykfunc_s2f": None,
+}
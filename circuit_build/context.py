@@ -1,16 +1,36 @@
 """Context used in Snakefile."""
 
+import importlib.util
 import logging
 import os.path
 import subprocess
 from copy import deepcopy
+from dataclasses import replace
 from datetime import datetime
+from functools import cached_property
 from pathlib import Path
 from typing import Dict
 
-from circuit_build.commands import build_command, load_legacy_env_config
-from circuit_build.constants import ENV_CONFIG, ENV_FILE, INDEX_SUCCESS_FILE, SPYKFUNC_RULES
-from circuit_build.ngv import stage_ngv_base_circuit
+from circuit_build.artifact_cache import artifact_key_prefix, build_artifact_cache_cmd
+from circuit_build.commands import (
+    CommandOptions,
+    build_command,
+    get_slurm_config,
+    get_slurm_resources,
+    is_dask_managed,
+    load_legacy_env_config,
+)
+from circuit_build.constants import (
+    DEFAULT_STAGING_DIR,
+    ENV_CONFIG,
+    ENV_FILE,
+    INDEX_SUCCESS_FILE,
+    RECIPE_SECTIONS,
+    SPYKFUNC_RULES,
+)
+from circuit_build.ngv import STAGING_MANIFEST_FILE, gmsh_refine_script, stage_ngv_base_circuit
+from circuit_build.recipe import recipe_digest, recipe_sections_digests
+from circuit_build.sbatch import get_rule_groups
 from circuit_build.sonata_config import write_config
 from circuit_build.utils import dump_yaml, env_true, load_yaml, redirect_to_file
 from circuit_build.validators import (
@@ -123,6 +143,10 @@ class CircuitPaths:
         """Return nodes population morphology dir."""
         return self.morphologies_dir / population_name
 
+    def nodes_population_morphologies_container(self, population_name):
+        """Return nodes population merged morphology container."""
+        return self.morphologies_dir / f"{population_name}.h5"
+
     def edges_population_connectome_path(self, population_name, path):
         """Return edges population connectome dir."""
         return self.connectome_dir / population_name / path
@@ -132,6 +156,110 @@ class CircuitPaths:
         return self.edges_population_connectome_path(population_name, "touches")
 
 
+class NGVOptions:
+    """Options and paths of the NGV phases that are split, cached or packed.
+
+    They are accessed from the context as ``ctx.ngv``.
+    """
+
+    def __init__(self, context):
+        """Initialize the object."""
+        self._context = context
+        self.conf = context.conf
+        self.paths = context.paths
+
+    @property
+    def artifact_cache_dir(self):
+        """Return the artifact cache used by the NGV phases that are always cached.
+
+        It's the artifact cache given in the command line if specified, or a directory in the
+        auxiliary directory otherwise, so that the outputs are reused at least by the reruns.
+        """
+        return self.conf.get("artifact_cache") or self.paths.auxiliary_path("artifact_cache")
+
+    @property
+    def neuroglial_synapse_attributes(self):
+        """Return the attributes of the neuronal synapses needed by the neuroglial connectivity."""
+        return self.conf.get(["ngv", "neuroglial_connectivity", "synapse_attributes"])
+
+    @property
+    def synthesis_shards(self):
+        """Return the number of shards used to synthesize the astrocytes."""
+        return self.conf.get(["ngv", "synthesis", "shards"], default=1)
+
+    @property
+    def synthesis_container(self):
+        """Return True if the astrocytic morphologies are packed in a merged container."""
+        return bool(self.conf.get(["ngv", "synthesis", "container"], default=False))
+
+    @property
+    def astrocytes_morphologies_container_file(self):
+        """Return path to the merged container of the astrocytic morphologies."""
+        return self.paths.nodes_population_morphologies_container(
+            self._context.nodes_astrocytes_name
+        )
+
+    @property
+    def astrocytes_morphologies_h5v1(self):
+        """Return the astrocytic morphologies in h5v1 format, as a container or a directory."""
+        if self.synthesis_container:
+            return self.astrocytes_morphologies_container_file
+        return self._context.nodes_astrocytes_morphologies_dir
+
+    @property
+    def endfeet_tiles(self):
+        """Return the number of tiles used to build the endfeet surface meshes."""
+        return self.conf.get(["ngv", "endfeet_surface_meshes", "tiles"], default=1)
+
+    @property
+    def endfeet_growth_radius(self):
+        """Return the maximum radius of growth of the endfeet."""
+        return self.conf.get(["ngv", "endfeet_surface_meshes", "fmm_cutoff_radius"])
+
+    @property
+    def endfeet_tiles_halo(self):
+        """Return the width of the halo around each tile of endfeet.
+
+        It defaults to twice the maximum radius of growth, so that all the endfeet
+        that can reach the surface reached by the endfeet of the tile are included.
+        """
+        halo = self.conf.get(["ngv", "endfeet_surface_meshes", "halo"])
+        if halo is None:
+            halo = 2 * self.endfeet_growth_radius
+        return halo
+
+    @property
+    def finalization_merged(self):
+        """Return True if the gliovascular and neuroglial connectivity are finalized in one job."""
+        return bool(self.conf.get(["ngv", "finalize_connectivity", "merged"], default=False))
+
+    @property
+    def finalization_staging_dir(self):
+        """Return the directory where the morphologies are staged, or None if disabled."""
+        keys = ["ngv", "finalize_connectivity", "staging_dir"]
+        return self.conf.get(keys, default=DEFAULT_STAGING_DIR) or None
+
+    @property
+    def glialglial_shards(self):
+        """Return the number of shards used to build the glial-glial connectivity."""
+        return self.conf.get(["ngv", "glialglial_connectivity", "shards"], default=1)
+
+    @property
+    def refine_tetrahedral_gmsh_script_file(self):
+        """Return the path to the gmsh script used to refine the tet mesh."""
+        return self.paths.auxiliary_path("ngv_refine_tetrahedral_mesh.geo")
+
+    def write_refine_tetrahedral_script(self, output_file):
+        """Write the gmsh script used to refine the tetrahedral mesh."""
+        output_file.write(
+            gmsh_refine_script(
+                input_mesh=self._context.tetrahedral_mesh_file,
+                output_mesh=self._context.refined_tetrahedral_mesh_file,
+                steps=self._context.refinement_subdividing_steps,
+            )
+        )
+
+
 class Context:
     """Context class."""
 
@@ -153,6 +281,7 @@ class Context:
 
         self.conf = Config(config=config)
         self.cluster_config = cluster_config
+        self.ngv = NGVOptions(self)
 
         self.BUILDER_RECIPE = self.paths.bioname_path("builderRecipeAllPathways.xml")
         self.MORPHDB = self.paths.bioname_path("extNeuronDB.dat")
@@ -216,7 +345,11 @@ class Context:
         # missing rules if needed by the ngv dag.
         if self.is_ngv_standalone():
             base_circuit_config = self.conf.get(["ngv", "common", "base_circuit"])
-            stage_ngv_base_circuit(base_circuit_config, context=self)
+            stage_ngv_base_circuit(
+                base_circuit_config,
+                context=self,
+                manifest_file=self.paths.auxiliary_path(STAGING_MANIFEST_FILE),
+            )
 
         self.spine_morphologies_dir = self.conf.get(["common", "spine_morphologies_dir"])
 
@@ -388,6 +521,75 @@ class Context:
             population_name=self.edges_astrocytes_vasculature_name
         )
 
+    @property
+    def synthesis_shards(self):
+        """Return the number of shards used to synthesize the morphologies."""
+        return self.conf.get(["synthesize_morphologies", "shards"], default=1)
+
+    @property
+    def synthesis_container(self):
+        """Return True if the synthesized morphologies are packed in a merged container."""
+        return bool(
+            self.SYNTHESIZE
+            and self.conf.get(["synthesize_morphologies", "container"], default=False)
+        )
+
+    @property
+    def synthesized_morphologies_container_file(self):
+        """Return path to the merged container of the synthesized morphologies."""
+        return self.paths.nodes_population_morphologies_container(self.nodes_neurons_name)
+
+    @property
+    def neurons_morphologies_h5v1(self):
+        """Return the neuronal morphologies in h5v1 format, as a container or a directory."""
+        if self.synthesis_container:
+            return self.synthesized_morphologies_container_file
+        return self.if_synthesis(self.SYNTHESIZE_MORPH_DIR, Path(self.MORPH_RELEASE, "h5v1"))
+
+    @property
+    def neuroglial_synapses_file(self):
+        """Return the neuronal synapses file read by the neuroglial connectivity phases.
+
+        It's the compact copy of the functional edges if the synapse attributes are defined,
+        or the functional edges otherwise.
+        """
+        if self.ngv.neuroglial_synapse_attributes:
+            return self.paths.auxiliary_path("ngv_neuronal_synapses.h5")
+        return self.edges_neurons_neurons_file(connectome_type="functional")
+
+    def dask_managed(self, slurm_env):
+        """Return True if the Dask cluster is started by circuit-build for the given slurm_env."""
+        return is_dask_managed(self.cluster_config, slurm_env)
+
+    @property
+    def sbatch(self):
+        """Return True if the jobs are submitted with sbatch, using the profile written by the CLI.
+
+        This happens when snakemake is invoked with `--config sbatch=1`.
+        """
+        return bool(self.conf.get("sbatch"))
+
+    @property
+    def rule_groups(self):
+        """Return the dict mapping the grouped rules to their group in the cluster config."""
+        return get_rule_groups(self.cluster_config)
+
+    def slurm_resources(self, slurm_env):
+        """Return the resources allocated to the jobs of slurm_env, as Snakemake resources."""
+        return get_slurm_resources(self.cluster_config, slurm_env)
+
+    def local_threads(self, slurm_env, cores):
+        """Return the threads of the jobs of slurm_env, used when executed without Slurm.
+
+        The jobs executed in a Slurm allocation use the CPUs requested in salloc,
+        so they don't reserve the local cores while waiting for the allocation.
+        """
+        return 1 if get_slurm_config(self.cluster_config, slurm_env) else cores
+
+    def emodel_chunks(self, rule):
+        """Return the number of chunks used to execute the given emodel rule."""
+        return self.conf.get([rule, "chunks"], default=1)
+
     @property
     def refinement_subdividing_steps(self):
         """Return the refinement_subdividing_steps from config file if exist.
@@ -455,6 +657,18 @@ class Context:
             or env_true("CIRCUIT_BUILD_SKIP_GIT_CHECK")
         )
 
+    def in_process(self, module_name):
+        """Return True if the rules using ``module_name`` can be executed in the Snakemake process.
+
+        This happens when the module can be imported, unless the env variable
+        CIRCUIT_BUILD_SKIP_IN_PROCESS is set to 'true', to load the environment of the rules
+        instead.
+        """
+        return (
+            not env_true("CIRCUIT_BUILD_SKIP_IN_PROCESS")
+            and importlib.util.find_spec(module_name) is not None
+        )
+
     def if_synthesis(self, true_value, false_value):
         """Return ``true_value`` if synthesis is enabled, else ``false_value``."""
         return true_value if self.SYNTHESIZE else false_value
@@ -548,15 +762,35 @@ class Context:
         """Write the environment configuration into the log directory."""
         dump_yaml(self.log_path("environments"), data=self.ENV_CONFIG)
 
-    def bbp_env(self, module_env, command, slurm_env=None):
-        """Wrap and return the command string to be executed."""
-        return build_command(
+    def bbp_env(self, module_env, command, slurm_env=None, cache=None, options=None):
+        """Wrap and return the command string to be executed.
+
+        The optional ``options`` define the commands executed before and after the command
+        in the same environment, but outside of the Slurm allocation.
+
+        If ``cache`` is given and the artifact cache is enabled, the outputs are linked
+        from the cache when they have been already built with the same command, environment
+        and content of the cache inputs, and stored in the cache otherwise.
+        The artifact cache given in the command line is used, unless the cache directory
+        is specified in ``cache``.
+        """
+        cmd = build_command(
             cmd=command,
             env_config=self.ENV_CONFIG,
             env_name=module_env,
             cluster_config=self.cluster_config,
             slurm_env=slurm_env,
+            options=replace(options or CommandOptions(), sbatch=self.sbatch),
         )
+        cache_dir = cache and (cache.cache_dir or self.conf.get("artifact_cache"))
+        if cache_dir:
+            key_prefix = artifact_key_prefix(
+                command, env_config=self.ENV_CONFIG[module_env], inputs=cache.inputs
+            )
+            cmd = build_artifact_cache_cmd(
+                cmd, cache_dir=cache_dir, key_prefix=key_prefix, inputs=cache.inputs
+            )
+        return cmd
 
     def write_network_config(
         self, connectome_dir, output_file, nodes_file=None, is_partial_config=False
@@ -565,7 +799,7 @@ class Context:
         morphologies_entry = self.if_synthesis(
             {
                 "alternate_morphologies": {
-                    "h5v1": self.SYNTHESIZE_MORPH_DIR,
+                    "h5v1": self.neurons_morphologies_h5v1,
                     "neurolucida-asc": self.SYNTHESIZE_MORPH_DIR,
                 }
             },
@@ -653,10 +887,7 @@ class Context:
                     "population_name": self.nodes_neurons_name,
                     "spatial_segment_index_dir": self.nodes_spatial_index_dir,
                     "alternate_morphologies": {
-                        "h5v1": self.if_synthesis(
-                            self.paths.nodes_population_morphologies_dir(self.nodes_neurons_name),
-                            Path(self.MORPH_RELEASE, "h5v1"),
-                        ),
+                        "h5v1": self.neurons_morphologies_h5v1,
                         "neurolucida-asc": self.if_synthesis(
                             self.paths.nodes_population_morphologies_dir(self.nodes_neurons_name),
                             Path(self.MORPH_RELEASE, "ascii"),
@@ -669,7 +900,7 @@ class Context:
                     "nodes_file": self.nodes_astrocytes_file,
                     "population_type": "astrocyte",
                     "population_name": self.nodes_astrocytes_name,
-                    "morphologies_dir": self.nodes_astrocytes_morphologies_dir,
+                    "morphologies_dir": self.ngv.astrocytes_morphologies_h5v1,
                     "microdomains_file": self.nodes_astrocytes_microdomains_file,
                     **self.provenance(),
                 },
@@ -690,6 +921,18 @@ class Context:
             node_sets_file=self.NODESETS_FILE,
         )
 
+    @cached_property
+    def _recipe_sections_digests(self):
+        return recipe_sections_digests(self.BUILDER_RECIPE)
+
+    def recipe_digest(self, rule):
+        """Return the digest of the recipe sections used by the given rule.
+
+        The digest can be used as a parameter of the rule, so that the rule is executed again only
+        when the relevant sections of the recipe are modified (Snakemake ``params`` rerun trigger).
+        """
+        return recipe_digest(self._recipe_sections_digests, sections=RECIPE_SECTIONS[rule])
+
     def run_spykfunc(self, rule):
         """Return the spykfunc command as a string."""
         if rule in SPYKFUNC_RULES:
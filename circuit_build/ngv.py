@@ -1,14 +1,23 @@
 """Utilities specific to the NGV building."""
 
+import hashlib
+import json
 import logging
 import os
+import re
+import shutil
 from dataclasses import dataclass
 from pathlib import Path
 
-from bluepysnap.circuit import CircuitConfig
-
 L = logging.getLogger(__name__)
 
+# manifest of the staged base circuit, written in the auxiliary directory
+STAGING_MANIFEST_FILE = "ngv_base_circuit_staging.json"
+# attributes of the astrocytes used to build the microdomains
+MICRODOMAINS_KEY_ATTRIBUTES = ["x", "y", "z", "radius"]
+# name of the files written by each rank of touchdetector, e.g. touchesData.3.bin
+_TOUCHES_RANK_FILE = re.compile(r"^[^.]+\.(\d+)(\..*)?$")
+
 
 class BaseConfigKeys:
     """NGV Base config keys."""
@@ -43,23 +52,180 @@ class _BaseCircuitComponents:
     segment_index_dir: Path | None
 
 
-def stage_ngv_base_circuit(base_circuit_config, context):
-    """Stage base circuit for ngv standalone."""
-    comps = _get_components(base_circuit_config, parent_dir=context.paths.bioname_dir)
+def stage_ngv_base_circuit(base_circuit_config, context, manifest_file=None):
+    """Stage base circuit for ngv standalone.
 
-    _stage_path(source=comps.nodes_file, target=context.nodes_neurons_file)
-    _stage_path(source=comps.hoc_dir, target=context.EMODEL_RELEASE_HOC)
-    _stage_path(source=comps.morphologies_dir, target=context.SYNTHESIZE_MORPH_DIR)
-    _stage_path(source=comps.edges_file, target=context.edges_neurons_neurons_file("functional"))
+    If ``manifest_file`` is given, the staged links are recorded in the manifest, and the base
+    circuit is staged again only when the links or the sources differ from the manifest, so that
+    the base circuit doesn't need to be opened again by each Snakemake process.
+    """
+    config_path = _get_config_path(base_circuit_config, parent_dir=context.paths.bioname_dir)
+    if manifest_file and _is_staged(manifest_file, base_circuit_config, config_path):
+        L.debug("Base circuit already staged according to %s", manifest_file)
+        return
 
+    comps = _get_components(base_circuit_config, parent_dir=context.paths.bioname_dir)
+    links = [
+        (comps.nodes_file, context.nodes_neurons_file),
+        (comps.hoc_dir, context.EMODEL_RELEASE_HOC),
+        (comps.morphologies_dir, context.SYNTHESIZE_MORPH_DIR),
+        (comps.edges_file, context.edges_neurons_neurons_file("functional")),
+    ]
     if comps.synapse_index_dir:
-        _stage_path(source=comps.synapse_index_dir, target=context.edges_spatial_index_dir)
-
+        links.append((comps.synapse_index_dir, context.edges_spatial_index_dir))
     if comps.segment_index_dir:
-        _stage_path(source=comps.segment_index_dir, target=context.nodes_spatial_index_dir)
+        links.append((comps.segment_index_dir, context.nodes_spatial_index_dir))
+
+    for source, target in links:
+        _stage_path(source=source, target=target)
+
+    if manifest_file:
+        _write_staging_manifest(manifest_file, base_circuit_config, config_path, links)
+
+
+def gmsh_refine_script(input_mesh, output_mesh, steps):
+    """Return the gmsh script refining the tetrahedral mesh in a single gmsh session.
+
+    At each step every edge is split in two sub-edges, and the CPU time, the memory and the number
+    of tetrahedra are printed, while the refined mesh is written only once at the end.
+    """
+    lines = [
+        f'Merge "{Path(input_mesh).absolute()}";',
+        'Printf("Initial mesh: %g Mb, %g tetrahedra", Memory, Mesh.NbTetrahedra);',
+    ]
+    for step in range(1, steps + 1):
+        lines += [
+            "start = Cpu;",
+            "RefineMesh;",
+            f'Printf("Refinement step {step}/{steps}: %g s, %g Mb, %g tetrahedra", '
+            "Cpu - start, Memory, Mesh.NbTetrahedra);",
+        ]
+    lines.append(f'Save "{Path(output_mesh).absolute()}";')
+    return "\n".join(lines) + "\n"
+
+
+def split_touches_dir(touches_dir, out_dirs):
+    """Split the files written by touchdetector in shards, linking them in the output directories.
+
+    The files written by each rank of touchdetector are linked in the subdirectory ``<rank>`` of
+    one shard, distributing the ranks in round-robin, while the other files (e.g. the metadata)
+    are linked in all the subdirectories, so that the touches of each rank can be read separately.
+    """
+    rank_paths = {}
+    common_paths = []
+    for path in sorted(Path(touches_dir).iterdir()):
+        if match := _TOUCHES_RANK_FILE.match(path.name):
+            rank_paths.setdefault(int(match.group(1)), []).append(path)
+        else:
+            common_paths.append(path)
+    for out_dir in out_dirs:
+        Path(out_dir).mkdir(parents=True, exist_ok=True)
+    for rank, paths in rank_paths.items():
+        rank_dir = Path(out_dirs[rank % len(out_dirs)], str(rank))
+        rank_dir.mkdir()
+        for path in paths + common_paths:
+            os.symlink(path.resolve(), rank_dir / path.name)
+
+
+def merge_morphology_dirs(shard_dirs, out_dir):
+    """Merge the morphologies synthesized in shards, linking them in the output directory.
+
+    Hard links are used when possible, so that the shards are kept without using more space,
+    and the morphologies are copied otherwise.
+    """
+    Path(out_dir).mkdir(parents=True, exist_ok=True)
+    for shard_dir in shard_dirs:
+        for path in sorted(Path(shard_dir).iterdir()):
+            target = Path(out_dir, path.name)
+            if target.exists():
+                raise RuntimeError(f"Morphology {path.name} found in more than one shard")
+            try:
+                os.link(path, target)
+            except OSError:
+                shutil.copy2(path, target)
+
+
+def write_microdomains_key(astrocytes_file, config, out_file):
+    """Write the key of the microdomains, depending only on the data used by the tessellation.
+
+    The key contains the digests of the positions and radii of the astrocytes, and the
+    configuration of the microdomains, so that it's unchanged when other attributes change.
+    """
+    # pylint: disable=import-outside-toplevel
+    import libsonata
+
+    storage = libsonata.NodeStorage(str(astrocytes_file))
+    (population_name,) = storage.population_names
+    population = storage.open_population(population_name)
+    selection = libsonata.Selection([[0, population.size]])
+    key = {"population_name": population_name, "size": population.size, "config": config}
+    for name in MICRODOMAINS_KEY_ATTRIBUTES:
+        values = population.get_attribute(name, selection)
+        key[name] = hashlib.sha256(values.tobytes()).hexdigest()
+    Path(out_file).write_text(json.dumps(key, indent=2, sort_keys=True), encoding="utf-8")
+
+
+def _get_config_path(base_config, parent_dir=None):
+    """Return the path to the circuit config of the base circuit, if defined."""
+    if BaseConfigKeys.CONFIG not in base_config:
+        return None
+    config = base_config[BaseConfigKeys.CONFIG]
+    if parent_dir:
+        config = Path(parent_dir).expanduser().resolve() / config
+    return Path(config).resolve()
+
+
+def _file_digest(path):
+    """Return the hex digest of the content of the given file."""
+    return hashlib.sha256(Path(path).read_bytes()).hexdigest()
+
+
+def _stat_entry(source, target):
+    """Return the entry of the staging manifest corresponding to the given link."""
+    stat = Path(source).stat()
+    return {
+        "source": str(source),
+        "target": str(target),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+    }
+
+
+def _write_staging_manifest(manifest_file, base_config, config_path, links):
+    """Write the manifest containing the staged links, and the size and mtime of their sources."""
+    manifest = {
+        "base_circuit": base_config,
+        "config_digest": _file_digest(config_path),
+        "links": [_stat_entry(source, target) for source, target in links],
+    }
+    manifest_file = Path(manifest_file)
+    manifest_file.parent.mkdir(parents=True, exist_ok=True)
+    manifest_file.write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+
+
+def _is_staged(manifest_file, base_config, config_path):
+    """Return True if the links and their sources are consistent with the staging manifest."""
+    try:
+        manifest = json.loads(Path(manifest_file).read_text(encoding="utf-8"))
+        config_digest = _file_digest(config_path)
+        if manifest["base_circuit"] != base_config or manifest["config_digest"] != config_digest:
+            return False
+        for entry in manifest["links"]:
+            if os.readlink(entry["target"]) != entry["source"]:
+                return False
+            if _stat_entry(entry["source"], entry["target"]) != entry:
+                return False
+    except (OSError, TypeError, ValueError, KeyError) as e:
+        L.debug("Base circuit to be staged: %s", e)
+        return False
+    return True
 
 
 def _get_base_populations(base_config, parent_dir=None):
+    # bluepysnap is imported only when the base circuit needs to be staged
+    # pylint: disable=import-outside-toplevel
+    from bluepysnap.circuit import CircuitConfig
+
     try:
         node_population_name = base_config[BaseConfigKeys.NODE_POPULATION_NAME]
         edge_population_name = base_config[BaseConfigKeys.EDGE_POPULATION_NAME]
@@ -0,0 +1,198 @@
+"""Provenance database used to decide the jobs to be executed from the content of the files.
+
+Snakemake decides if a job should be executed again comparing the modification times of the
+input and output files, and these may change when the files are restored from git or copied.
+
+After each execution, the provenance database keeps track of the digests of the input and
+output files of each job. The changes of the parameters and of the commands are not tracked here,
+since they are already detected by the rerun triggers of Snakemake, that don't depend on the
+modification times.
+
+Before each execution, the modification times of the outputs are restored when the content
+of the files is unchanged, so that Snakemake does not consider them as outdated.
+"""
+
+import hashlib
+import json
+import logging
+import os
+from base64 import urlsafe_b64decode
+from pathlib import Path
+
+L = logging.getLogger(__name__)
+
+PROVENANCE_FILE = "logs/provenance.json"
+METADATA_DIR = ".snakemake/metadata"
+# timestamp file written by Snakemake in the directories declared as output
+SNAKEMAKE_TIMESTAMP = ".snakemake_timestamp"
+CHUNK_SIZE = 1 << 20
+
+
+def _file_digest(path, cache):
+    """Return the digest of a file, using the cached value if size and mtime are unchanged."""
+    stat = os.stat(path)
+    key = str(path)
+    cached = cache.get(key)
+    if cached and cached["size"] == stat.st_size and cached["mtime_ns"] == stat.st_mtime_ns:
+        return cached["digest"]
+    h = hashlib.sha256()
+    with open(path, "rb") as fd:
+        while chunk := fd.read(CHUNK_SIZE):
+            h.update(chunk)
+    digest = h.hexdigest()
+    cache[key] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "digest": digest}
+    return digest
+
+
+def file_digest(path, cache=None):
+    """Return the digest of the content of a file or directory, or None if it doesn't exist.
+
+    The digest of a directory is computed from the relative paths and the digests
+    of the files in the directory, ignoring the timestamp files written by Snakemake.
+
+    Args:
+        path: path to the file or directory.
+        cache: optional dict used to cache the digests of the files.
+    """
+    path = Path(path)
+    cache = {} if cache is None else cache
+    if path.is_file():
+        return _file_digest(path, cache)
+    if path.is_dir():
+        h = hashlib.sha256()
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                if name == SNAKEMAKE_TIMESTAMP:
+                    continue
+                filepath = Path(root, name)
+                h.update(f"{filepath.relative_to(path)}:{_file_digest(filepath, cache)};".encode())
+        return h.hexdigest()
+    return None
+
+
+def _mtime(path):
+    """Return the modification time of the path as considered by Snakemake."""
+    path = Path(path)
+    timestamp = path / SNAKEMAKE_TIMESTAMP
+    if path.is_dir() and timestamp.exists():
+        return timestamp.stat().st_mtime
+    return path.stat().st_mtime
+
+
+def _set_mtime(path, mtime):
+    path = Path(path)
+    os.utime(path, (mtime, mtime), follow_symlinks=False)
+    timestamp = path / SNAKEMAKE_TIMESTAMP
+    if path.is_dir() and timestamp.exists():
+        os.utime(timestamp, (mtime, mtime))
+
+
+def _decode_key(metadata_dir, metadata_file):
+    """Return the output path corresponding to the given Snakemake metadata file."""
+    parts = metadata_file.relative_to(metadata_dir).parts
+    return urlsafe_b64decode("".join(part.lstrip("@") for part in parts)).decode()
+
+
+def _iter_metadata(metadata_dir):
+    """Yield tuples (output, record) from the Snakemake metadata of the completed jobs."""
+    metadata_dir = Path(metadata_dir)
+    if not metadata_dir.is_dir():
+        return
+    for metadata_file in metadata_dir.rglob("*"):
+        if not metadata_file.is_file():
+            continue
+        try:
+            output = _decode_key(metadata_dir, metadata_file)
+            record = json.loads(metadata_file.read_text(encoding="utf-8"))
+        except (ValueError, UnicodeDecodeError):
+            L.debug("Ignoring invalid metadata file %s", metadata_file)
+            continue
+        if not record.get("incomplete") and record.get("rule"):
+            yield output, record
+
+
+def load_provenance(directory):
+    """Load and return the provenance database, or an empty database if it doesn't exist."""
+    path = Path(directory, PROVENANCE_FILE)
+    if path.exists():
+        return json.loads(path.read_text(encoding="utf-8"))
+    return {"outputs": {}, "files": {}}
+
+
+def dump_provenance(directory, data):
+    """Write the provenance database, dropping the cached digests of the deleted files."""
+    data["files"] = {key: value for key, value in data["files"].items() if Path(key).is_file()}
+    path = Path(directory, PROVENANCE_FILE)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    tmp_path.write_text(json.dumps(data, indent=2, sort_keys=True), encoding="utf-8")
+    tmp_path.replace(path)
+
+
+def update_provenance(directory):
+    """Add the jobs executed successfully by Snakemake to the provenance database.
+
+    An entry is refreshed only if the job has been executed again since the entry was recorded,
+    so that the digests of the inputs are always the ones used to produce the output,
+    even when the inputs are modified and Snakemake fails before executing the job again.
+
+    Args:
+        directory: working directory of Snakemake.
+    """
+    directory = Path(directory)
+    data = load_provenance(directory)
+    cache = data["files"]
+    for output, record in _iter_metadata(directory / METADATA_DIR):
+        endtime = record.get("endtime") or 0
+        entry = data["outputs"].get(output)
+        if entry and endtime <= entry["endtime"]:
+            continue
+        output_digest = file_digest(directory / output, cache)
+        if output_digest is None:
+            continue
+        data["outputs"][output] = {
+            "rule": record["rule"],
+            "endtime": endtime,
+            "digest": output_digest,
+            "inputs": {
+                str(path): file_digest(directory / path, cache) for path in record.get("input", [])
+            },
+        }
+    dump_provenance(directory, data)
+    L.info("Updated provenance of %s outputs", len(data["outputs"]))
+
+
+def restore_mtimes(directory):
+    """Restore the modification times of the outputs whose inputs are unchanged by content.
+
+    The outputs are processed in order of execution, so that the modification times
+    of the outputs are always more recent than the modification times of their inputs.
+
+    Return the list of the outputs whose modification time has been restored.
+    """
+    directory = Path(directory)
+    data = load_provenance(directory)
+    cache = data["files"]
+    restored = []
+    for output, entry in sorted(data["outputs"].items(), key=lambda item: item[1]["endtime"]):
+        output_path = directory / output
+        if file_digest(output_path, cache) != entry["digest"]:
+            L.debug("Output %s is missing or modified", output)
+            continue
+        if any(
+            file_digest(directory / path, cache) != digest
+            for path, digest in entry["inputs"].items()
+        ):
+            L.debug("Inputs of %s are missing or modified", output)
+            continue
+        max_input_mtime = max((_mtime(directory / path) for path in entry["inputs"]), default=None)
+        if max_input_mtime is not None and _mtime(output_path) < max_input_mtime:
+            L.info("Restoring modification time of %s", output)
+            _set_mtime(output_path, max_input_mtime)
+            if output_path.is_file():
+                # avoid computing again the digest in the next execution
+                cache[str(output_path)]["mtime_ns"] = output_path.stat().st_mtime_ns
+            restored.append(output)
+    dump_provenance(directory, data)
+    return restored
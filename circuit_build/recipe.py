@@ -0,0 +1,65 @@
+"""Utilities to fingerprint the sections of the connectome recipe."""
+
+import hashlib
+import xml.sax
+import xml.sax.handler
+from pathlib import Path
+
+
+class _SectionsHandler(xml.sax.handler.ContentHandler):
+    """Compute a digest for each top-level section of the recipe.
+
+    Comments, whitespace and the order of the attributes are ignored,
+    so that only semantic changes of a section modify its digest.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.sections = {}
+        self._depth = 0
+        self._current = None
+
+    def startElement(self, name, attrs):
+        self._depth += 1
+        if self._depth == 2:
+            # the same section may appear multiple times, and it's hashed only once
+            self._current = self.sections.setdefault(name, hashlib.sha256())
+        if self._depth >= 2:
+            attributes = " ".join(f"{k}={attrs[k]!r}" for k in sorted(attrs.getNames()))
+            self._current.update(f"<{name} {attributes}>".encode())
+
+    def endElement(self, name):
+        if self._depth >= 2:
+            self._current.update(f"</{name}>".encode())
+        self._depth -= 1
+
+    def characters(self, content):
+        if self._depth >= 2 and content.strip():
+            self._current.update(content.strip().encode())
+
+
+def recipe_sections_digests(recipe_path):
+    """Return a dict containing the hex digest of each top-level section of the recipe.
+
+    External entities (for example the included connectivity recipe) are resolved
+    relatively to the directory of the recipe.
+    """
+    handler = _SectionsHandler()
+    parser = xml.sax.make_parser()
+    parser.setFeature(xml.sax.handler.feature_external_ges, True)
+    parser.setContentHandler(handler)
+    parser.parse(str(Path(recipe_path).resolve()))
+    return {name: h.hexdigest() for name, h in handler.sections.items()}
+
+
+def recipe_digest(sections_digests, sections=None):
+    """Return a single digest for the given sections, or for all the sections if None.
+
+    Missing sections are considered as well, so that adding or removing a section
+    modifies the digest.
+    """
+    names = sorted(sections_digests) if sections is None else sorted(sections)
+    h = hashlib.sha256()
+    for name in names:
+        h.update(f"{name}:{sections_digests.get(name, '')};".encode())
+    return h.hexdigest()
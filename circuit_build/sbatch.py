@@ -0,0 +1,196 @@
+"""Submission of the jobs with sbatch, using the cluster support of Snakemake.
+
+Snakemake submits each job with ``circuit-build sbatch submit``, and polls the status
+of the submitted jobs with ``circuit-build sbatch status``, so that the jobs are executed
+in their own allocation without keeping a blocking ``salloc`` process on the local node.
+
+The parameters of each allocation are taken from the cluster config, using the section
+corresponding to the ``slurm_env`` resource declared by the rule, or the configuration
+of the group in the ``__groups__`` section for the jobs executed in the same allocation.
+"""
+
+import json
+import logging
+import os
+import shlex
+import subprocess
+from pathlib import Path
+
+from circuit_build.commands import get_slurm_config
+from circuit_build.constants import (
+    CLUSTER_CONFIG_GROUPS,
+    SBATCH_PROFILE_OPTIONS,
+    SLURM_RUNNING_STATES,
+    SLURM_SUCCESS_STATES,
+)
+from circuit_build.utils import dump_yaml, load_yaml
+
+L = logging.getLogger(__name__)
+
+PROFILE_FILE = "config.yaml"
+
+
+def _snakemake_major_version():
+    # pylint: disable=import-outside-toplevel
+    import importlib.metadata
+
+    return int(importlib.metadata.version("snakemake").split(".")[0])
+
+
+def get_rule_groups(cluster_config):
+    """Return the dict mapping the name of each grouped rule to the name of its group."""
+    result = {}
+    for group, group_config in (cluster_config or {}).get(CLUSTER_CONFIG_GROUPS, {}).items():
+        for rule in group_config["rules"]:
+            if rule in result:
+                raise ValueError(f"Rule {rule} cannot be in groups {result[rule]} and {group}")
+            result[rule] = group
+    return result
+
+
+def get_group_config(cluster_config, group):
+    """Return the slurm configuration of the allocation used to execute the given group."""
+    group_config = cluster_config.get(CLUSTER_CONFIG_GROUPS, {}).get(group)
+    if group_config is None:
+        raise ValueError(f"Group {group} must be defined in {CLUSTER_CONFIG_GROUPS}")
+    return {
+        "jobname": group,
+        **{key: group_config[key] for key in ["jobname", "salloc"] if key in group_config},
+    }
+
+
+def write_profile(profile_dir, *, cluster_config, log_dir, snakemake_version=None):
+    """Write the Snakemake profile used to submit the jobs with sbatch, and return its path.
+
+    Args:
+        profile_dir: directory where the profile is written.
+        cluster_config: path to the cluster config.
+        log_dir: directory where the output of the Slurm jobs is written.
+        snakemake_version: major version of Snakemake, detected automatically if not given.
+    """
+    if snakemake_version is None:
+        snakemake_version = _snakemake_major_version()
+    submit_cmd = " ".join(
+        [
+            "circuit-build -v sbatch submit",
+            f"--cluster-config {shlex.quote(str(Path(cluster_config).absolute()))}",
+            f"--log-dir {shlex.quote(str(Path(log_dir).absolute()))}",
+        ]
+    )
+    status_cmd = "circuit-build sbatch status"
+    options = dict(SBATCH_PROFILE_OPTIONS)
+    cluster_config_data = load_yaml(cluster_config)
+    groups = get_rule_groups(cluster_config_data)
+    if groups:
+        # the jobs of the rules in the same group are executed in the same allocation
+        options["groups"] = [f"{rule}={group}" for rule, group in groups.items()]
+        # but the jobs that aren't connected are executed together only if requested
+        components = [
+            f"{group}={group_config['components']}"
+            for group, group_config in cluster_config_data[CLUSTER_CONFIG_GROUPS].items()
+            if "components" in group_config
+        ]
+        if components:
+            options["group-components"] = components
+    if snakemake_version >= 8:
+        # the cluster support is provided by snakemake-executor-plugin-cluster-generic
+        options.update(
+            {
+                "executor": "cluster-generic",
+                "cluster-generic-submit-cmd": submit_cmd,
+                "cluster-generic-status-cmd": status_cmd,
+                "cluster-generic-cancel-cmd": "scancel",
+            }
+        )
+    else:
+        options["restart-times"] = options.pop("retries")
+        options.update(
+            {
+                "cluster": submit_cmd,
+                "cluster-status": status_cmd,
+                "cluster-cancel": "scancel",
+            }
+        )
+    path = Path(profile_dir, PROFILE_FILE)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    dump_yaml(path, data=options)
+    return path
+
+
+def get_job_slurm_config(cluster_config, properties):
+    """Return the slurm configuration to be used for the job with the given properties.
+
+    Args:
+        cluster_config (dict): cluster configuration.
+        properties (dict): properties of the job, as written by Snakemake in the jobscript.
+    """
+    if properties.get("type") == "group":
+        return get_group_config(cluster_config, properties["groupid"])
+    slurm_env = properties.get("resources", {}).get("slurm_env") or properties["rule"]
+    return get_slurm_config(cluster_config, slurm_env)
+
+
+def sbatch_args(slurm_config, log_dir):
+    """Return the arguments of sbatch corresponding to the given slurm configuration.
+
+    The doubled braces are needed in the cluster config to escape the Snakemake placeholders,
+    so they are replaced with single braces, and the environment variables are expanded.
+    """
+    salloc = slurm_config["salloc"].replace("{{", "{").replace("}}", "}")
+    return [
+        "--parsable",
+        f"--job-name={slurm_config['jobname']}",
+        f"--output={Path(log_dir, '%x-%j.out')}",
+        *shlex.split(os.path.expandvars(salloc)),
+    ]
+
+
+def _read_job_properties(jobscript):
+    """Return the properties of the job written by Snakemake in the jobscript."""
+    prefix = "# properties = "
+    with open(jobscript, encoding="utf-8") as fd:
+        for line in fd:
+            if line.startswith(prefix):
+                return json.loads(line.removeprefix(prefix))
+    raise ValueError(f"Job properties not found in {jobscript}")
+
+
+def submit(jobscript, *, cluster_config, log_dir):
+    """Submit the jobscript with sbatch, and return the id of the Slurm job."""
+    properties = _read_job_properties(jobscript)
+    slurm_config = get_job_slurm_config(load_yaml(cluster_config), properties)
+    Path(log_dir).mkdir(parents=True, exist_ok=True)
+    cmd = ["sbatch", *sbatch_args(slurm_config, log_dir), str(jobscript)]
+    L.info("Command: %s", " ".join(cmd))
+    result = subprocess.run(cmd, check=True, capture_output=True, text=True)
+    # the output of sbatch --parsable is "jobid" or "jobid;cluster"
+    return result.stdout.strip().split(";")[0]
+
+
+def _query_state(cmd):
+    """Return the first state returned by the given command, or None if not available."""
+    result = subprocess.run(cmd, check=False, capture_output=True, text=True)
+    if result.returncode != 0:
+        L.warning("Command failed: %s\n%s", " ".join(cmd), result.stderr)
+        return None
+    states = result.stdout.split()
+    return states[0] if states else ""
+
+
+def job_status(jobid):
+    """Return the status of the Slurm job, as expected by Snakemake: running, success or failed.
+
+    The state is taken from sacct, or from squeue if the job isn't in the accounting yet.
+    The jobs are considered running when the state cannot be retrieved temporarily.
+    """
+    state = _query_state(["sacct", "-j", jobid, "-X", "-n", "-P", "-o", "State"])
+    if not state:
+        state = _query_state(["squeue", "-j", jobid, "-h", "-o", "%T"]) or state
+    if state is None:
+        return "running"
+    if state in SLURM_SUCCESS_STATES:
+        return "success"
+    if state in SLURM_RUNNING_STATES:
+        return "running"
+    L.warning("Slurm job %s: %s", jobid, state or "not found")
+    return "failed"
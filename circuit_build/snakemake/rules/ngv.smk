@@ -1,3 +1,6 @@
+from circuit_build.ngv import merge_morphology_dirs, split_touches_dir, write_microdomains_key
+
+
 rule ngv:
     input:
         "ngv_config.json",
@@ -11,6 +14,10 @@ rule ngv:
         ctx.edges_astrocytes_vasculature_endfeet_meshes_file,
         ctx.edges_astrocytes_astrocytes_file,
         ctx.nodes_astrocytes_morphologies_dir,
+        *if_then_else(
+            ctx.ngv.synthesis_container, [ctx.ngv.astrocytes_morphologies_container_file], []
+        ),
+        *if_then_else(ctx.synthesis_container, [ctx.synthesized_morphologies_container_file], []),
         ctx.refined_tetrahedral_mesh_file,
 
 
@@ -31,6 +38,8 @@ rule build_sonata_vasculature:
         ctx.nodes_vasculature_file,
     log:
         ctx.log_path("build_sonata_vasculature"),
+    resources:
+        **ctx.slurm_resources("build_sonata_vasculature"),
     shell:
         ctx.bbp_env(
             "ngv",
@@ -38,6 +47,9 @@ rule build_sonata_vasculature:
                 "vascpy morphology-to-sonata",
                 "{input} {output}",
             ],
+            slurm_env="build_sonata_vasculature",
+            # the vasculature is usually shared, so it's converted once for all the circuits
+            cache=CacheOptions(inputs=["{input}"], cache_dir=ctx.ngv.artifact_cache_dir),
         )
 
 
@@ -48,6 +60,8 @@ rule place_glia:
         ctx.paths.auxiliary_path("astrocytes.somata.h5"),
     log:
         ctx.log_path("place_glia"),
+    resources:
+        **ctx.slurm_resources("place_glia"),
     shell:
         ctx.bbp_env(
             "ngv",
@@ -61,6 +75,7 @@ rule place_glia:
                 "--output {output}",
                 f"--seed {ctx.conf.get(['ngv', 'common', 'seed'])}",
             ],
+            slurm_env="place_glia",
         )
 
 
@@ -71,6 +86,8 @@ rule assign_glia_emodels:
         ctx.paths.auxiliary_path("astrocytes.emodels.h5"),
     log:
         ctx.log_path("assign_glia_emodels"),
+    resources:
+        **ctx.slurm_resources("assign_glia_emodels"),
     shell:
         ctx.bbp_env(
             "ngv",
@@ -80,6 +97,7 @@ rule assign_glia_emodels:
                 "--output {output}",
                 f"--hoc {ctx.conf.get(['ngv', 'assign_emodels', 'hoc_template'])}",
             ],
+            slurm_env="assign_glia_emodels",
         )
 
 
@@ -91,6 +109,8 @@ rule finalize_glia:
         ctx.nodes_astrocytes_file,
     log:
         ctx.log_path("finalize_glia"),
+    resources:
+        **ctx.slurm_resources("finalize_glia"),
     shell:
         ctx.bbp_env(
             "ngv",
@@ -100,28 +120,56 @@ rule finalize_glia:
                 "--emodels-file {input[emodels]}",
                 "--output {output}",
             ],
+            slurm_env="finalize_glia",
         )
 
 
-rule build_glia_microdomains:
+rule glia_microdomains_key:
     input:
         ctx.nodes_astrocytes_file,
+    output:
+        ctx.paths.auxiliary_path("astrocytes.microdomains_key.json"),
+    log:
+        ctx.log_path("glia_microdomains_key"),
+    message:
+        "Compute the key of the microdomains from the positions and radii of the astrocytes"
+    run:
+        with log_exceptions(log[0]):
+            write_microdomains_key(input[0], ctx.conf.get(["ngv", "microdomains"]), output[0])
+
+
+rule build_glia_microdomains:
+    # the astrocytes are not an input, so that the rule depends only on the key of the
+    # microdomains, the atlas and the seed, and the tessellation is reused when only the
+    # other attributes of the astrocytes change
+    input:
+        key=ctx.paths.auxiliary_path("astrocytes.microdomains_key.json"),
     output:
         ctx.nodes_astrocytes_microdomains_file,
     log:
         ctx.log_path("build_glia_microdomains"),
+    resources:
+        **ctx.slurm_resources("build_glia_microdomains"),
+    params:
+        atlas=ctx.conf.get(["ngv", "common", "atlas"]),
+        seed=ctx.conf.get(["ngv", "common", "seed"]),
     shell:
         ctx.bbp_env(
             "ngv",
             [
                 "ngv microdomains",
                 f"--config {ctx.paths.bioname_path('MANIFEST.yaml')}",
-                "--astrocytes {input}",
-                f"--atlas {ctx.conf.get(['ngv', 'common', 'atlas'])}",
+                f"--astrocytes {ctx.nodes_astrocytes_file}",
+                "--atlas {params[atlas]}",
                 "--atlas-cache .atlas",
                 "--output-file-path {output}",
-                f"--seed {ctx.conf.get(['ngv', 'common', 'seed'])}",
+                "--seed {params[seed]}",
             ],
+            slurm_env="build_glia_microdomains",
+            cache=CacheOptions(
+                inputs=["{input[key]}", "{params[atlas]}"],
+                cache_dir=ctx.ngv.artifact_cache_dir,
+            ),
         )
 
 
@@ -134,6 +182,8 @@ rule build_gliovascular_connectivity:
         ctx.paths.auxiliary_path("gliovascular.connectivity.h5"),
     log:
         ctx.log_path("gliovascular_connectivity"),
+    resources:
+        **ctx.slurm_resources("build_gliovascular_connectivity"),
     shell:
         ctx.bbp_env(
             "ngv",
@@ -147,20 +197,52 @@ rule build_gliovascular_connectivity:
                 f"--population-name {ctx.edges_astrocytes_vasculature_name}",
                 "--output {output}",
             ],
+            slurm_env="build_gliovascular_connectivity",
         )
 
 
+if ctx.ngv.neuroglial_synapse_attributes:
+
+    rule extract_neuroglial_synapses:
+        input:
+            ctx.edges_neurons_neurons_file("functional"),
+        output:
+            ctx.neuroglial_synapses_file,
+        log:
+            ctx.log_path("extract_neuroglial_synapses"),
+        resources:
+            **ctx.slurm_resources("extract_neuroglial_synapses"),
+        message:
+            "Extract the attributes of the neuronal synapses used by the neuroglial connectivity"
+        shell:
+            ctx.bbp_env(
+                "ngv",
+                [
+                    "python",
+                    script_path("edges_subset.py"),
+                    "--edges-path {input}",
+                    f"--population-name {ctx.edges_neurons_neurons_name}",
+                    "--attributes",
+                    *ctx.ngv.neuroglial_synapse_attributes,
+                    "--out-path {output}",
+                ],
+                slurm_env="extract_neuroglial_synapses",
+            )
+
+
 rule build_neuroglial_connectivity:
     input:
         astrocytes=ctx.nodes_astrocytes_file,
         microdomains=ctx.nodes_astrocytes_microdomains_file,
         neurons=ctx.nodes_neurons_file,
-        neuronal_synapses=ctx.edges_neurons_neurons_file("functional"),
+        neuronal_synapses=ctx.neuroglial_synapses_file,
         spatial_synapse_index_dir=ctx.edges_spatial_index_dir,
     output:
         ctx.paths.auxiliary_path("neuroglial.connectivity.h5"),
     log:
         ctx.log_path("neuroglial_connectivity"),
+    resources:
+        **ctx.slurm_resources("build_neuroglial_connectivity"),
     shell:
         ctx.bbp_env(
             "ngv",
@@ -175,124 +257,429 @@ rule build_neuroglial_connectivity:
                 "--output-path {output}",
                 f"--seed {ctx.conf.get(['ngv', 'common', 'seed'])}",
             ],
+            slurm_env="build_neuroglial_connectivity",
         )
 
 
-rule build_endfeet_surface_meshes:
-    input:
-        ctx.paths.auxiliary_path("gliovascular.connectivity.h5"),
-    output:
-        ctx.edges_astrocytes_vasculature_endfeet_meshes_file,
-    log:
-        ctx.log_path("endfeet_area"),
-    shell:
-        ctx.bbp_env(
-            "ngv",
-            [
-                "ngv endfeet-area",
-                f"--config-path {ctx.paths.bioname_path('MANIFEST.yaml')}",
-                f"--vasculature-mesh-path {ctx.conf.get(['ngv', 'common', 'vasculature_mesh'])}",
-                "--gliovascular-connectivity-path {input}",
-                "--output-path {output}",
-                f"--seed {ctx.conf.get(['ngv', 'common', 'seed'])}",
+def _endfeet_area_cmd(*, vasculature_mesh, connectivity, output, seed):
+    """Return the command used to build the endfeet surface meshes of all the endfeet, or a tile."""
+    return ctx.bbp_env(
+        "ngv",
+        [
+            "ngv endfeet-area",
+            f"--config-path {ctx.paths.bioname_path('MANIFEST.yaml')}",
+            f"--vasculature-mesh-path {vasculature_mesh}",
+            f"--gliovascular-connectivity-path {connectivity}",
+            f"--output-path {output}",
+            f"--seed {seed}",
+        ],
+        slurm_env="build_endfeet_surface_meshes",
+    )
+
+
+if ctx.ngv.endfeet_tiles > 1:
+
+    rule split_endfeet_tiles:
+        input:
+            ctx.paths.auxiliary_path("gliovascular.connectivity.h5"),
+        output:
+            connectivities=[
+                ctx.paths.auxiliary_path(f"endfeet_tiles/gliovascular_{tile}.h5")
+                for tile in range(ctx.ngv.endfeet_tiles)
             ],
-        )
-
-
-rule synthesize_glia:
-    input:
-        astrocytes=ctx.nodes_astrocytes_file,
-        microdomains=ctx.nodes_astrocytes_microdomains_file,
-        gliovascular_connectivity=ctx.paths.auxiliary_path("gliovascular.connectivity.h5"),
-        neuroglial_connectivity=ctx.paths.auxiliary_path("neuroglial.connectivity.h5"),
-        endfeet_meshes=ctx.edges_astrocytes_vasculature_endfeet_meshes_file,
-        neuronal_synapses=ctx.edges_neurons_neurons_file("functional"),
-    output:
-        morphologies_dir=directory(ctx.nodes_astrocytes_morphologies_dir),
-    log:
-        ctx.log_path("synthesis"),
-    shell:
-        ctx.bbp_env(
-            "synthesize-glia",
-            [
-                f"ngv -v synthesis",
-                f'--config-path {ctx.paths.bioname_path("MANIFEST.yaml")}',
-                f'--tns-distributions-path {ctx.paths.bioname_path("tns_distributions.json")}',
-                f'--tns-parameters-path {ctx.paths.bioname_path("tns_parameters.json")}',
-                f'--tns-context-path {ctx.paths.bioname_path("tns_context.json")}',
-                f'--er-data-path {ctx.paths.bioname_path("er_data.json")}',
-                "--astrocytes-path {input[astrocytes]}",
-                "--microdomains-path {input[microdomains]}",
-                "--gliovascular-connectivity-path {input[gliovascular_connectivity]}",
-                "--neuroglial-connectivity-path {input[neuroglial_connectivity]}",
-                "--endfeet-meshes-path {input[endfeet_meshes]}",
-                "--out-morph-dir {output[morphologies_dir]}",
-                "--neuronal-connectivity-path {input[neuronal_synapses]}",
-                ("--parallel" if ctx.conf.get(["ngv", "common", "parallel"]) else ""),
-                f"--seed {ctx.conf.get(['ngv', 'common', 'seed'])}",
-            ],
-            slurm_env="synthesize_glia",
-        )
-
-
-rule finalize_gliovascular_connectivity:
-    input:
-        astrocytes=ctx.nodes_astrocytes_file,
-        connectivity=ctx.paths.auxiliary_path("gliovascular.connectivity.h5"),
-        endfeet_meshes=ctx.edges_astrocytes_vasculature_endfeet_meshes_file,
-        morphologies_dir=ctx.nodes_astrocytes_morphologies_dir,
-        vasculature_sonata=ctx.nodes_vasculature_file,
-    output:
-        ctx.edges_astrocytes_vasculature_file,
-    log:
-        ctx.log_path("finalize_gliovascular_connectivity"),
-    shell:
-        ctx.bbp_env(
-            "ngv",
-            [
-                "ngv attach-endfeet-info-to-gliovascular-connectivity",
-                "--input-file {input[connectivity]}",
-                "--output-file {output}",
-                "--astrocytes {input[astrocytes]}",
-                "--endfeet-meshes-path {input[endfeet_meshes]}",
-                "--vasculature-sonata {input[vasculature_sonata]}",
-                "--morph-dir {input[morphologies_dir]}",
-                ("--parallel" if ctx.conf.get(["ngv", "common", "parallel"]) else ""),
-                f"--seed {ctx.conf.get(['ngv', 'common', 'seed'])}",
+            meshes=[
+                ctx.paths.auxiliary_path(f"endfeet_tiles/vasculature_{tile}.obj")
+                for tile in range(ctx.ngv.endfeet_tiles)
             ],
-        )
-
-
-rule finalize_neuroglial_connectivity:
-    input:
-        astrocytes=ctx.nodes_astrocytes_file,
-        microdomains=ctx.nodes_astrocytes_microdomains_file,
-        connectivity=ctx.paths.auxiliary_path("neuroglial.connectivity.h5"),
-        morphologies_dir=ctx.nodes_astrocytes_morphologies_dir,
-        neuronal_synapses=ctx.edges_neurons_neurons_file("functional"),
-    output:
-        ctx.edges_neurons_astrocytes_file,
-    log:
-        ctx.log_path("finalize_neuroglial_connectivity"),
-    shell:
-        ctx.bbp_env(
-            "ngv",
-            [
-                "ngv attach-morphology-info-to-neuroglial-connectivity",
-                "--input-file-path {input[connectivity]}",
-                "--output-file-path {output}",
-                "--astrocytes-path {input[astrocytes]}",
-                "--microdomains-path {input[microdomains]}",
-                "--morph-dir {input[morphologies_dir]}",
-                "--synaptic-data-path {input[neuronal_synapses]}",
-                ("--parallel" if ctx.conf.get(["ngv", "common", "parallel"]) else ""),
-                f"--seed {ctx.conf.get(['ngv', 'common', 'seed'])}",
+            ids=[
+                ctx.paths.auxiliary_path(f"endfeet_tiles/ids_{tile}.npz")
+                for tile in range(ctx.ngv.endfeet_tiles)
             ],
-        )
+        log:
+            ctx.log_path("split_endfeet_tiles"),
+        resources:
+            **ctx.slurm_resources("split_endfeet_tiles"),
+        message:
+            "Split the endfeet and the vasculature mesh in tiles"
+        shell:
+            ctx.bbp_env(
+                "ngv",
+                [
+                    "python",
+                    script_path("endfeet_tiles.py"),
+                    "split",
+                    "--connectivity-path {input}",
+                    f"--population-name {ctx.edges_astrocytes_vasculature_name}",
+                    "--vasculature-mesh-path",
+                    ctx.conf.get(["ngv", "common", "vasculature_mesh"]),
+                    f"--halo {ctx.ngv.endfeet_tiles_halo}",
+                    f"--growth-radius {ctx.ngv.endfeet_growth_radius}",
+                    "--out-connectivities {output[connectivities]}",
+                    "--out-meshes {output[meshes]}",
+                    "--out-ids {output[ids]}",
+                ],
+                slurm_env="split_endfeet_tiles",
+            )
+
+    rule build_endfeet_surface_meshes_tile:
+        input:
+            connectivity=ctx.paths.auxiliary_path("endfeet_tiles/gliovascular_{tile}.h5"),
+            mesh=ctx.paths.auxiliary_path("endfeet_tiles/vasculature_{tile}.obj"),
+        output:
+            ctx.paths.auxiliary_path("endfeet_tiles/endfeet_meshes_{tile}.h5"),
+        log:
+            ctx.log_path("endfeet_area_{tile}"),
+        wildcard_constraints:
+            tile=r"\d+",
+        resources:
+            **ctx.slurm_resources("build_endfeet_surface_meshes"),
+        message:
+            "Build the endfeet surface meshes of the tile {wildcards.tile}"
+        shell:
+            _endfeet_area_cmd(
+                vasculature_mesh="{input[mesh]}",
+                connectivity="{input[connectivity]}",
+                output="{output}",
+                # the seed is shifted so that each tile uses a different random sequence
+                seed=f"$(( {ctx.conf.get(['ngv', 'common', 'seed'])} + {{wildcards.tile}} ))",
+            )
+
+    rule build_endfeet_surface_meshes:
+        input:
+            meshes=expand(
+                ctx.paths.auxiliary_path("endfeet_tiles/endfeet_meshes_{tile}.h5"),
+                tile=range(ctx.ngv.endfeet_tiles),
+            ),
+            ids=expand(
+                ctx.paths.auxiliary_path("endfeet_tiles/ids_{tile}.npz"),
+                tile=range(ctx.ngv.endfeet_tiles),
+            ),
+        output:
+            ctx.edges_astrocytes_vasculature_endfeet_meshes_file,
+        log:
+            ctx.log_path("endfeet_area"),
+        resources:
+            **ctx.slurm_resources("merge_endfeet_tiles"),
+        message:
+            "Merge the endfeet surface meshes of the tiles"
+        shell:
+            ctx.bbp_env(
+                "ngv",
+                [
+                    "python",
+                    script_path("endfeet_tiles.py"),
+                    "merge",
+                    "--tile-meshes {input[meshes]}",
+                    "--tile-ids {input[ids]}",
+                    "--out-path {output}",
+                ],
+                slurm_env="merge_endfeet_tiles",
+            )
+
+else:
+
+    rule build_endfeet_surface_meshes:
+        input:
+            ctx.paths.auxiliary_path("gliovascular.connectivity.h5"),
+        output:
+            ctx.edges_astrocytes_vasculature_endfeet_meshes_file,
+        log:
+            ctx.log_path("endfeet_area"),
+        resources:
+            **ctx.slurm_resources("build_endfeet_surface_meshes"),
+        shell:
+            _endfeet_area_cmd(
+                vasculature_mesh=ctx.conf.get(["ngv", "common", "vasculature_mesh"]),
+                connectivity="{input}",
+                output="{output}",
+                seed=ctx.conf.get(["ngv", "common", "seed"]),
+            )
+
+
+def _synthesize_glia_cmd(*, command, out_morph_dir, slurm_env, extra_args=(), options=None):
+    """Return the command used to synthesize all the astrocytes, or a shard."""
+    return ctx.bbp_env(
+        "synthesize-glia",
+        [
+            command,
+            f'--config-path {ctx.paths.bioname_path("MANIFEST.yaml")}',
+            f'--tns-distributions-path {ctx.paths.bioname_path("tns_distributions.json")}',
+            f'--tns-parameters-path {ctx.paths.bioname_path("tns_parameters.json")}',
+            f'--tns-context-path {ctx.paths.bioname_path("tns_context.json")}',
+            f'--er-data-path {ctx.paths.bioname_path("er_data.json")}',
+            "--astrocytes-path {input[astrocytes]}",
+            "--microdomains-path {input[microdomains]}",
+            "--gliovascular-connectivity-path {input[gliovascular_connectivity]}",
+            "--neuroglial-connectivity-path {input[neuroglial_connectivity]}",
+            "--endfeet-meshes-path {input[endfeet_meshes]}",
+            f"--out-morph-dir {out_morph_dir}",
+            "--neuronal-connectivity-path {input[neuronal_synapses]}",
+            *extra_args,
+            ("--parallel" if ctx.conf.get(["ngv", "common", "parallel"]) else ""),
+            f"--seed {ctx.conf.get(['ngv', 'common', 'seed'])}",
+        ],
+        slurm_env=slurm_env,
+        options=options,
+    )
+
+
+_SYNTHESIZE_GLIA_INPUT = {
+    "astrocytes": ctx.nodes_astrocytes_file,
+    "microdomains": ctx.nodes_astrocytes_microdomains_file,
+    "gliovascular_connectivity": ctx.paths.auxiliary_path("gliovascular.connectivity.h5"),
+    "neuroglial_connectivity": ctx.paths.auxiliary_path("neuroglial.connectivity.h5"),
+    "endfeet_meshes": ctx.edges_astrocytes_vasculature_endfeet_meshes_file,
+    "neuronal_synapses": ctx.edges_neurons_neurons_file("functional"),
+}
+
+
+if ctx.ngv.synthesis_shards > 1:
+
+    rule synthesize_glia_shard:
+        input:
+            **_SYNTHESIZE_GLIA_INPUT,
+        output:
+            morphologies_dir=directory(
+                ctx.paths.auxiliary_path("glia_synthesis_shards/morphologies_{shard}")
+            ),
+        log:
+            ctx.log_path("synthesis_{shard}"),
+        wildcard_constraints:
+            shard=r"\d+",
+        threads: ctx.local_threads("synthesize_glia_shard", workflow.cores)
+        resources:
+            **ctx.slurm_resources("synthesize_glia_shard"),
+        message:
+            "Synthesize the astrocytes of the shard {wildcards.shard}"
+        shell:
+            _synthesize_glia_cmd(
+                command=f"python {script_path('glia_synthesis_shards.py')}",
+                out_morph_dir="{output[morphologies_dir]}",
+                slurm_env="synthesize_glia_shard",
+                extra_args=["--shard {wildcards.shard}", f"--shards {ctx.ngv.synthesis_shards}"],
+                # the script doesn't support MPI, and it uses all the CPUs of the node if parallel
+                options=CommandOptions(single_task=True),
+            )
+
+    rule synthesize_glia:
+        input:
+            expand(
+                ctx.paths.auxiliary_path("glia_synthesis_shards/morphologies_{shard}"),
+                shard=range(ctx.ngv.synthesis_shards),
+            ),
+        output:
+            morphologies_dir=directory(ctx.nodes_astrocytes_morphologies_dir),
+        log:
+            ctx.log_path("synthesis"),
+        message:
+            "Merge the astrocyte morphologies of the shards"
+        run:
+            with log_exceptions(log[0]):
+                merge_morphology_dirs(input, output.morphologies_dir)
+
+else:
+
+    rule synthesize_glia:
+        input:
+            **_SYNTHESIZE_GLIA_INPUT,
+        output:
+            morphologies_dir=directory(ctx.nodes_astrocytes_morphologies_dir),
+        log:
+            ctx.log_path("synthesis"),
+        threads: ctx.local_threads("synthesize_glia", workflow.cores)
+        resources:
+            **ctx.slurm_resources("synthesize_glia"),
+        shell:
+            _synthesize_glia_cmd(
+                command="ngv -v synthesis",
+                out_morph_dir="{output[morphologies_dir]}",
+                slurm_env="synthesize_glia",
+            )
+
+
+if ctx.ngv.synthesis_container:
+
+    rule glia_morphologies_container:
+        input:
+            ctx.nodes_astrocytes_morphologies_dir,
+        output:
+            ctx.ngv.astrocytes_morphologies_container_file,
+        log:
+            ctx.log_path("glia_morphologies_container"),
+        resources:
+            **ctx.slurm_resources("glia_morphologies_container"),
+        message:
+            "Pack the astrocyte morphologies in a merged container"
+        shell:
+            ctx.bbp_env(
+                "ngv",
+                [
+                    "python",
+                    script_path("morphology_container.py"),
+                    "--morph-dir {input}",
+                    "--out-path {output}",
+                ],
+                slurm_env="glia_morphologies_container",
+            )
+
+
+def _finalize_gliovascular_args(*, output, morph_dir):
+    """Return the arguments used to attach the endfeet info to the gliovascular connectivity."""
+    return [
+        "ngv attach-endfeet-info-to-gliovascular-connectivity",
+        "--input-file {input[gliovascular_connectivity]}",
+        f"--output-file {output}",
+        "--astrocytes {input[astrocytes]}",
+        "--endfeet-meshes-path {input[endfeet_meshes]}",
+        "--vasculature-sonata {input[vasculature_sonata]}",
+        f"--morph-dir {morph_dir}",
+        ("--parallel" if ctx.conf.get(["ngv", "common", "parallel"]) else ""),
+        f"--seed {ctx.conf.get(['ngv', 'common', 'seed'])}",
+    ]
+
+
+def _finalize_neuroglial_args(*, output, morph_dir):
+    """Return the arguments used to attach the morphology info to the neuroglial connectivity."""
+    return [
+        "ngv attach-morphology-info-to-neuroglial-connectivity",
+        "--input-file-path {input[neuroglial_connectivity]}",
+        f"--output-file-path {output}",
+        "--astrocytes-path {input[astrocytes]}",
+        "--microdomains-path {input[microdomains]}",
+        f"--morph-dir {morph_dir}",
+        "--synaptic-data-path {input[neuronal_synapses]}",
+        ("--parallel" if ctx.conf.get(["ngv", "common", "parallel"]) else ""),
+        f"--seed {ctx.conf.get(['ngv', 'common', 'seed'])}",
+    ]
+
+
+_FINALIZE_GLIOVASCULAR_INPUT = {
+    "astrocytes": ctx.nodes_astrocytes_file,
+    "gliovascular_connectivity": ctx.paths.auxiliary_path("gliovascular.connectivity.h5"),
+    "endfeet_meshes": ctx.edges_astrocytes_vasculature_endfeet_meshes_file,
+    "morphologies_dir": ctx.nodes_astrocytes_morphologies_dir,
+    "vasculature_sonata": ctx.nodes_vasculature_file,
+}
+_FINALIZE_NEUROGLIAL_INPUT = {
+    "astrocytes": ctx.nodes_astrocytes_file,
+    "microdomains": ctx.nodes_astrocytes_microdomains_file,
+    "neuroglial_connectivity": ctx.paths.auxiliary_path("neuroglial.connectivity.h5"),
+    "morphologies_dir": ctx.nodes_astrocytes_morphologies_dir,
+    "neuronal_synapses": ctx.neuroglial_synapses_file,
+}
+
+
+def _stage_glia_morphologies_args():
+    """Return the arguments used to stage the morphologies, and the path to the staged directory.
+
+    The morphologies are copied in one pass to a temporary directory in the staging directory,
+    removed at the end of the job, or used in place if staging is disabled.
+    The job fails before copying if the staging directory doesn't have enough free space.
+    """
+    staging_dir = ctx.ngv.finalization_staging_dir
+    if not staging_dir:
+        return [], "{input[morphologies_dir]}"
+    # escape the braces, since the command is formatted by Snakemake
+    staging_dir = str(staging_dir).replace("{", "{{").replace("}", "}}")
+    args = [
+        "required=$(du -sk {input[morphologies_dir]} | cut -f1)",
+        "&&",
+        f'available=$(df -Pk "{staging_dir}" | tail -1 | tr -s " " | cut -d " " -f4)',
+        "&&",
+        '(test "$required" -lt "$available"',
+        "||",
+        f'(echo "Not enough space in {staging_dir} to stage the morphologies:'
+        ' $required KiB required, $available KiB available" >&2',
+        "&&",
+        "false))",
+        "&&",
+        f'staged_dir=$(mktemp -d "{staging_dir}/astrocytes_morphologies.XXXXXX")',
+        "&&",
+        'trap "rm -rf $staged_dir" EXIT',
+        "&&",
+        'cp -r {input[morphologies_dir]}/. "$staged_dir"',
+        "&&",
+    ]
+    return args, '"$staged_dir"'
+
+
+if ctx.ngv.finalization_merged:
+    _STAGE_ARGS, _STAGED_MORPH_DIR = _stage_glia_morphologies_args()
+
+    rule finalize_glia_connectivity:
+        input:
+            **{**_FINALIZE_GLIOVASCULAR_INPUT, **_FINALIZE_NEUROGLIAL_INPUT},
+        output:
+            gliovascular=ctx.edges_astrocytes_vasculature_file,
+            neuroglial=ctx.edges_neurons_astrocytes_file,
+        log:
+            ctx.log_path("finalize_glia_connectivity"),
+        resources:
+            **ctx.slurm_resources("finalize_glia_connectivity"),
+        message:
+            "Attach the morphology info to the gliovascular and neuroglial connectivity in one job"
+        shell:
+            ctx.bbp_env(
+                "ngv",
+                [
+                    *_STAGE_ARGS,
+                    *_finalize_gliovascular_args(
+                        output="{output[gliovascular]}", morph_dir=_STAGED_MORPH_DIR
+                    ),
+                    "&&",
+                    *_finalize_neuroglial_args(
+                        output="{output[neuroglial]}", morph_dir=_STAGED_MORPH_DIR
+                    ),
+                ],
+                slurm_env="finalize_glia_connectivity",
+            )
+
+else:
+
+    rule finalize_gliovascular_connectivity:
+        input:
+            **_FINALIZE_GLIOVASCULAR_INPUT,
+        output:
+            ctx.edges_astrocytes_vasculature_file,
+        log:
+            ctx.log_path("finalize_gliovascular_connectivity"),
+        resources:
+            **ctx.slurm_resources("finalize_gliovascular_connectivity"),
+        shell:
+            ctx.bbp_env(
+                "ngv",
+                _finalize_gliovascular_args(
+                    output="{output}", morph_dir="{input[morphologies_dir]}"
+                ),
+                slurm_env="finalize_gliovascular_connectivity",
+            )
+
+    rule finalize_neuroglial_connectivity:
+        input:
+            **_FINALIZE_NEUROGLIAL_INPUT,
+        output:
+            ctx.edges_neurons_astrocytes_file,
+        log:
+            ctx.log_path("finalize_neuroglial_connectivity"),
+        resources:
+            **ctx.slurm_resources("finalize_neuroglial_connectivity"),
+        shell:
+            ctx.bbp_env(
+                "ngv",
+                _finalize_neuroglial_args(
+                    output="{output}", morph_dir="{input[morphologies_dir]}"
+                ),
+                slurm_env="finalize_neuroglial_connectivity",
+            )
 
 
 rule glial_gap_junctions:
     input:
+        **if_then_else(
+            ctx.ngv.synthesis_container,
+            {"morphologies_container": ctx.ngv.astrocytes_morphologies_container_file},
+            {},
+        ),
         astrocytes=ctx.nodes_astrocytes_file,
         morphologies_dir=ctx.nodes_astrocytes_morphologies_dir,
         circuit_config="ngv_config.json",
@@ -300,6 +687,8 @@ rule glial_gap_junctions:
         touches_dir=directory(ctx.tmp_edges_astrocytes_glialglial_touches_dir),
     log:
         ctx.log_path("glial_gap_junctions"),
+    resources:
+        **ctx.slurm_resources("ngv-touchdetector"),
     shell:
         ctx.bbp_env(
             "ngv-touchdetector",
@@ -317,27 +706,117 @@ rule glial_gap_junctions:
         )
 
 
-rule glialglial_connectivity:
-    input:
-        astrocytes=ctx.nodes_astrocytes_file,
-        touches_dir=ctx.tmp_edges_astrocytes_glialglial_touches_dir,
-    output:
-        glialglial_connectivity=ctx.edges_astrocytes_astrocytes_file,
-    log:
-        ctx.log_path("glialglial_connectivity"),
-    shell:
-        ctx.bbp_env(
-            "ngv-pytouchreader",
-            [
-                "ngv glialglial-connectivity",
-                "--astrocytes {input[astrocytes]}",
-                "--population-name {ctx.edges_astrocytes_astrocytes_name}",
-                "--touches-dir {input[touches_dir]}",
-                f"--population-name {ctx.edges_astrocytes_astrocytes_name}",
-                "--output-connectivity {output[glialglial_connectivity]}",
-                f"--seed {ctx.conf.get(['ngv', 'common', 'seed'])}",
+def _glialglial_connectivity_cmd(*, touches_dir, output, seed, options=None):
+    """Return the command used to build the glial-glial connectivity from all the touches, or a shard."""
+    return ctx.bbp_env(
+        "ngv-pytouchreader",
+        [
+            "ngv glialglial-connectivity",
+            "--astrocytes {input[astrocytes]}",
+            f"--touches-dir {touches_dir}",
+            f"--population-name {ctx.edges_astrocytes_astrocytes_name}",
+            f"--output-connectivity {output}",
+            f"--seed {seed}",
+        ],
+        slurm_env="glialglial_connectivity",
+        options=options,
+    )
+
+
+if ctx.ngv.glialglial_shards > 1:
+
+    rule split_glialglial_shards:
+        input:
+            ctx.tmp_edges_astrocytes_glialglial_touches_dir,
+        output:
+            touches_dirs=[
+                directory(ctx.paths.auxiliary_path(f"glialglial_shards/touches_{shard}"))
+                for shard in range(ctx.ngv.glialglial_shards)
             ],
-        )
+        log:
+            ctx.log_path("split_glialglial_shards"),
+        message:
+            "Split the glial-glial touches in shards"
+        run:
+            with log_exceptions(log[0]):
+                split_touches_dir(input[0], output.touches_dirs)
+
+    rule glialglial_connectivity_shard:
+        input:
+            astrocytes=ctx.nodes_astrocytes_file,
+            touches_dir=ctx.paths.auxiliary_path("glialglial_shards/touches_{shard}"),
+        output:
+            directory(ctx.paths.auxiliary_path("glialglial_shards/glialglial_{shard}")),
+        log:
+            ctx.log_path("glialglial_connectivity_{shard}"),
+        wildcard_constraints:
+            shard=r"\d+",
+        resources:
+            **ctx.slurm_resources("glialglial_connectivity"),
+        message:
+            "Build the glial-glial connectivity of the shard {wildcards.shard}"
+        shell:
+            # the touches of each rank are processed separately with the seed shifted by the rank,
+            # so that the edges don't depend on the number of shards, and since the tool doesn't
+            # support MPI, each rank is processed by a single task in a separate job step
+            _glialglial_connectivity_cmd(
+                touches_dir="{input[touches_dir]}/$rank",
+                output="{output}/$rank.h5",
+                seed=f"$(( {ctx.conf.get(['ngv', 'common', 'seed'])} + $rank ))",
+                options=CommandOptions(
+                    pre_cmd=["mkdir", "-p", "{output}"],
+                    loop="rank in $(ls {input[touches_dir]})",
+                    single_task=True,
+                ),
+            )
+
+    rule glialglial_connectivity:
+        input:
+            astrocytes=ctx.nodes_astrocytes_file,
+            shards=expand(
+                ctx.paths.auxiliary_path("glialglial_shards/glialglial_{shard}"),
+                shard=range(ctx.ngv.glialglial_shards),
+            ),
+        output:
+            glialglial_connectivity=ctx.edges_astrocytes_astrocytes_file,
+        log:
+            ctx.log_path("glialglial_connectivity"),
+        resources:
+            **ctx.slurm_resources("merge_glialglial_shards"),
+        message:
+            "Merge the glial-glial connectivity of the shards"
+        shell:
+            ctx.bbp_env(
+                "ngv-pytouchreader",
+                [
+                    "python",
+                    script_path("glialglial_shards.py"),
+                    "--shard-dirs {input[shards]}",
+                    f"--population-name {ctx.edges_astrocytes_astrocytes_name}",
+                    "--astrocytes {input[astrocytes]}",
+                    "--out-edges {output[glialglial_connectivity]}",
+                ],
+                slurm_env="merge_glialglial_shards",
+            )
+
+else:
+
+    rule glialglial_connectivity:
+        input:
+            astrocytes=ctx.nodes_astrocytes_file,
+            touches_dir=ctx.tmp_edges_astrocytes_glialglial_touches_dir,
+        output:
+            glialglial_connectivity=ctx.edges_astrocytes_astrocytes_file,
+        log:
+            ctx.log_path("glialglial_connectivity"),
+        resources:
+            **ctx.slurm_resources("glialglial_connectivity"),
+        shell:
+            _glialglial_connectivity_cmd(
+                touches_dir="{input[touches_dir]}",
+                output="{output[glialglial_connectivity]}",
+                seed=ctx.conf.get(["ngv", "common", "seed"]),
+            )
 
 
 rule prepare_tetrahedral:
@@ -347,6 +826,8 @@ rule prepare_tetrahedral:
         script=ctx.tetrahedral_gmsh_script_file,
     log:
         ctx.log_path("prepare_tetrahedral"),
+    resources:
+        **ctx.slurm_resources("prepare_tetrahedral"),
     shell:
         ctx.bbp_env(
             "ngv-prepare-tetrahedral",
@@ -357,6 +838,7 @@ rule prepare_tetrahedral:
                 "--atlas-cache .atlas",
                 "--output-path {output.mesh}",
             ],
+            slurm_env="prepare_tetrahedral",
         )
 
 
@@ -368,6 +850,8 @@ rule build_tetrahedral:
         ctx.tetrahedral_mesh_file,
     log:
         ctx.log_path("build_tetrahedral"),
+    resources:
+        **ctx.slurm_resources("build_tetrahedral"),
     shell:
         ctx.bbp_env(
             "ngv-build-tetrahedral",
@@ -378,27 +862,42 @@ rule build_tetrahedral:
                 "-o {output}",
                 "-algo initial3d",
             ],
+            slurm_env="build_tetrahedral",
         )
 
 
+rule refine_tetrahedral_script:
+    output:
+        ctx.ngv.refine_tetrahedral_gmsh_script_file,
+    log:
+        ctx.log_path("refine_tetrahedral_script"),
+    # generates the gmsh script refining the tetrahedral mesh for the next step
+    params:
+        steps=ctx.refinement_subdividing_steps,
+    run:
+        with write_with_log(output[0], log[0]) as out:
+            ctx.ngv.write_refine_tetrahedral_script(out)
+
+
 rule refine_tetrahedral:
-    # this loop refines the provided tetrahedral mesh by subdividing its edges,
-    # i.e. at every iteration every edge is split in two sub-edges
+    # refines the provided tetrahedral mesh by subdividing its edges in a single gmsh session,
+    # i.e. at every step every edge is split in two sub-edges, and the mesh is written once
     input:
-        ctx.tetrahedral_mesh_file,
+        mesh_file=ctx.tetrahedral_mesh_file,
+        script_file=ctx.ngv.refine_tetrahedral_gmsh_script_file,
     output:
         ctx.refined_tetrahedral_mesh_file,
     log:
         ctx.log_path("refine_tetrahedral"),
+    resources:
+        **ctx.slurm_resources("refine_tetrahedral"),
     shell:
         ctx.bbp_env(
             "ngv-refine-tetrahedral",
             [
-                (
-                    "cp -v {input} tmp.msh && "
-                    f"for (( c=1; c<={ctx.refinement_subdividing_steps}; c++ )); "
-                    "do gmsh -refine tmp.msh -o tmp.msh; done && "
-                    "mv -v tmp.msh {output}"
-                )
+                "gmsh",
+                "{input.script_file}",  # input.mesh_file and output are set in input.script_file
+                "-",  # Parse the script and exit, without meshing.
             ],
+            slurm_env="refine_tetrahedral",
         )
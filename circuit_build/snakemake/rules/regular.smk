@@ -1,42 +1,67 @@
 import json
+import shutil
 from pathlib import Path
+from circuit_build.artifact_cache import CacheOptions
+from circuit_build.commands import CommandOptions
 from circuit_build.utils import (
     format_dict_to_list,
     format_if,
     if_then_else,
+    log_exceptions,
+    script_path,
     write_with_log,
 )
 
+# the empty cell collection is created in the Snakemake process when voxcell is available,
+# to avoid loading the modules and starting a new interpreter only to save an empty file
+if ctx.in_process("voxcell"):
 
-rule init_cells:
-    message:
-        "Create an empty cell collection with a correct population name. This collection will be populated further."
-    output:
-        ctx.paths.auxiliary_path("circuit.empty.h5"),
-    log:
-        ctx.log_path("init_cells"),
-    shell:
-        ctx.bbp_env(
-            "brainbuilder",
-            [
-                'echo -n "Using python: " && which python &&',
-                'python -c "from voxcell import CellCollection;',
-                f"cells = CellCollection('{ctx.nodes_neurons_name}');",
-                "cells.save('{output}');",
-                '"',
-            ],
-        )
+    rule init_cells:
+        output:
+            ctx.paths.auxiliary_path("circuit.empty.h5"),
+        log:
+            ctx.log_path("init_cells"),
+        message:
+            "Create an empty cell collection with a correct population name. This collection will be populated further."
+        run:
+            with log_exceptions(log[0]):
+                from voxcell import CellCollection
+
+                CellCollection(ctx.nodes_neurons_name).save(output[0])
+
+else:
+
+    rule init_cells:
+        output:
+            ctx.paths.auxiliary_path("circuit.empty.h5"),
+        log:
+            ctx.log_path("init_cells"),
+        message:
+            "Create an empty cell collection with a correct population name. This collection will be populated further."
+        shell:
+            ctx.bbp_env(
+                "brainbuilder",
+                [
+                    'echo -n "Using python: " && which python &&',
+                    'python -c "from voxcell import CellCollection;',
+                    f"cells = CellCollection('{ctx.nodes_neurons_name}');",
+                    "cells.save('{output}');",
+                    '"',
+                ],
+            )
 
 
 rule place_cells:
-    message:
-        "Generate cell positions; assign me-types"
     input:
         ctx.paths.auxiliary_path("circuit.empty.h5"),
     output:
         ctx.paths.auxiliary_path("circuit.somata.h5"),
     log:
         ctx.log_path("place_cells"),
+    resources:
+        **ctx.slurm_resources("place_cells"),
+    message:
+        "Generate cell positions; assign me-types"
     shell:
         ctx.bbp_env(
             "brainbuilder",
@@ -85,12 +110,19 @@ rule place_cells:
                 "{output}",
             ],
             slurm_env="place_cells",
+            cache=CacheOptions(
+                inputs=[
+                    "{input}",
+                    ctx.paths.bioname_path("cell_composition.yaml"),
+                    ctx.paths.bioname_path("mtype_taxonomy.tsv"),
+                    ctx.paths.bioname_path("mini_frequencies.tsv"),
+                    ctx.ATLAS,
+                ],
+            ),
         )
 
 
 rule choose_morphologies:
-    message:
-        "Choose morphologies/axons using 'placement hints' approach"
     input:
         ctx.paths.auxiliary_path("circuit.somata.h5"),
     output:
@@ -100,6 +132,10 @@ rule choose_morphologies:
         ),
     log:
         ctx.log_path("choose_morphologies"),
+    resources:
+        **ctx.slurm_resources("choose_morphologies"),
+    message:
+        "Choose morphologies/axons using 'placement hints' approach"
     shell:
         ctx.bbp_env(
             "placement-algorithm",
@@ -137,12 +173,19 @@ rule choose_morphologies:
                 [],
             ),
             slurm_env="choose_morphologies",
+            cache=CacheOptions(
+                inputs=[
+                    "{input}",
+                    ctx.if_synthesis(ctx.SYNTHESIZE_MORPHDB, ctx.MORPHDB),
+                    ctx.paths.bioname_path("placement_rules.xml"),
+                    Path(ctx.MORPH_RELEASE, "annotations.json"),
+                    ctx.ATLAS,
+                ],
+            ),
         )
 
 
 rule assign_morphologies:
-    message:
-        "Assign morphologies"
     input:
         cells=ctx.paths.auxiliary_path("circuit.somata.h5"),
         morph=ctx.paths.auxiliary_path("morphologies.tsv"),
@@ -150,6 +193,10 @@ rule assign_morphologies:
         ctx.paths.auxiliary_path("circuit.morphologies.h5"),
     log:
         ctx.log_path("assign_morphologies"),
+    resources:
+        **ctx.slurm_resources("assign_morphologies"),
+    message:
+        "Assign morphologies"
     shell:
         ctx.bbp_env(
             "placement-algorithm",
@@ -179,97 +226,294 @@ rule assign_morphologies:
         )
 
 
-rule synthesize_morphologies:
-    message:
-        "Synthesize morphologies"
-    input:
-        **if_then_else(
-            ctx.conf.get(["synthesize_morphologies", "synthesize_axons"], default=False),
-            {},
-            {"morph": ctx.paths.auxiliary_path("axon-morphologies.tsv")},
-        ),
-        cells=ctx.paths.auxiliary_path("circuit.somata.h5"),
-    output:
-        ctx.paths.auxiliary_path("circuit.synthesized_morphologies.h5"),
-    log:
-        ctx.log_path("synthesize_morphologies"),
-    shell:
-        ctx.bbp_env(
+def _synthesize_morphologies_cmd(
+    *, out_cells, out_morph_dir, seed, checkpoint_dir, out_debug_data_suffix=""
+):
+    """Return the command used to synthesize the morphologies of all the cells, or of a shard.
+
+    If resume is enabled, only the cells not synthesized in the previous attempts are given to
+    region-grower, and the results of all the attempts are merged to the final cell collection.
+    """
+    synthesize_axons = ctx.conf.get(["synthesize_morphologies", "synthesize_axons"], default=False)
+    max_files_per_dir = ctx.conf.get(["synthesize_morphologies", "max_files_per_dir"], default=1024)
+    input_cells = "{input[cells]}"
+    pre_command = post_command = condition = loop = None
+    if ctx.conf.get(["synthesize_morphologies", "resume"], default=False):
+        checkpoint_args = [
+            "--cells-path",
+            input_cells,
+            "--checkpoint-dir",
+            checkpoint_dir,
+            "--morph-dir",
+            out_morph_dir,
+            "--seed",
+            seed,
+            "--out-morph-ext h5",
+            "--out-morph-ext asc",
+        ]
+        script = script_path("synthesis_checkpoint.py")
+        batch_size = ctx.conf.get(["synthesize_morphologies", "resume_batch_size"], default=100000)
+        pre_command = [
+            "python",
+            script,
+            "prepare",
+            *checkpoint_args,
+            "--batch-size",
+            batch_size,
+        ]
+        post_command = ["python", script, "finalize", *checkpoint_args, "--out-cells", out_cells]
+        # the allocation is requested only if some cells are still missing,
+        # and region-grower is executed for each batch of missing cells in a separate job step
+        batches_file = Path(checkpoint_dir, "batches.txt")
+        condition = f"[ -s {batches_file} ]"
+        loop = f"batch in $(cat {batches_file})"
+        batch_dir = Path(checkpoint_dir, "batches", "$batch")
+        input_cells = batch_dir / "cells.h5"
+        out_cells = batch_dir / "synthesized.h5"
+        seed = f'"$(cat {batch_dir / "seed.txt"})"'
+        out_morph_dir = Path(out_morph_dir, "batches", "$batch")
+        out_debug_data_suffix = f"{out_debug_data_suffix}_$batch"
+    return ctx.bbp_env(
+        "region-grower",
+        [
             "region-grower",
-            [
+            "synthesize-morphologies",
+            "--input-cells",
+            input_cells,
+            "--atlas",
+            ctx.ATLAS,
+            "--atlas-cache",
+            ctx.ATLAS_CACHE_DIR,
+            "--max-drop-ratio",
+            ctx.conf.get(["synthesize_morphologies", "max_drop_ratio"], default=0.0),
+            "--out-cells",
+            out_cells,
+            "--tmd-distributions",
+            ctx.paths.bioname_path("tmd_distributions.json"),
+            "--tmd-parameters",
+            ctx.paths.bioname_path("tmd_parameters.json"),
+            "--region-structure",
+            ctx.paths.bioname_path("region_structure.yaml"),
+            if_then_else(synthesize_axons, "", "--morph-axon {input[morph]}"),
+            "--base-morph-dir",
+            Path(ctx.MORPH_RELEASE, "h5v1"),
+            "--seed",
+            seed,
+            "--out-apical",
+            f"{out_morph_dir}/apical.yaml",
+            "--out-apical-nrn-sections",
+            f"{out_morph_dir}/apical_nrn_isec.yaml",
+            "--out-morph-dir",
+            out_morph_dir,
+            "--max-files-per-dir",
+            max_files_per_dir,
+            "--out-morph-ext h5",
+            "--out-morph-ext asc",
+            if_then_else(ctx.dask_managed("synthesize_morphologies"), "", "--with-mpi"),
+            format_if(
+                "--scaling-jitter-std {}",
+                ctx.conf.get(["synthesize_morphologies", "scaling_jitter_std"]),
+            ),
+            format_if(
+                "--rotational-jitter-std {}",
+                ctx.conf.get(["synthesize_morphologies", "rotational_jitter_std"]),
+            ),
+            format_if(
+                "--out-debug-data {}",
+                ctx.conf.get(["synthesize_morphologies", "out_debug_data"]),
+                func=lambda x: f"{x}{out_debug_data_suffix}",
+            ),
+            format_if(
+                "--log-level {}",
+                ctx.conf.get(["synthesize_morphologies", "log_level"]),
+            ),
+            if_then_else(synthesize_axons, "--synthesize-axons", ""),
+        ],
+        slurm_env="synthesize_morphologies",
+        options=CommandOptions(
+            pre_cmd=pre_command, post_cmd=post_command, condition=condition, loop=loop
+        ),
+    )
+
+
+if ctx.synthesis_shards > 1:
+
+    rule split_synthesis_shards:
+        input:
+            ctx.paths.auxiliary_path("circuit.somata.h5"),
+        output:
+            cells=[
+                ctx.paths.auxiliary_path(f"synthesis_shards/cells_{shard}.h5")
+                for shard in range(ctx.synthesis_shards)
+            ],
+            seeds=[
+                ctx.paths.auxiliary_path(f"synthesis_shards/seed_{shard}.txt")
+                for shard in range(ctx.synthesis_shards)
+            ],
+        log:
+            ctx.log_path("split_synthesis_shards"),
+        resources:
+            **ctx.slurm_resources("split_synthesis_shards"),
+        message:
+            "Split the cells to be synthesized in shards grouped by mtype"
+        shell:
+            ctx.bbp_env(
                 "region-grower",
-                "synthesize-morphologies",
-                "--input-cells",
-                "{input[cells]}",
-                "--atlas",
-                ctx.ATLAS,
-                "--atlas-cache",
-                ctx.ATLAS_CACHE_DIR,
-                "--max-drop-ratio",
-                ctx.conf.get(["synthesize_morphologies", "max_drop_ratio"], default=0.0),
-                "--out-cells",
-                "{output}",
-                "--tmd-distributions",
-                ctx.paths.bioname_path("tmd_distributions.json"),
-                "--tmd-parameters",
-                ctx.paths.bioname_path("tmd_parameters.json"),
-                "--region-structure",
-                ctx.paths.bioname_path("region_structure.yaml"),
-                if_then_else(
-                    ctx.conf.get(["synthesize_morphologies", "synthesize_axons"], default=False),
-                    "",
-                    "--morph-axon {input[morph]}",
-                ),
-                "--base-morph-dir",
-                Path(ctx.MORPH_RELEASE, "h5v1"),
-                "--seed",
-                ctx.conf.get(["synthesize_morphologies", "seed"], default=0),
-                "--out-apical",
-                Path(ctx.SYNTHESIZE_MORPH_DIR, "apical.yaml"),
-                "--out-apical-nrn-sections",
-                Path(ctx.SYNTHESIZE_MORPH_DIR, "apical_nrn_isec.yaml"),
-                "--out-morph-dir",
-                ctx.SYNTHESIZE_MORPH_DIR,
-                "--max-files-per-dir",
-                ctx.conf.get(["synthesize_morphologies", "max_files_per_dir"], default=1024),
-                "--out-morph-ext h5",
-                "--out-morph-ext asc",
-                "--with-mpi",
-                format_if(
-                    "--scaling-jitter-std {}",
-                    ctx.conf.get(["synthesize_morphologies", "scaling_jitter_std"]),
-                ),
-                format_if(
-                    "--rotational-jitter-std {}",
-                    ctx.conf.get(["synthesize_morphologies", "rotational_jitter_std"]),
-                ),
-                format_if(
-                    "--out-debug-data {}",
-                    ctx.conf.get(["synthesize_morphologies", "out_debug_data"]),
-                ),
-                format_if(
-                    "--log-level {}",
-                    ctx.conf.get(["synthesize_morphologies", "log_level"]),
-                ),
-                if_then_else(
-                    ctx.conf.get(["synthesize_morphologies", "synthesize_axons"], default=False),
-                    "--synthesize-axons",
-                    "",
+                [
+                    "python",
+                    script_path("synthesis_shards.py"),
+                    "split",
+                    "--cells-path",
+                    "{input}",
+                    "--seed",
+                    ctx.conf.get(["synthesize_morphologies", "seed"], default=0),
+                    "--out-cells",
+                    "{output[cells]}",
+                    "--out-seeds",
+                    "{output[seeds]}",
+                ],
+                slurm_env="split_synthesis_shards",
+            )
+
+    rule synthesize_morphologies_shard:
+        input:
+            **if_then_else(
+                ctx.conf.get(["synthesize_morphologies", "synthesize_axons"], default=False),
+                {},
+                {"morph": ctx.paths.auxiliary_path("axon-morphologies.tsv")},
+            ),
+            cells=ctx.paths.auxiliary_path("synthesis_shards/cells_{shard}.h5"),
+            seed=ctx.paths.auxiliary_path("synthesis_shards/seed_{shard}.txt"),
+        output:
+            # the morphologies are kept when resume is enabled
+            **if_then_else(
+                ctx.conf.get(["synthesize_morphologies", "resume"], default=False),
+                {},
+                {"morph_dir": directory(str(Path(ctx.SYNTHESIZE_MORPH_DIR, "shards", "{shard}")))},
+            ),
+            cells=ctx.paths.auxiliary_path("synthesis_shards/synthesized_{shard}.h5"),
+        log:
+            ctx.log_path("synthesize_morphologies_{shard}"),
+        wildcard_constraints:
+            shard=r"\d+",
+        threads: ctx.local_threads("synthesize_morphologies", workflow.cores)
+        resources:
+            **ctx.slurm_resources("synthesize_morphologies"),
+        message:
+            "Synthesize morphologies of the shard {wildcards.shard}"
+        shell:
+            _synthesize_morphologies_cmd(
+                out_cells="{output[cells]}",
+                out_morph_dir=Path(ctx.SYNTHESIZE_MORPH_DIR, "shards", "{wildcards.shard}"),
+                seed='"$(cat {input[seed]})"',
+                checkpoint_dir=ctx.paths.auxiliary_path(
+                    "synthesis_shards/checkpoint_{wildcards.shard}"
                 ),
-            ],
-            slurm_env="synthesize_morphologies",
-        )
+                out_debug_data_suffix="_{wildcards.shard}",
+            )
+
+    rule synthesize_morphologies:
+        input:
+            expand(
+                ctx.paths.auxiliary_path("synthesis_shards/synthesized_{shard}.h5"),
+                shard=range(ctx.synthesis_shards),
+            ),
+        output:
+            ctx.paths.auxiliary_path("circuit.synthesized_morphologies.h5"),
+        log:
+            ctx.log_path("synthesize_morphologies"),
+        resources:
+            **ctx.slurm_resources("merge_synthesis_shards"),
+        message:
+            "Merge the synthesized shards"
+        shell:
+            ctx.bbp_env(
+                "region-grower",
+                [
+                    "python",
+                    script_path("synthesis_shards.py"),
+                    "merge",
+                    "--shard-cells",
+                    "{input}",
+                    "--shard-dirs",
+                    *(
+                        Path(ctx.SYNTHESIZE_MORPH_DIR, "shards", str(shard))
+                        for shard in range(ctx.synthesis_shards)
+                    ),
+                    "--morph-dir",
+                    ctx.SYNTHESIZE_MORPH_DIR,
+                    "--out-cells",
+                    "{output}",
+                ],
+                slurm_env="merge_synthesis_shards",
+            )
+
+else:
+
+    rule synthesize_morphologies:
+        input:
+            **if_then_else(
+                ctx.conf.get(["synthesize_morphologies", "synthesize_axons"], default=False),
+                {},
+                {"morph": ctx.paths.auxiliary_path("axon-morphologies.tsv")},
+            ),
+            cells=ctx.paths.auxiliary_path("circuit.somata.h5"),
+        output:
+            ctx.paths.auxiliary_path("circuit.synthesized_morphologies.h5"),
+        log:
+            ctx.log_path("synthesize_morphologies"),
+        threads: ctx.local_threads("synthesize_morphologies", workflow.cores)
+        resources:
+            **ctx.slurm_resources("synthesize_morphologies"),
+        message:
+            "Synthesize morphologies"
+        shell:
+            _synthesize_morphologies_cmd(
+                out_cells="{output}",
+                out_morph_dir=ctx.SYNTHESIZE_MORPH_DIR,
+                seed=ctx.conf.get(["synthesize_morphologies", "seed"], default=0),
+                checkpoint_dir=ctx.paths.auxiliary_path("synthesis_checkpoint"),
+            )
+
+
+if ctx.synthesis_container:
+
+    rule synthesized_morphologies_container:
+        input:
+            ctx.paths.auxiliary_path("circuit.synthesized_morphologies.h5"),
+        output:
+            ctx.synthesized_morphologies_container_file,
+        log:
+            ctx.log_path("synthesized_morphologies_container"),
+        resources:
+            **ctx.slurm_resources("synthesized_morphologies_container"),
+        message:
+            "Pack the synthesized morphologies in a merged container"
+        shell:
+            ctx.bbp_env(
+                "region-grower",
+                [
+                    "python",
+                    script_path("morphology_container.py"),
+                    "--morph-dir",
+                    ctx.SYNTHESIZE_MORPH_DIR,
+                    "--out-path {output}",
+                ],
+                slurm_env="synthesized_morphologies_container",
+            )
 
 
 rule assign_emodels:
-    message:
-        "Assign electrical models"
     input:
         ctx.paths.auxiliary_path("circuit.morphologies.h5"),
     output:
         ctx.paths.auxiliary_path("circuit.h5"),
     log:
         ctx.log_path("assign_emodels_per_type"),
+    resources:
+        **ctx.slurm_resources("assign_emodels"),
+    message:
+        "Assign electrical models"
     shell:
         ctx.bbp_env(
             "brainbuilder",
@@ -287,14 +531,16 @@ rule assign_emodels:
 
 
 rule provide_me_info:
-    message:
-        "Provide MorphoElectrical info for SONATA nodes"
     input:
         ctx.paths.auxiliary_path("circuit.h5"),
     output:
         ctx.nodes_neurons_file,
     log:
         ctx.log_path("provide_me_info"),
+    resources:
+        **ctx.slurm_resources("provide_me_info"),
+    message:
+        "Provide MorphoElectrical info for SONATA nodes"
     shell:
         ctx.bbp_env(
             "brainbuilder",
@@ -312,28 +558,32 @@ rule provide_me_info:
 if ctx.NO_EMODEL:
 
     rule bypass_emodel:
-        message:
-            "Bypass any emodel related tasks"
         input:
             ctx.paths.auxiliary_path("circuit.synthesized_morphologies.h5"),
         output:
             ctx.nodes_neurons_file,
         log:
             ctx.log_path("bypass_emodel"),
-        shell:
-            "cp -v {input} {output}"
+        message:
+            "Bypass any emodel related tasks"
+        run:
+            with log_exceptions(log[0]) as lf:
+                shutil.copyfile(input[0], output[0])
+                lf.write(f"{input[0]} -> {output[0]}\n")
 
 else:
 
     rule assign_synthesis_emodels:
-        message:
-            "Assign emodels for synthesis"
         input:
             ctx.paths.auxiliary_path("circuit.synthesized_morphologies.h5"),
         output:
             ctx.paths.auxiliary_path("circuit.assign_synthesis_emodels.h5"),
         log:
             ctx.log_path("assign_synthesis_emodel"),
+        resources:
+            **ctx.slurm_resources("assign_synthesis_emodels"),
+        message:
+            "Assign emodels for synthesis"
         shell:
             ctx.bbp_env(
                 "emodel-generalisation",
@@ -349,72 +599,249 @@ else:
                 slurm_env="assign_synthesis_emodels",
             )
 
-    rule adapt_emodels:
-        message:
-            "Adapt AIS and soma scales and add the column @dynamics:ais_scaler and @dynamics:soma_scale to SONATA nodes"
-        input:
-            ctx.paths.auxiliary_path("circuit.assign_synthesis_emodels.h5"),
-        output:
-            ctx.paths.auxiliary_path("circuit.adapt_emodels.h5"),
-        log:
-            ctx.log_path("adapt_emodels"),
-        shell:
-            ctx.bbp_env(
-                "emodel-generalisation",
-                [
-                    "emodel-generalisation -v adapt",
-                    "--input-node-path",
-                    "{input}",
-                    "--morphology-path",
-                    ctx.SYNTHESIZE_MORPH_DIR,
-                    "--config-path",
-                    Path(ctx.SYNTHESIZE_EMODEL_RELEASE) / "config",
-                    "--output-node-path",
-                    "{output}",
-                    "--output-hoc-path",
-                    ctx.EMODEL_RELEASE_HOC,
-                    "--parallel-lib",
-                    "dask_dataframe",
-                    "--max-scale",
-                    3.0,
-                    "--min-scale",
-                    0.8,
-                ],
-                slurm_env="adapt_emodels",
-            )
+    _EMODEL_CHUNKS_INPUT = {
+        "adapt_emodels": ctx.paths.auxiliary_path("circuit.assign_synthesis_emodels.h5"),
+        "compute_currents": ctx.paths.auxiliary_path("circuit.adapt_emodels.h5"),
+    }
+    if any(ctx.emodel_chunks(name) > 1 for name in _EMODEL_CHUNKS_INPUT):
 
-    rule compute_currents:
-        message:
-            "Compute currents for SONATA nodes, assigning the column @dynamics:holding_currents, @dynamics:threshold_currents, @dynamics:resting_potential and @dynamics:input_resistance"
-        input:
-            ctx.paths.auxiliary_path("circuit.adapt_emodels.h5"),
-        output:
-            ctx.nodes_neurons_file,
-        log:
-            ctx.log_path("compute_currents"),
-        shell:
-            ctx.bbp_env(
-                "emodel-generalisation",
-                [
-                    "emodel-generalisation -v compute_currents",
-                    "--input-path",
-                    "{input}",
-                    "--morphology-path",
-                    ctx.SYNTHESIZE_MORPH_DIR,
-                    "--output-path",
-                    "{output}",
-                    "--hoc-path",
-                    ctx.EMODEL_RELEASE_HOC,
-                    "--parallel-lib",
-                    "dask_dataframe",
-                ],
-                slurm_env="compute_currents",
-            )
+        rule split_emodel_chunks:
+            input:
+                cells=lambda wildcards: _EMODEL_CHUNKS_INPUT[wildcards.emodel_rule],
+            output:
+                directory(ctx.paths.auxiliary_path("emodel_chunks/{emodel_rule}/inputs")),
+            log:
+                ctx.log_path("split_emodel_chunks_{emodel_rule}"),
+            wildcard_constraints:
+                emodel_rule="|".join(_EMODEL_CHUNKS_INPUT),
+            resources:
+                **ctx.slurm_resources("split_emodel_chunks"),
+            params:
+                n_chunks=lambda wildcards: ctx.emodel_chunks(wildcards.emodel_rule),
+            message:
+                "Split the input cells of {wildcards.emodel_rule} in chunks"
+            shell:
+                ctx.bbp_env(
+                    "emodel-generalisation",
+                    [
+                        "python",
+                        script_path("emodel_chunks.py"),
+                        "split",
+                        "--cells-path",
+                        "{input[cells]}",
+                        "--n-chunks",
+                        "{params[n_chunks]}",
+                        "--out-dir",
+                        "{output}",
+                    ],
+                    slurm_env="split_emodel_chunks",
+                )
+
+    def _adapt_emodels_cmd(*, input_cells, output_hoc_path, local_dir=None):
+        """Return the command used to adapt the emodels of all the cells, or of a chunk."""
+        return ctx.bbp_env(
+            "emodel-generalisation",
+            [
+                "emodel-generalisation -v adapt",
+                "--input-node-path",
+                input_cells,
+                "--morphology-path",
+                ctx.SYNTHESIZE_MORPH_DIR,
+                "--config-path",
+                Path(ctx.SYNTHESIZE_EMODEL_RELEASE) / "config",
+                "--output-node-path",
+                "{output[cells]}",
+                "--output-hoc-path",
+                output_hoc_path,
+                *if_then_else(local_dir is None, [], ["--local-dir", local_dir]),
+                "--parallel-lib",
+                "dask_dataframe",
+                "--max-scale",
+                3.0,
+                "--min-scale",
+                0.8,
+            ],
+            slurm_env="adapt_emodels",
+        )
+
+    def _compute_currents_cmd(*, input_cells):
+        """Return the command used to compute the currents of all the cells, or of a chunk."""
+        return ctx.bbp_env(
+            "emodel-generalisation",
+            [
+                "emodel-generalisation -v compute_currents",
+                "--input-path",
+                input_cells,
+                "--morphology-path",
+                ctx.SYNTHESIZE_MORPH_DIR,
+                "--output-path",
+                "{output[cells]}",
+                "--hoc-path",
+                ctx.EMODEL_RELEASE_HOC,
+                "--parallel-lib",
+                "dask_dataframe",
+            ],
+            slurm_env="compute_currents",
+        )
+
+    if ctx.emodel_chunks("adapt_emodels") > 1:
+
+        rule adapt_emodels_chunk:
+            input:
+                chunks_dir=ctx.paths.auxiliary_path("emodel_chunks/adapt_emodels/inputs"),
+            output:
+                cells=ctx.paths.auxiliary_path("emodel_chunks/adapt_emodels/output_{chunk}.h5"),
+                hoc=directory(ctx.paths.auxiliary_path("emodel_chunks/adapt_emodels/hoc_{chunk}")),
+            log:
+                ctx.log_path("adapt_emodels_{chunk}"),
+            wildcard_constraints:
+                chunk=r"\d+",
+            threads: ctx.local_threads("adapt_emodels", workflow.cores)
+            resources:
+                **ctx.slurm_resources("adapt_emodels"),
+            message:
+                "Adapt AIS and soma scales of the cells in the chunk {wildcards.chunk}"
+            shell:
+                _adapt_emodels_cmd(
+                    input_cells="{input[chunks_dir]}/input_{wildcards.chunk}.h5",
+                    output_hoc_path="{output[hoc]}",
+                    # the intermediate results are reused if the chunk is executed again
+                    local_dir=ctx.paths.auxiliary_path(
+                        "emodel_chunks/adapt_emodels/local_{wildcards.chunk}"
+                    ),
+                )
+
+        rule adapt_emodels:
+            input:
+                cells=ctx.paths.auxiliary_path("circuit.assign_synthesis_emodels.h5"),
+                chunks=expand(
+                    ctx.paths.auxiliary_path("emodel_chunks/adapt_emodels/output_{chunk}.h5"),
+                    chunk=range(ctx.emodel_chunks("adapt_emodels")),
+                ),
+                hoc=expand(
+                    ctx.paths.auxiliary_path("emodel_chunks/adapt_emodels/hoc_{chunk}"),
+                    chunk=range(ctx.emodel_chunks("adapt_emodels")),
+                ),
+            output:
+                cells=ctx.paths.auxiliary_path("circuit.adapt_emodels.h5"),
+            log:
+                ctx.log_path("adapt_emodels"),
+            resources:
+                **ctx.slurm_resources("merge_emodel_chunks"),
+            message:
+                "Merge the columns @dynamics:ais_scaler and @dynamics:soma_scale of the chunks"
+            shell:
+                ctx.bbp_env(
+                    "emodel-generalisation",
+                    [
+                        "python",
+                        script_path("emodel_chunks.py"),
+                        "merge",
+                        "--cells-path",
+                        "{input[cells]}",
+                        "--chunk-cells",
+                        "{input[chunks]}",
+                        "--hoc-dirs",
+                        "{input[hoc]}",
+                        "--out-hoc-dir",
+                        ctx.EMODEL_RELEASE_HOC,
+                        "--out-cells",
+                        "{output[cells]}",
+                    ],
+                    slurm_env="merge_emodel_chunks",
+                )
+
+    else:
+
+        rule adapt_emodels:
+            input:
+                cells=ctx.paths.auxiliary_path("circuit.assign_synthesis_emodels.h5"),
+            output:
+                cells=ctx.paths.auxiliary_path("circuit.adapt_emodels.h5"),
+            log:
+                ctx.log_path("adapt_emodels"),
+            threads: ctx.local_threads("adapt_emodels", workflow.cores)
+            resources:
+                **ctx.slurm_resources("adapt_emodels"),
+            message:
+                "Adapt AIS and soma scales and add the column @dynamics:ais_scaler and @dynamics:soma_scale to SONATA nodes"
+            shell:
+                _adapt_emodels_cmd(
+                    input_cells="{input[cells]}", output_hoc_path=ctx.EMODEL_RELEASE_HOC
+                )
+
+    if ctx.emodel_chunks("compute_currents") > 1:
+
+        rule compute_currents_chunk:
+            input:
+                chunks_dir=ctx.paths.auxiliary_path("emodel_chunks/compute_currents/inputs"),
+            output:
+                cells=ctx.paths.auxiliary_path("emodel_chunks/compute_currents/output_{chunk}.h5"),
+            log:
+                ctx.log_path("compute_currents_{chunk}"),
+            wildcard_constraints:
+                chunk=r"\d+",
+            threads: ctx.local_threads("compute_currents", workflow.cores)
+            resources:
+                **ctx.slurm_resources("compute_currents"),
+            message:
+                "Compute currents of the cells in the chunk {wildcards.chunk}"
+            shell:
+                _compute_currents_cmd(
+                    input_cells="{input[chunks_dir]}/input_{wildcards.chunk}.h5",
+                )
+
+        rule compute_currents:
+            input:
+                cells=ctx.paths.auxiliary_path("circuit.adapt_emodels.h5"),
+                chunks=expand(
+                    ctx.paths.auxiliary_path("emodel_chunks/compute_currents/output_{chunk}.h5"),
+                    chunk=range(ctx.emodel_chunks("compute_currents")),
+                ),
+            output:
+                cells=ctx.nodes_neurons_file,
+            log:
+                ctx.log_path("compute_currents"),
+            resources:
+                **ctx.slurm_resources("merge_emodel_chunks"),
+            message:
+                "Merge the columns @dynamics:holding_currents, @dynamics:threshold_currents, @dynamics:resting_potential and @dynamics:input_resistance of the chunks"
+            shell:
+                ctx.bbp_env(
+                    "emodel-generalisation",
+                    [
+                        "python",
+                        script_path("emodel_chunks.py"),
+                        "merge",
+                        "--cells-path",
+                        "{input[cells]}",
+                        "--chunk-cells",
+                        "{input[chunks]}",
+                        "--out-cells",
+                        "{output[cells]}",
+                    ],
+                    slurm_env="merge_emodel_chunks",
+                )
+
+    else:
+
+        rule compute_currents:
+            input:
+                cells=ctx.paths.auxiliary_path("circuit.adapt_emodels.h5"),
+            output:
+                cells=ctx.nodes_neurons_file,
+            log:
+                ctx.log_path("compute_currents"),
+            threads: ctx.local_threads("compute_currents", workflow.cores)
+            resources:
+                **ctx.slurm_resources("compute_currents"),
+            message:
+                "Compute currents for SONATA nodes, assigning the column @dynamics:holding_currents, @dynamics:threshold_currents, @dynamics:resting_potential and @dynamics:input_resistance"
+            shell:
+                _compute_currents_cmd(input_cells="{input[cells]}")
 
 
 rule touchdetector:
-    message:
-        "Detect touches between neurites"
     input:
         circuit_config=ctx.paths.auxiliary_path("circuit_config_hpc.json"),
     output:
@@ -425,8 +852,14 @@ rule touchdetector:
         ),
     log:
         ctx.log_path(f"touchdetector{ctx.partition_wildcard()}"),
+    threads: ctx.local_threads("touchdetector", workflow.cores)
+    resources:
+        **ctx.slurm_resources("touchdetector"),
     params:
         output_dir=lambda wildcards, output: Path(output.success).parent,
+        recipe_digest=lambda wildcards: ctx.recipe_digest("touchdetector"),
+    message:
+        "Detect touches between neurites"
     shell:
         ctx.bbp_env(
             "touchdetector",
@@ -454,8 +887,6 @@ rule touchdetector:
 
 
 rule touch2parquet:
-    message:
-        "Convert TouchDetector output to Parquet synapse files"
     input:
         ctx.tmp_edges_neurons_chemical_connectome_path(
             f"touches{ctx.partition_wildcard()}/raw/_SUCCESS",
@@ -468,8 +899,13 @@ rule touch2parquet:
         ),
     log:
         ctx.log_path(f"touch2parquet{ctx.partition_wildcard()}"),
+    resources:
+        **ctx.slurm_resources("touch2parquet"),
+    message:
+        "Convert TouchDetector output to Parquet synapse files"
     shell:
-        "mkdir -p {output.parquet_dir} && " + ctx.bbp_env(
+        "mkdir -p {output.parquet_dir} && "
+        + ctx.bbp_env(
             "parquet-converters",
             ["cd {output.parquet_dir}", "&&", "touch2parquet ../raw/touchesData.*"],
             slurm_env="touch2parquet",
@@ -477,8 +913,6 @@ rule touch2parquet:
 
 
 rule spykfunc_s2s:
-    message:
-        "Convert touches into synapses (S2S)"
     input:
         **ctx.if_partition({"nodesets": ctx.NODESETS_FILE}, {}),
         neurons=ctx.if_synthesis(
@@ -494,16 +928,20 @@ rule spykfunc_s2s:
         ),
     log:
         ctx.log_path(f"spykfunc_s2s{ctx.partition_wildcard()}"),
+    threads: ctx.local_threads("spykfunc_s2s", workflow.cores)
+    resources:
+        **ctx.slurm_resources("spykfunc_s2s"),
     params:
         parquet_dirs=lambda wildcards, input: Path(input.touches, "*.parquet"),
         output_dir=lambda wildcards, output: Path(output.success).parent.parent,
+        recipe_digest=lambda wildcards: ctx.recipe_digest("spykfunc_s2s"),
+    message:
+        "Convert touches into synapses (S2S)"
     shell:
         ctx.run_spykfunc("spykfunc_s2s")
 
 
 rule spykfunc_s2f:
-    message:
-        "Prune touches and convert them into synapses (S2F)"
     input:
         **ctx.if_partition({"nodesets": ctx.NODESETS_FILE}, {}),
         neurons=ctx.if_synthesis(
@@ -519,16 +957,20 @@ rule spykfunc_s2f:
         ),
     log:
         ctx.log_path(f"spykfunc_s2f{ctx.partition_wildcard()}"),
+    threads: ctx.local_threads("spykfunc_s2f", workflow.cores)
+    resources:
+        **ctx.slurm_resources("spykfunc_s2f"),
     params:
         parquet_dirs=lambda wildcards, input: Path(input.touches, "*.parquet"),
         output_dir=lambda wildcards, output: Path(output.success).parent.parent,
+        recipe_digest=lambda wildcards: ctx.recipe_digest("spykfunc_s2f"),
+    message:
+        "Prune touches and convert them into synapses (S2F)"
     shell:
         ctx.run_spykfunc("spykfunc_s2f")
 
 
 rule spykfunc_merge:
-    message:
-        "Merge synapses from different nodesets."
     input:
         expand(
             ctx.tmp_edges_neurons_chemical_connectome_path(
@@ -542,16 +984,19 @@ rule spykfunc_merge:
         ),
     log:
         ctx.log_path("spykfunc_merge_{connectome_dir}"),
+    threads: ctx.local_threads("spykfunc_merge", workflow.cores)
+    resources:
+        **ctx.slurm_resources("spykfunc_merge"),
     params:
         parquet_dirs=lambda wildcards, input: " ".join(str(Path(i).parent) for i in input),
         output_dir=lambda wildcards, output: Path(output.success).parent.parent,
+    message:
+        "Merge synapses from different nodesets."
     shell:
         ctx.run_spykfunc("spykfunc_merge")
 
 
 rule node_sets:
-    message:
-        "Generate SONATA node sets"
     input:
         ctx.if_synthesis(
             ctx.paths.auxiliary_path("circuit.synthesized_morphologies.h5"),
@@ -561,6 +1006,10 @@ rule node_sets:
         ctx.NODESETS_FILE,
     log:
         ctx.log_path("node_sets"),
+    resources:
+        **ctx.slurm_resources("node_sets"),
+    message:
+        "Generate SONATA node sets"
     shell:
         ctx.bbp_env(
             "brainbuilder",
@@ -590,14 +1039,17 @@ rule node_sets:
 
 
 rule spatial_index_segment:
-    message:
-        "Generate segment spatial index"
     input:
         ctx.nodes_neurons_file,
     output:
         ctx.nodes_spatial_index_success_file,
     log:
         ctx.log_path("spatial_index_segment"),
+    threads: ctx.local_threads("spatial_index_segment", workflow.cores)
+    resources:
+        **ctx.slurm_resources("spatial_index_segment"),
+    message:
+        "Generate segment spatial index"
     shell:
         ctx.bbp_env(
             "spatialindexer",
@@ -617,8 +1069,6 @@ rule spatial_index_segment:
 
 
 rule spatial_index_synapse:
-    message:
-        "Generate synapse spatial index"
     input:
         ctx.edges_neurons_neurons_file(connectome_type="functional"),
     output:
@@ -626,6 +1076,11 @@ rule spatial_index_synapse:
         directory(ctx.edges_spatial_index_dir),
     log:
         ctx.log_path("spatial_index_synapse"),
+    threads: ctx.local_threads("spatial_index_synapse", workflow.cores)
+    resources:
+        **ctx.slurm_resources("spatial_index_synapse"),
+    message:
+        "Generate synapse spatial index"
     shell:
         ctx.bbp_env(
             "spatialindexer",
@@ -644,8 +1099,6 @@ rule spatial_index_synapse:
 
 
 rule parquet_to_sonata:
-    message:
-        "Convert synapses from Parquet to SONATA format"
     input:
         ctx.tmp_edges_neurons_chemical_connectome_path(
             "{connectome_dir}/spykfunc/circuit.parquet/_SUCCESS",
@@ -654,6 +1107,10 @@ rule parquet_to_sonata:
         ctx.edges_neurons_neurons_file(connectome_type="{connectome_dir}"),
     log:
         ctx.log_path("parquet_to_sonata_{connectome_dir}"),
+    resources:
+        **ctx.slurm_resources("parquet_to_sonata"),
+    message:
+        "Convert synapses from Parquet to SONATA format"
     shell:
         ctx.bbp_env(
             "parquet-converters",
@@ -670,8 +1127,6 @@ rule parquet_to_sonata:
 
 
 rule subcellular:
-    message:
-        "Assign gene expressions / protein concentrations to cells"
     input:
         file=ctx.paths.auxiliary_path("circuit.h5"),
         directory="subcellular",
@@ -679,6 +1134,10 @@ rule subcellular:
         "subcellular.h5",
     log:
         ctx.log_path("subcellular"),
+    resources:
+        **ctx.slurm_resources("subcellular"),
+    message:
+        "Assign gene expressions / protein concentrations to cells"
     shell:
         ctx.bbp_env(
             "brainbuilder",
@@ -698,35 +1157,37 @@ rule subcellular:
 
 
 rule circuitconfig_sonata:
-    message:
-        "Generate SONATA network config"
     output:
         "sonata/circuit_config.json",
     log:
         ctx.log_path("circuitconfig_sonata"),
+    message:
+        "Generate SONATA network config"
     run:
         with write_with_log(output[0], log[0]) as out:
             ctx.write_network_config(connectome_dir="functional", output_file=out)
 
 
-
 rule circuitconfig_struct_sonata:
-    message:
-        "Generate SONATA network config (structural)"
     output:
         "sonata/struct_circuit_config.json",
     log:
         ctx.log_path("circuitconfig_struct_sonata"),
+    message:
+        "Generate SONATA network config (structural)"
     run:
         with write_with_log(output[0], log[0]) as out:
             ctx.write_network_config(connectome_dir="structural", output_file=out)
 
 
 rule circuitconfig_hpc:
-    message:
-        "Generate SONATA network config (touchdetector and spykfunc)"
     input:
         **ctx.if_partition({"nodesets": ctx.NODESETS_FILE}, {}),
+        **if_then_else(
+            ctx.synthesis_container,
+            {"morphologies_container": ctx.synthesized_morphologies_container_file},
+            {},
+        ),
         neurons=ctx.if_synthesis(
             ctx.paths.auxiliary_path("circuit.synthesized_morphologies.h5"),
             ctx.nodes_neurons_file,
@@ -735,6 +1196,8 @@ rule circuitconfig_hpc:
         ctx.paths.auxiliary_path("circuit_config_hpc.json"),
     log:
         ctx.log_path("circuitconfig_hpc"),
+    message:
+        "Generate SONATA network config (touchdetector and spykfunc)"
     run:
         with write_with_log(output[0], log[0]) as out:
             ctx.write_network_config(
@@ -751,6 +1214,7 @@ rule functional:
         ctx.NODESETS_FILE,
         ctx.nodes_neurons_file,
         ctx.edges_neurons_neurons_file(connectome_type="functional"),
+        *if_then_else(ctx.synthesis_container, [ctx.synthesized_morphologies_container_file], []),
         *ctx.if_no_index(
             [],
             [
@@ -766,3 +1230,4 @@ rule structural:
         ctx.NODESETS_FILE,
         ctx.nodes_neurons_file,
         ctx.edges_neurons_neurons_file(connectome_type="structural"),
+        *if_then_else(ctx.synthesis_container, [ctx.synthesized_morphologies_container_file], []),
@@ -0,0 +1,117 @@
+"""Start a Dask cluster in the Slurm allocation, and execute a command connected to it.
+
+The script should be executed by all the tasks of the allocation with ``srun``:
+
+- the task 0 starts the scheduler, that writes the performance report when it's closed,
+- the task 1 waits for the workers, executes the command, and shuts down the cluster,
+- the other tasks start one worker each.
+
+The command is executed with the environment variables ``DASK_SCHEDULER_ADDRESS`` and
+``PARALLEL_DASK_SCHEDULER_PATH``, so that the Dask clients created by region-grower
+and emodel-generalisation connect to the existing scheduler.
+
+This script is executed in the environment of the tools using Dask,
+so it should depend only on the packages available in that environment.
+"""
+
+import argparse
+import contextlib
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+# environment variable used to pass the path of the report to the scheduler preload
+REPORT_ENV_VAR = "CIRCUIT_BUILD_DASK_PERFORMANCE_REPORT"
+SCHEDULER_RANK = 0
+CLIENT_RANK = 1
+
+
+def dask_setup(scheduler):
+    """Start recording the tasks, when the script is loaded as scheduler preload."""
+    # ensure that the task stream plugin is registered before any task is executed
+    scheduler.get_task_stream(start=0, stop=0)
+    scheduler.circuit_build_report_start = (time.time(), scheduler.monitor.count)
+
+
+async def dask_teardown(scheduler):
+    """Write the performance report, when the script is loaded as scheduler preload."""
+    path = os.environ.get(REPORT_ENV_VAR)
+    if not path:
+        return
+    start, last_count = scheduler.circuit_build_report_start
+    html = await scheduler.performance_report(start=start, last_count=last_count)
+    Path(path).write_text(html, encoding="utf-8")
+
+
+def cluster_paths(log_path, job_id):
+    """Return the paths of the scheduler file and of the performance report."""
+    prefix = str(Path(log_path).with_suffix(""))
+    return Path(f"{prefix}_dask_scheduler_{job_id}.json"), Path(f"{prefix}_dask_report.html")
+
+
+def run_scheduler(scheduler_file, report_path):
+    """Start the scheduler, and return when it's closed."""
+    env = {**os.environ, REPORT_ENV_VAR: str(report_path)}
+    cmd = [
+        *[sys.executable, "-m", "distributed.cli.dask_scheduler"],
+        *["--scheduler-file", str(scheduler_file), "--no-dashboard", "--preload", __file__],
+    ]
+    return subprocess.run(cmd, env=env, check=False).returncode
+
+
+def run_worker(scheduler_file, memory_limit):
+    """Start a worker, and return when the cluster is closed."""
+    cmd = [
+        *[sys.executable, "-m", "distributed.cli.dask_worker"],
+        *["--scheduler-file", str(scheduler_file), "--no-dashboard"],
+        *["--nworkers", "1", "--nthreads", "1", "--memory-limit", str(memory_limit)],
+    ]
+    return subprocess.run(cmd, check=False).returncode
+
+
+def run_client(command, scheduler_file, n_workers):
+    """Execute the command when the workers are ready, and shut down the cluster."""
+    # pylint: disable=import-outside-toplevel
+    from distributed import Client
+
+    client = Client(scheduler_file=str(scheduler_file))
+    try:
+        client.wait_for_workers(n_workers)
+        print(f"Dask cluster ready at {client.scheduler.address} with {n_workers} workers")
+        # remove the PMI variables, so that MPI is initialized only in the current process
+        env = {k: v for k, v in os.environ.items() if not k.startswith(("PMI_", "PMIX_"))}
+        env["DASK_SCHEDULER_ADDRESS"] = client.scheduler.address
+        env["PARALLEL_DASK_SCHEDULER_PATH"] = str(scheduler_file)
+        return subprocess.run(command, shell=True, env=env, check=False).returncode
+    finally:
+        # the cluster may have been already shut down by the command
+        with contextlib.suppress(Exception):
+            client.shutdown()
+
+
+def main():
+    """Parse the arguments and run the task corresponding to the rank."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--log-path", required=True, help="Path to the log file of the job.")
+    parser.add_argument("--memory-limit", default="auto", help="Memory limit of each worker.")
+    parser.add_argument("command", help="Command to be executed, as a single string.")
+    args = parser.parse_args()
+    rank = int(os.environ["SLURM_PROCID"])
+    n_tasks = int(os.environ["SLURM_NTASKS"])
+    if n_tasks < 3:
+        raise ValueError("At least 3 tasks are needed for the scheduler, the client and a worker")
+    scheduler_file, report_path = cluster_paths(args.log_path, os.environ["SLURM_JOB_ID"])
+    if rank == SCHEDULER_RANK:
+        returncode = run_scheduler(scheduler_file, report_path)
+    elif rank == CLIENT_RANK:
+        returncode = run_client(args.command, scheduler_file, n_workers=n_tasks - 2)
+    else:
+        returncode = run_worker(scheduler_file, args.memory_limit)
+    # only the exit code of the command is relevant, since the cluster is shut down in any case
+    sys.exit(returncode if rank == CLIENT_RANK else 0)
+
+
+if __name__ == "__main__":
+    main()
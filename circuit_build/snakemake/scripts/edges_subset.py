@@ -0,0 +1,74 @@
+"""Write a compact copy of an edge population, containing only the given attributes.
+
+All the edges are kept in the same order, so that the edge ids are unchanged, and the datasets
+are written without chunks and compression, so that they can be memory-mapped when read.
+
+This script is executed in the environment of the NGV tools,
+so it should depend only on the packages available in that environment.
+"""
+
+import argparse
+
+import h5py
+
+# datasets always copied, in addition to the attributes of the edges
+REQUIRED_DATASETS = [
+    "source_node_id",
+    "target_node_id",
+    "edge_type_id",
+    "edge_group_id",
+    "edge_group_index",
+]
+# name of the group containing the attributes of the edges
+ATTRIBUTES_GROUP = "0"
+# number of rows copied at once, to limit the memory usage
+BLOCK_SIZE = 10_000_000
+
+
+def _copy_attrs(source, target):
+    for key, value in source.attrs.items():
+        target.attrs[key] = value
+
+
+def _copy_dataset(source, target_group, name, block_size):
+    """Copy the dataset block by block, as a contiguous dataset."""
+    dataset = target_group.create_dataset(name, shape=source.shape, dtype=source.dtype)
+    for start in range(0, len(source), block_size):
+        block = slice(start, start + block_size)
+        dataset[block] = source[block]
+    _copy_attrs(source, dataset)
+
+
+def write_subset(edges_path, population_name, attributes, out_path, block_size=BLOCK_SIZE):
+    """Write the edges with only the given attributes, and the same indices."""
+    with h5py.File(edges_path, "r") as src, h5py.File(out_path, "w") as out:
+        _copy_attrs(src, out)
+        population = src["edges"][population_name]
+        out_population = out.create_group(f"edges/{population_name}")
+        _copy_attrs(population, out_population)
+        for name in REQUIRED_DATASETS:
+            _copy_dataset(population[name], out_population, name, block_size)
+        group = population[ATTRIBUTES_GROUP]
+        out_group = out_population.create_group(ATTRIBUTES_GROUP)
+        _copy_attrs(group, out_group)
+        for name in attributes:
+            if name not in group:
+                raise KeyError(f"Attribute {name} not found in {edges_path}")
+            _copy_dataset(group[name], out_group, name, block_size)
+        if "indices" in population:
+            src.copy(population["indices"], out_population)
+
+
+def main():
+    """Parse the arguments and run the command."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--edges-path", required=True)
+    parser.add_argument("--population-name", required=True)
+    parser.add_argument("--attributes", nargs="+", required=True)
+    parser.add_argument("--out-path", required=True)
+    args = parser.parse_args()
+    write_subset(args.edges_path, args.population_name, args.attributes, args.out_path)
+
+
+if __name__ == "__main__":
+    main()
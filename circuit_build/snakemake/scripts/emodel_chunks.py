@@ -0,0 +1,99 @@
+"""Split the cells processed by emodel-generalisation in chunks, and merge the results.
+
+Each chunk is a contiguous range of rows of the input nodes file, so that the results
+can be merged back in the same order, copying the ``@dynamics:*`` properties.
+
+This script is executed in the environment of the emodel tools,
+so it should depend only on the packages available in that environment.
+"""
+
+import argparse
+import logging
+import shutil
+from pathlib import Path
+
+import numpy as np
+
+L = logging.getLogger(__name__)
+
+DYNAMICS_PREFIX = "@dynamics:"
+# name of the file with the input cells of each chunk in the output directory of split
+CHUNK_FILE = "input_{chunk}.h5"
+
+
+def chunk_bounds(n_cells, n_chunks):
+    """Return the bounds of the row ranges of each chunk."""
+    return np.linspace(0, n_cells, n_chunks + 1).round().astype(int)
+
+
+def split(cells_path, n_chunks, out_dir):
+    """Write the cells of each chunk to the output directory, loading the input cells once."""
+    # pylint: disable=import-outside-toplevel
+    from voxcell import CellCollection
+
+    cells = CellCollection.load(cells_path)
+    df = cells.as_dataframe()
+    bounds = chunk_bounds(len(df), n_chunks)
+    Path(out_dir).mkdir(parents=True, exist_ok=True)
+    for chunk in range(n_chunks):
+        start, stop = bounds[chunk], bounds[chunk + 1]
+        chunk_df = df.iloc[start:stop].reset_index(drop=True)
+        chunk_df.index += 1
+        result = CellCollection.from_dataframe(chunk_df)
+        result.population_name = cells.population_name
+        result.save(Path(out_dir, CHUNK_FILE.format(chunk=chunk)))
+        L.info("Chunk %s: cells %s to %s of %s", chunk, start, stop, len(df))
+
+
+def merge(cells_path, chunk_cells, out_cells, hoc_dirs=(), out_hoc_dir=None):
+    """Add the ``@dynamics:*`` properties of the chunks to the input cells.
+
+    The hoc files written for each chunk are copied to ``out_hoc_dir``, if given.
+    """
+    # pylint: disable=import-outside-toplevel
+    from voxcell import CellCollection
+
+    cells = CellCollection.load(cells_path)
+    bounds = chunk_bounds(len(cells.positions), len(chunk_cells))
+    dynamics = {}
+    for n, path in enumerate(chunk_cells):
+        df = CellCollection.load(path).as_dataframe()
+        if len(df) != bounds[n + 1] - bounds[n]:
+            raise ValueError(f"Unexpected number of cells in {path}: {len(df)}")
+        for col in df.columns:
+            if col.startswith(DYNAMICS_PREFIX):
+                dynamics.setdefault(col, []).append(df[col].to_numpy())
+    for col, values in dynamics.items():
+        cells.properties[col] = np.concatenate(values)
+    cells.save(out_cells)
+    if out_hoc_dir is not None:
+        Path(out_hoc_dir).mkdir(parents=True, exist_ok=True)
+        for hoc_dir in hoc_dirs:
+            for path in sorted(Path(hoc_dir).glob("*.hoc")):
+                shutil.copy2(path, Path(out_hoc_dir, path.name))
+
+
+def main():
+    """Parse the arguments and run the command."""
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    split_parser = subparsers.add_parser("split", help=split.__doc__)
+    split_parser.add_argument("--cells-path", required=True)
+    split_parser.add_argument("--n-chunks", type=int, required=True)
+    split_parser.add_argument("--out-dir", required=True)
+    merge_parser = subparsers.add_parser("merge", help=merge.__doc__)
+    merge_parser.add_argument("--cells-path", required=True)
+    merge_parser.add_argument("--chunk-cells", nargs="+", required=True)
+    merge_parser.add_argument("--hoc-dirs", nargs="+", default=[])
+    merge_parser.add_argument("--out-hoc-dir")
+    merge_parser.add_argument("--out-cells", required=True)
+    args = parser.parse_args()
+    if args.command == "split":
+        split(args.cells_path, args.n_chunks, args.out_dir)
+    else:
+        merge(args.cells_path, args.chunk_cells, args.out_cells, args.hoc_dirs, args.out_hoc_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""Split the endfeet and the vasculature mesh in tiles, and merge the endfeet meshes of the tiles.
+
+The endfeet are split in tiles of similar size along the longest axis of their bounding box.
+Each tile contains also the endfeet in a halo around it, so that the endfeet at the boundaries
+compete for the surface with the same neighbours as in the whole mesh, and the part of the
+vasculature mesh that can be reached by all these endfeet.
+Only the endfeet in the core of each tile are kept when the tiles are merged.
+
+This script is executed in the environment of the NGV tools,
+so it should depend only on the packages available in that environment.
+"""
+
+import argparse
+
+import h5py
+import numpy as np
+
+POSITION_ATTRIBUTES = ["endfoot_surface_x", "endfoot_surface_y", "endfoot_surface_z"]
+ATTRIBUTES_GROUP = "0"
+
+
+def _copy_attrs(source, target):
+    for key, value in source.attrs.items():
+        target.attrs[key] = value
+
+
+def tile_bounds(positions, n_tiles, halo):
+    """Return the axis used to split the endfeet, the core of each tile, and the tiles with halo.
+
+    The core of each tile is given as a boolean mask of the endfeet, and each tile with halo
+    as the interval of coordinates along the axis.
+    """
+    axis = int(np.argmax(np.ptp(positions, axis=0)))
+    coords = positions[:, axis]
+    order = np.argsort(coords, kind="stable")
+    cores, intervals = [], []
+    for ids in np.array_split(order, n_tiles):
+        core = np.zeros(len(coords), dtype=bool)
+        core[ids] = True
+        cores.append(core)
+        if len(ids) == 0:
+            intervals.append((np.inf, -np.inf))
+        else:
+            intervals.append((coords[ids].min() - halo, coords[ids].max() + halo))
+    return axis, cores, intervals
+
+
+def read_positions(connectivity_path, population_name):
+    """Return the positions of the endfeet on the vasculature surface."""
+    with h5py.File(connectivity_path, "r") as h5:
+        group = h5["edges"][population_name][ATTRIBUTES_GROUP]
+        return np.column_stack([group[name][:] for name in POSITION_ATTRIBUTES])
+
+
+def read_obj(mesh_path):
+    """Return the vertices and the triangles of the mesh in OBJ format."""
+    vertices, triangles = [], []
+    with open(mesh_path, encoding="utf-8") as fd:
+        for line in fd:
+            if line.startswith("v "):
+                vertices.append(line.split()[1:4])
+            elif line.startswith("f "):
+                triangles.append([token.split("/")[0] for token in line.split()[1:4]])
+    return np.array(vertices, dtype=float).reshape(-1, 3), np.array(triangles, dtype=int) - 1
+
+
+def write_obj(mesh_path, vertices, triangles):
+    """Write the mesh in OBJ format."""
+    with open(mesh_path, "w", encoding="utf-8") as fd:
+        np.savetxt(fd, vertices, fmt="v %.6f %.6f %.6f")
+        np.savetxt(fd, triangles + 1, fmt="f %d %d %d")
+
+
+def submesh(vertices, triangles, axis, interval):
+    """Return the part of the mesh with at least one vertex in the interval along the axis."""
+    inside = (vertices[:, axis] >= interval[0]) & (vertices[:, axis] <= interval[1])
+    triangles = triangles[inside[triangles].any(axis=1)]
+    used, triangles = np.unique(triangles, return_inverse=True)
+    return vertices[used], triangles.reshape(-1, 3)
+
+
+def write_edges_subset(connectivity_path, population_name, ids, out_path):
+    """Write the edges with the given ids, with all the attributes."""
+    # pylint: disable=import-outside-toplevel
+    import libsonata
+
+    with h5py.File(connectivity_path, "r") as src, h5py.File(out_path, "w") as out:
+        _copy_attrs(src, out)
+        population = src["edges"][population_name]
+        out_population = out.create_group(f"edges/{population_name}")
+        _copy_attrs(population, out_population)
+        node_counts = []
+        for name in ["source_node_id", "target_node_id"]:
+            values = population[name][:]
+            node_counts.append(int(values.max()) + 1 if len(values) else 0)
+        out_attributes = out_population.create_group(ATTRIBUTES_GROUP)
+        _copy_attrs(population[ATTRIBUTES_GROUP], out_attributes)
+        for group, out_group in [
+            (population, out_population),
+            (population[ATTRIBUTES_GROUP], out_attributes),
+        ]:
+            for name, dataset in group.items():
+                if not isinstance(dataset, h5py.Dataset):
+                    continue
+                data = np.arange(len(ids)) if name == "edge_group_index" else dataset[:][ids]
+                out_group.create_dataset(name, data=data)
+                _copy_attrs(dataset, out_group[name])
+    libsonata.EdgePopulation.write_indices(str(out_path), population_name, *node_counts)
+
+
+def split(connectivity_path, population_name, mesh_path, halo, growth_radius, out_tiles):
+    """Write the endfeet, the vasculature mesh, and the ids of each tile.
+
+    The endfeet in the halo of each tile are included, and the mesh is extended by the
+    maximum growth radius of the endfeet.
+    """
+    positions = read_positions(connectivity_path, population_name)
+    vertices, triangles = read_obj(mesh_path)
+    axis, cores, intervals = tile_bounds(positions, len(out_tiles), halo)
+    for (lo, hi), core, (out_connectivity, out_mesh, out_ids) in zip(intervals, cores, out_tiles):
+        selected = (positions[:, axis] >= lo) & (positions[:, axis] <= hi)
+        ids = np.flatnonzero(selected)
+        write_edges_subset(connectivity_path, population_name, ids, out_connectivity)
+        interval = (lo - growth_radius, hi + growth_radius)
+        write_obj(out_mesh, *submesh(vertices, triangles, axis, interval))
+        np.savez(out_ids, ids=ids, core=core[ids], n_endfeet=len(positions))
+
+
+def merge(tile_meshes, tile_ids, out_path):
+    """Merge the endfeet meshes of the core of each tile, in the order of the endfeet ids.
+
+    The datasets in ``attributes`` contain one value per endfoot, while the datasets in ``data``
+    contain the values of all the endfeet, delimited by the datasets with the same name in
+    ``offsets``.
+    """
+    ids = [np.load(path) for path in tile_ids]
+    global_ids = np.concatenate([tile["ids"][tile["core"]] for tile in ids])
+    if not np.array_equal(np.sort(global_ids), np.arange(ids[0]["n_endfeet"])):
+        raise RuntimeError("Each endfoot must be in the core of exactly one tile")
+    order = np.argsort(global_ids)
+    with h5py.File(out_path, "w") as out:
+        with h5py.File(tile_meshes[0], "r") as first:
+            _copy_attrs(first, out)
+            attribute_names = list(first["attributes"])
+            data_names = list(first["data"])
+        attributes = {name: [] for name in attribute_names}
+        chunks = {name: [] for name in data_names}
+        # True if the offsets contain also the end of the last endfoot
+        closed = {}
+        for path, tile in zip(tile_meshes, ids):
+            local_ids = np.flatnonzero(tile["core"])
+            with h5py.File(path, "r") as h5:
+                for name in attribute_names:
+                    attributes[name].append(h5["attributes"][name][:][local_ids])
+                for name in data_names:
+                    data, offsets = h5["data"][name][:], h5["offsets"][name][:]
+                    closed[name] = len(offsets) > len(tile["ids"])
+                    if not closed[name]:
+                        offsets = np.append(offsets, len(data))
+                    starts, stops = offsets[local_ids], offsets[local_ids + 1]
+                    chunks[name].extend(data[start:stop] for start, stop in zip(starts, stops))
+        for name, values in attributes.items():
+            out.create_dataset(f"attributes/{name}", data=np.concatenate(values)[order])
+        for name, values in chunks.items():
+            values = [values[i] for i in order]
+            offsets = np.cumsum([0] + [len(value) for value in values], dtype=np.int64)
+            if not closed[name]:
+                offsets = offsets[:-1]
+            out.create_dataset(f"data/{name}", data=np.concatenate(values))
+            out.create_dataset(f"offsets/{name}", data=offsets)
+
+
+def main():
+    """Parse the arguments and run the command."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    split_parser = subparsers.add_parser("split", help=split.__doc__)
+    split_parser.add_argument("--connectivity-path", required=True)
+    split_parser.add_argument("--population-name", required=True)
+    split_parser.add_argument("--vasculature-mesh-path", required=True)
+    split_parser.add_argument("--halo", type=float, required=True)
+    split_parser.add_argument("--growth-radius", type=float, required=True)
+    split_parser.add_argument("--out-connectivities", nargs="+", required=True)
+    split_parser.add_argument("--out-meshes", nargs="+", required=True)
+    split_parser.add_argument("--out-ids", nargs="+", required=True)
+    merge_parser = subparsers.add_parser("merge", help=merge.__doc__)
+    merge_parser.add_argument("--tile-meshes", nargs="+", required=True)
+    merge_parser.add_argument("--tile-ids", nargs="+", required=True)
+    merge_parser.add_argument("--out-path", required=True)
+    args = parser.parse_args()
+    if args.command == "split":
+        out_tiles = list(zip(args.out_connectivities, args.out_meshes, args.out_ids))
+        split(
+            args.connectivity_path,
+            args.population_name,
+            args.vasculature_mesh_path,
+            args.halo,
+            args.growth_radius,
+            out_tiles,
+        )
+    else:
+        merge(args.tile_meshes, args.tile_ids, args.out_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Synthesize the morphologies of the astrocytes in a shard.
+
+The astrocytes are split in contiguous shards of node ids, and each astrocyte is synthesized
+with the same function and seed used by ``ngv synthesis``, so that the morphologies don't
+depend on the number of shards.
+
+Since archngv doesn't provide a public function to synthesize a subset of the astrocytes,
+the internal function used by ``ngv synthesis`` is called directly, and only the pinned
+version of archngv is accepted. The functional test of the NGV circuit verifies that the
+morphologies synthesized in shards are identical to the ones synthesized by ``ngv synthesis``.
+
+This script is executed in the environment of the NGV synthesis tools,
+so it should depend only on the packages available in that environment.
+"""
+
+import argparse
+import multiprocessing
+import os
+from pathlib import Path
+
+import h5py
+import numpy as np
+
+# version of archngv verified to synthesize each astrocyte with the internal function used below
+ARCHNGV_VERSION = "3.0.2"
+
+
+def shard_ids(n_astrocytes, n_shards, shard):
+    """Return the node ids of the astrocytes in the given shard."""
+    bounds = np.linspace(0, n_astrocytes, n_shards + 1).round().astype(int)
+    return np.arange(bounds[shard], bounds[shard + 1], dtype=np.int64)
+
+
+def count_astrocytes(astrocytes_path):
+    """Return the number of astrocytes in the only population of the nodes file."""
+    with h5py.File(astrocytes_path, "r") as h5:
+        (population,) = h5["nodes"].values()
+        return len(population["node_type_id"])
+
+
+def check_archngv_version():
+    """Raise an error if the installed version of archngv isn't the pinned one."""
+    # pylint: disable=import-outside-toplevel
+    from importlib.metadata import version
+
+    installed = version("archngv")
+    if installed != ARCHNGV_VERSION:
+        raise RuntimeError(
+            f"The synthesis in shards requires archngv {ARCHNGV_VERSION}, found {installed}. "
+            "Set ngv.synthesis.shards to 1 to use ngv synthesis with any version."
+        )
+
+
+def cpu_count():
+    """Return the number of CPUs of the Slurm task, or the CPUs available to the process."""
+    return int(os.environ.get("SLURM_CPUS_PER_TASK", 0)) or len(os.sched_getaffinity(0))
+
+
+def _synthesize_one(astrocyte_index, seed, paths, parameters):
+    # pylint: disable=import-outside-toplevel,protected-access
+    from archngv.building.morphology_synthesis import full_astrocyte
+
+    full_astrocyte._synthesize(astrocyte_index, seed, paths, parameters)
+
+
+def synthesize(ids, paths, config_path, seed, parallel):
+    """Synthesize the astrocytes with the given ids."""
+    # pylint: disable=import-outside-toplevel
+    from archngv.app.utils import load_ngv_manifest
+    from archngv.building.morphology_synthesis.data_structures import SynthesisInputPaths
+
+    Path(paths["morphology_directory"]).mkdir(parents=True, exist_ok=True)
+    parameters = load_ngv_manifest(config_path)["synthesis"]
+    args = [(int(i), seed, SynthesisInputPaths(**paths), parameters) for i in ids]
+    if parallel:
+        with multiprocessing.Pool(cpu_count()) as pool:
+            pool.starmap(_synthesize_one, args, chunksize=1)
+    else:
+        for arg in args:
+            _synthesize_one(*arg)
+
+
+def main():
+    """Parse the arguments and run the command."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--config-path", required=True)
+    parser.add_argument("--tns-distributions-path", required=True)
+    parser.add_argument("--tns-parameters-path", required=True)
+    parser.add_argument("--tns-context-path", required=True)
+    parser.add_argument("--er-data-path", required=True)
+    parser.add_argument("--astrocytes-path", required=True)
+    parser.add_argument("--microdomains-path", required=True)
+    parser.add_argument("--gliovascular-connectivity-path", required=True)
+    parser.add_argument("--neuroglial-connectivity-path", required=True)
+    parser.add_argument("--endfeet-meshes-path", required=True)
+    parser.add_argument("--neuronal-connectivity-path", required=True)
+    parser.add_argument("--out-morph-dir", required=True)
+    parser.add_argument("--shard", type=int, required=True)
+    parser.add_argument("--shards", type=int, required=True)
+    parser.add_argument("--parallel", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    paths = {
+        "astrocytes": args.astrocytes_path,
+        "microdomains": args.microdomains_path,
+        "neuronal_synapses": args.neuronal_connectivity_path,
+        "gliovascular_connectivity": args.gliovascular_connectivity_path,
+        "neuroglial_connectivity": args.neuroglial_connectivity_path,
+        "endfeet_meshes": args.endfeet_meshes_path,
+        "tns_parameters": args.tns_parameters_path,
+        "tns_distributions": args.tns_distributions_path,
+        "tns_context": args.tns_context_path,
+        "er_data": args.er_data_path,
+        "morphology_directory": args.out_morph_dir,
+    }
+    check_archngv_version()
+    ids = shard_ids(count_astrocytes(args.astrocytes_path), args.shards, args.shard)
+    synthesize(ids, paths, args.config_path, args.seed, args.parallel)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Merge the glial-glial connectivity built from the shards of the touches.
+
+Each shard contains the edges built from the touches of each rank of touchdetector,
+in the file ``<rank>.h5``, and the edges are concatenated in order of rank,
+so that the result doesn't depend on the number of shards.
+
+This script is executed in the environment of the NGV tools,
+so it should depend only on the packages available in that environment.
+"""
+
+import argparse
+from pathlib import Path
+
+import h5py
+import numpy as np
+
+# datasets of the edge population that aren't concatenated, but rebuilt after the merge
+SKIPPED_GROUPS = ["indices"]
+# datasets containing an index that must be shifted by the number of edges in the previous shards
+SHIFTED_DATASETS = ["edge_group_index"]
+
+
+def _population_datasets(population_group):
+    """Return the names of the datasets of the edge population, relative to the population."""
+    names = []
+
+    def _visit(name, obj):
+        if isinstance(obj, h5py.Dataset) and name.split("/")[0] not in SKIPPED_GROUPS:
+            names.append(name)
+
+    population_group.visititems(_visit)
+    return names
+
+
+def _copy_attrs(source, target):
+    for key, value in source.attrs.items():
+        target.attrs[key] = value
+
+
+def rank_edges(shard_dirs):
+    """Return the edge files of all the ranks in the shard directories, sorted by rank."""
+    return sorted((path for d in shard_dirs for path in Path(d).glob("*.h5")), key=_rank)
+
+
+def _rank(path):
+    return int(path.stem)
+
+
+def merge(shard_edges, population_name, node_count, out_edges):
+    """Concatenate the edges of the shards, and write the indices of the merged population.
+
+    The edges are expected to be in a single group, as written by the NGV tools.
+    """
+    # pylint: disable=import-outside-toplevel
+    import libsonata
+
+    shards = [h5py.File(path, "r") for path in shard_edges]
+    try:
+        populations = [shard["edges"][population_name] for shard in shards]
+        with h5py.File(out_edges, "w") as out:
+            _copy_attrs(shards[0], out)
+            out_population = out.create_group(f"edges/{population_name}")
+            _copy_attrs(populations[0], out_population)
+            offsets = np.cumsum([0] + [len(p["source_node_id"]) for p in populations[:-1]])
+            for name in _population_datasets(populations[0]):
+                values = [p[name][...] for p in populations]
+                if name in SHIFTED_DATASETS:
+                    values = [v + offset for v, offset in zip(values, offsets)]
+                dataset = out_population.create_dataset(name, data=np.concatenate(values))
+                _copy_attrs(populations[0][name], dataset)
+                _copy_attrs(populations[0][name].parent, dataset.parent)
+    finally:
+        for shard in shards:
+            shard.close()
+    libsonata.EdgePopulation.write_indices(str(out_edges), population_name, node_count, node_count)
+
+
+def main():
+    """Parse the arguments and run the command."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--shard-dirs", nargs="+", required=True)
+    parser.add_argument("--population-name", required=True)
+    parser.add_argument("--astrocytes", required=True)
+    parser.add_argument("--out-edges", required=True)
+    args = parser.parse_args()
+    with h5py.File(args.astrocytes, "r") as h5:
+        # the astrocytes are the only population in the nodes file
+        (population,) = h5["nodes"].values()
+        node_count = len(population["node_type_id"])
+    merge(rank_edges(args.shard_dirs), args.population_name, node_count, args.out_edges)
+
+
+if __name__ == "__main__":
+    main()
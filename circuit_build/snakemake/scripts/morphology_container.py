@@ -0,0 +1,56 @@
+"""Pack the morphologies of a directory in a merged morphology container.
+
+The container is a single HDF5 file with one group for each morphology in h5v1 format,
+named as the path of the morphology relative to the directory, without extension,
+as expected by MorphIO and libsonata when reading the morphologies from a container.
+
+This script is executed in the environment of the morphology tools,
+so it should depend only on the packages available in that environment.
+"""
+
+import argparse
+from pathlib import Path
+
+import h5py
+
+
+def _copy_attrs(source, target):
+    for key, value in source.attrs.items():
+        target.attrs[key] = value
+
+
+def morphology_names(morph_dir):
+    """Return the morphology names and paths in the directory, sorted by name.
+
+    The morphologies in the subdirectories, written by the shards and the attempts of the
+    synthesis, are named with the relative path, as in the ``morphology`` property of the cells.
+    """
+    morph_dir = Path(morph_dir)
+    return sorted(
+        (path.relative_to(morph_dir).with_suffix("").as_posix(), path)
+        for path in morph_dir.rglob("*.h5")
+    )
+
+
+def pack(morph_dir, out_path):
+    """Write all the morphologies in h5v1 format found in the directory to the container."""
+    with h5py.File(out_path, "w") as out:
+        for name, path in morphology_names(morph_dir):
+            group = out.create_group(name)
+            with h5py.File(path, "r") as src:
+                _copy_attrs(src, group)
+                for key in src:
+                    src.copy(src[key], group)
+
+
+def main():
+    """Parse the arguments and run the command."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--morph-dir", required=True)
+    parser.add_argument("--out-path", required=True)
+    args = parser.parse_args()
+    pack(args.morph_dir, args.out_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+"""Track the cells already synthesized, to resume the synthesis of the morphologies.
+
+The cells still to be synthesized are split in batches, and region-grower is executed
+for each batch writing the morphologies to a separate folder ``batches/<batch>``.
+Since region-grower writes the output cells only after all the morphologies, a batch is
+considered complete only if its output cells can be loaded and all the listed morphology files
+exist, and the names and the orientations of the morphologies are taken from these output cells.
+
+The cells of the complete batches are never synthesized again, including the cells dropped by
+region-grower, while the cells of the incomplete batches are split in new batches with new seeds.
+
+This script is executed in the environment of the synthesis tools,
+so it should depend only on the packages available in that environment.
+"""
+
+import argparse
+import hashlib
+import logging
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import yaml
+
+L = logging.getLogger(__name__)
+
+# name of the temporary property used to restore the original order of the cells
+INDEX_PROPERTY = "checkpoint_original_index"
+CHECKPOINT_FILE = "checkpoint.yaml"
+BATCHES_FILE = "batches.txt"
+BATCHES_DIR = "batches"
+IDS_FILE = "ids.npy"
+CELLS_FILE = "cells.h5"
+SYNTHESIZED_FILE = "synthesized.h5"
+SEED_FILE = "seed.txt"
+APICAL_FILES = ["apical.yaml", "apical_nrn_isec.yaml"]
+
+
+def _digest(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as fd:
+        while chunk := fd.read(1 << 20):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _load_cells(path):
+    """Return the cell collection, or None if the file is missing or incomplete."""
+    # pylint: disable=import-outside-toplevel
+    from voxcell import CellCollection
+
+    if not Path(path).is_file():
+        return None
+    try:
+        return CellCollection.load(path)
+    except Exception:  # pylint: disable=broad-except
+        L.warning("Cannot load the cells in %s", path)
+        return None
+
+
+class Checkpoint:
+    """Completion state of the synthesis."""
+
+    def __init__(self, checkpoint_dir, morph_dir, digest, seed):
+        """Load the checkpoint, or initialize a new one if the input cells or the seed changed."""
+        self.checkpoint_dir = Path(checkpoint_dir)
+        self.morph_dir = Path(morph_dir)
+        self.digest = digest
+        self.seed = seed
+        # number of cells assigned to all the batches, used to shift the seed of the new batches
+        self.offset = 0
+        # completion flag of each batch, indexed by batch id
+        self.batches = {}
+        self.next_batch = 0
+        path = self.checkpoint_dir / CHECKPOINT_FILE
+        data = yaml.safe_load(path.read_text(encoding="utf-8")) if path.exists() else None
+        if data and data["digest"] == digest and data["seed"] == seed:
+            self.offset = data["offset"]
+            self.batches = data["batches"]
+            self.next_batch = data["next_batch"]
+        else:
+            # remove the batches written using different input cells or seed
+            for directory in [self.checkpoint_dir / BATCHES_DIR, self.morph_dir / BATCHES_DIR]:
+                shutil.rmtree(directory, ignore_errors=True)
+
+    def batch_dir(self, batch):
+        """Return the folder with the input and output cells of the given batch."""
+        return self.checkpoint_dir / BATCHES_DIR / str(batch)
+
+    def batch_morph_dir(self, batch):
+        """Return the folder with the morphologies of the given batch."""
+        return self.morph_dir / BATCHES_DIR / str(batch)
+
+    def done_ids(self):
+        """Return the ids of the cells in the complete batches, including the dropped cells."""
+        ids = [np.load(self.batch_dir(b) / IDS_FILE) for b, done in self.batches.items() if done]
+        return np.concatenate(ids) if ids else np.array([], dtype=np.int64)
+
+    def is_complete(self, batch, exts):
+        """Return True if region-grower wrote the output cells and the morphologies of the batch."""
+        cells = _load_cells(self.batch_dir(batch) / SYNTHESIZED_FILE)
+        if cells is None:
+            return False
+        morph_dir = self.batch_morph_dir(batch)
+        return all(
+            Path(morph_dir, f"{name}.{ext}").is_file()
+            for name in cells.properties["morphology"]
+            for ext in exts
+        )
+
+    def update(self, exts):
+        """Mark as done the complete batches, and remove the incomplete ones."""
+        for batch, done in list(self.batches.items()):
+            if done:
+                continue
+            if self.is_complete(batch, exts):
+                self.batches[batch] = True
+            else:
+                L.info("Discarding the incomplete batch %s", batch)
+                del self.batches[batch]
+                shutil.rmtree(self.batch_dir(batch), ignore_errors=True)
+                shutil.rmtree(self.batch_morph_dir(batch), ignore_errors=True)
+
+    def add_batch(self, cells, ids):
+        """Write the input cells of a new batch, and return the batch id.
+
+        The seed is shifted by the number of cells assigned to the previous batches,
+        so that every cell of every batch is synthesized with a different seed.
+        """
+        batch = self.next_batch
+        batch_dir = self.batch_dir(batch)
+        shutil.rmtree(self.batch_morph_dir(batch), ignore_errors=True)
+        batch_dir.mkdir(parents=True, exist_ok=True)
+        np.save(batch_dir / IDS_FILE, ids)
+        cells.save(batch_dir / CELLS_FILE)
+        Path(batch_dir, SEED_FILE).write_text(f"{self.seed + self.offset}\n", encoding="utf-8")
+        self.batches[batch] = False
+        self.next_batch += 1
+        self.offset += len(ids)
+        return batch
+
+    def save(self):
+        """Save the checkpoint."""
+        data = {
+            "digest": self.digest,
+            "seed": self.seed,
+            "offset": self.offset,
+            "next_batch": self.next_batch,
+            "batches": self.batches,
+        }
+        with open(self.checkpoint_dir / CHECKPOINT_FILE, "w", encoding="utf-8") as fd:
+            yaml.safe_dump(data, fd)
+
+
+def _split(ids, batch_size):
+    """Split the ids in batches of at most batch_size elements, or in one batch if not given."""
+    if len(ids) == 0:
+        return []
+    size = batch_size or len(ids)
+    return np.split(ids, np.arange(size, len(ids), size))
+
+
+def prepare(cells_path, checkpoint_dir, morph_dir, seed, exts, batch_size):
+    """Write the batches of cells still to be synthesized, and the list of their ids."""
+    # pylint: disable=import-outside-toplevel
+    from voxcell import CellCollection
+
+    checkpoint_dir = Path(checkpoint_dir)
+    checkpoint_dir.mkdir(parents=True, exist_ok=True)
+    cells = CellCollection.load(cells_path)
+    df = cells.as_dataframe()
+    df[INDEX_PROPERTY] = np.arange(len(df))
+    checkpoint = Checkpoint(checkpoint_dir, morph_dir, _digest(cells_path), seed)
+    checkpoint.update(exts)
+    missing = np.setdiff1d(np.arange(len(df)), checkpoint.done_ids())
+    L.info("Cells already synthesized: %s, missing: %s", len(df) - len(missing), len(missing))
+    batches = []
+    for ids in _split(missing, batch_size):
+        batch_df = df.iloc[ids].reset_index(drop=True)
+        batch_df.index += 1
+        batch_cells = CellCollection.from_dataframe(batch_df)
+        batch_cells.population_name = cells.population_name
+        batches.append(checkpoint.add_batch(batch_cells, ids))
+    checkpoint.save()
+    # the list is empty if all the cells are synthesized, and region-grower is not executed
+    Path(checkpoint_dir, BATCHES_FILE).write_text(
+        "".join(f"{batch}\n" for batch in batches), encoding="utf-8"
+    )
+
+
+def _merge_apical(checkpoint, morph_dir):
+    """Merge the apical points of all the batches, prefixing the names with the batch folder."""
+    for name in APICAL_FILES:
+        apical = {}
+        for batch in sorted(checkpoint.batches):
+            path = checkpoint.batch_morph_dir(batch) / name
+            if path.exists():
+                data = yaml.safe_load(path.read_text(encoding="utf-8")) or {}
+                apical.update({f"{BATCHES_DIR}/{batch}/{k}": v for k, v in data.items()})
+        with open(Path(morph_dir, name), "w", encoding="utf-8") as fd:
+            yaml.dump(apical, fd)
+
+
+def finalize(cells_path, checkpoint_dir, morph_dir, seed, exts, out_cells):
+    """Write the cell collection with all the synthesized cells, and merge the apical points."""
+    # pylint: disable=import-outside-toplevel
+    from voxcell import CellCollection
+
+    population_name = CellCollection.load(cells_path).population_name
+    checkpoint = Checkpoint(checkpoint_dir, morph_dir, _digest(cells_path), seed)
+    checkpoint.update(exts)
+    checkpoint.save()
+    if not all(checkpoint.batches.values()):
+        raise RuntimeError("Some batches of cells have not been synthesized")
+    dfs = []
+    for batch in sorted(checkpoint.batches):
+        df = CellCollection.load(checkpoint.batch_dir(batch) / SYNTHESIZED_FILE).as_dataframe()
+        df["morphology"] = f"{BATCHES_DIR}/{batch}/" + df["morphology"].astype(str)
+        dfs.append(df)
+    df = pd.concat(dfs).sort_values(INDEX_PROPERTY).drop(columns=INDEX_PROPERTY)
+    df = df.reset_index(drop=True)
+    df.index += 1
+    result = CellCollection.from_dataframe(df)
+    result.population_name = population_name
+    result.save(out_cells)
+    _merge_apical(checkpoint, morph_dir)
+
+
+def main():
+    """Parse the arguments and run the command."""
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("command", choices=["prepare", "finalize"])
+    parser.add_argument("--cells-path", required=True)
+    parser.add_argument("--checkpoint-dir", required=True)
+    parser.add_argument("--morph-dir", required=True)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out-morph-ext", dest="exts", action="append", required=True)
+    parser.add_argument("--batch-size", type=int)
+    parser.add_argument("--out-cells")
+    args = parser.parse_args()
+    paths = [args.cells_path, args.checkpoint_dir, args.morph_dir]
+    if args.command == "prepare":
+        prepare(*paths, args.seed, args.exts, args.batch_size)
+    else:
+        finalize(*paths, args.seed, args.exts, args.out_cells)
+
+
+if __name__ == "__main__":
+    main()
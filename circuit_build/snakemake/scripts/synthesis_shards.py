@@ -0,0 +1,110 @@
+"""Split the cells to be synthesized in shards, and merge the synthesized shards.
+
+This script is executed in the environment of the synthesis tools,
+so it should depend only on the packages available in that environment.
+"""
+
+import argparse
+from pathlib import Path
+
+import numpy as np
+import yaml
+
+# name of the temporary property used to restore the original order of the cells
+INDEX_PROPERTY = "shard_original_index"
+APICAL_FILES = ["apical.yaml", "apical_nrn_isec.yaml"]
+
+
+def shard_bounds(mtypes, n_shards):
+    """Return the positions of the cells sorted by mtype, and the bounds of each shard.
+
+    The cells are grouped by mtype and split in contiguous shards of similar size,
+    so that each shard contains only one or a few mtypes.
+    """
+    order = np.argsort(np.asarray(mtypes), kind="stable")
+    bounds = np.linspace(0, len(order), n_shards + 1).round().astype(int)
+    return order, bounds
+
+
+def split(cells_path, out_cells, out_seeds, seed):
+    """Split the cells in shards, and write the seed to be used for each shard.
+
+    The seed of each shard is shifted by the number of cells in the previous shards,
+    so that each cell is synthesized with a different seed.
+    """
+    # pylint: disable=import-outside-toplevel
+    from voxcell import CellCollection
+
+    cells = CellCollection.load(cells_path)
+    df = cells.as_dataframe()
+    df[INDEX_PROPERTY] = np.arange(len(df))
+    order, bounds = shard_bounds(df["mtype"], len(out_cells))
+    for n, (out_path, seed_path) in enumerate(zip(out_cells, out_seeds)):
+        start, stop = bounds[n], bounds[n + 1]
+        shard_df = df.iloc[order[start:stop]].reset_index(drop=True)
+        shard_df.index += 1
+        shard = CellCollection.from_dataframe(shard_df)
+        shard.population_name = cells.population_name
+        shard.save(out_path)
+        Path(seed_path).write_text(f"{seed + bounds[n]}\n", encoding="utf-8")
+
+
+def merge(shard_cells, shard_dirs, morph_dir, out_cells):
+    """Merge the synthesized shards, and the files with the apical points.
+
+    The morphology names are prefixed with the path of the shard directory
+    relative to the morphology directory.
+    """
+    # pylint: disable=import-outside-toplevel
+    import pandas as pd
+    from voxcell import CellCollection
+
+    dfs = []
+    apicals = {name: {} for name in APICAL_FILES}
+    population_name = None
+    for cells_path, shard_dir in zip(shard_cells, shard_dirs):
+        prefix = Path(shard_dir).relative_to(morph_dir).as_posix()
+        cells = CellCollection.load(cells_path)
+        population_name = cells.population_name
+        df = cells.as_dataframe()
+        df["morphology"] = prefix + "/" + df["morphology"].astype(str)
+        dfs.append(df)
+        for name, apical in apicals.items():
+            path = Path(shard_dir, name)
+            if path.exists():
+                data = yaml.safe_load(path.read_text(encoding="utf-8")) or {}
+                apical.update({f"{prefix}/{k}": v for k, v in data.items()})
+    df = pd.concat(dfs).sort_values(INDEX_PROPERTY).drop(columns=INDEX_PROPERTY)
+    df = df.reset_index(drop=True)
+    df.index += 1
+    cells = CellCollection.from_dataframe(df)
+    cells.population_name = population_name
+    cells.save(out_cells)
+    for name, apical in apicals.items():
+        with open(Path(morph_dir, name), "w", encoding="utf-8") as fd:
+            yaml.dump(apical, fd)
+
+
+def main():
+    """Parse the arguments and run the command."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    split_parser = subparsers.add_parser("split", help=split.__doc__)
+    split_parser.add_argument("--cells-path", required=True)
+    split_parser.add_argument("--seed", type=int, default=0)
+    split_parser.add_argument("--out-cells", nargs="+", required=True)
+    split_parser.add_argument("--out-seeds", nargs="+", required=True)
+    merge_parser = subparsers.add_parser("merge", help=merge.__doc__)
+    merge_parser.add_argument("--shard-cells", nargs="+", required=True)
+    merge_parser.add_argument("--shard-dirs", nargs="+", required=True)
+    merge_parser.add_argument("--morph-dir", required=True)
+    merge_parser.add_argument("--out-cells", required=True)
+    args = parser.parse_args()
+    if args.command == "split":
+        split(args.cells_path, args.out_cells, args.out_seeds, args.seed)
+    else:
+        merge(args.shard_cells, args.shard_dirs, args.morph_dir, args.out_cells)
+
+
+if __name__ == "__main__":
+    main()
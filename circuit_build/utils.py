@@ -9,7 +9,7 @@ from contextlib import contextmanager
 
 import yaml
 
-from circuit_build.constants import PACKAGE_NAME, SCHEMAS_DIR
+from circuit_build.constants import PACKAGE_NAME, SCHEMAS_DIR, SCRIPTS_DIR
 
 L = logging.getLogger(__name__)
 
@@ -73,17 +73,23 @@ def redirect_to_file(cmd, filename="{log}"):
 
 
 @contextmanager
-def write_with_log(out_file, log_file):
-    """Context manager used to write to ``out_file``, and log any exception to ``log_file``."""
+def log_exceptions(log_file):
+    """Context manager used to log any exception to ``log_file``, yielding the log file."""
     with open(log_file, "w", encoding="utf-8") as lf:
         try:
-            with open(out_file, "w", encoding="utf-8") as f:
-                yield f
+            yield lf
         except BaseException:
             lf.write(traceback.format_exc())
             raise
 
 
+@contextmanager
+def write_with_log(out_file, log_file):
+    """Context manager used to write to ``out_file``, and log any exception to ``log_file``."""
+    with log_exceptions(log_file), open(out_file, "w", encoding="utf-8") as f:
+        yield f
+
+
 def read_schema(schema_name):
     """Load a schema and return the result as a dictionary."""
     resource = importlib.resources.files(PACKAGE_NAME) / SCHEMAS_DIR / schema_name
@@ -91,6 +97,11 @@ def read_schema(schema_name):
     return yaml.safe_load(content)
 
 
+def script_path(script_name):
+    """Return the path to a script that can be executed in the environment of the rules."""
+    return importlib.resources.files(PACKAGE_NAME) / SCRIPTS_DIR / script_name
+
+
 def clean_slurm_env():
     """Remove PMI/SLURM variables that can cause issues when launching other slurm jobs.
 
@@ -5,8 +5,6 @@ import os
 import warnings
 from pathlib import Path
 
-import jsonschema
-
 from circuit_build.utils import read_schema
 
 logger = logging.getLogger(__name__)
@@ -40,6 +38,10 @@ def validate_config(config, schema_name):
     Raises:
         ValidationError in case of validation error.
     """
+    # jsonschema is imported only when needed, because it's slow to import
+    # pylint: disable=import-outside-toplevel
+    import jsonschema
+
     schema = read_schema(schema_name)
     cls = jsonschema.validators.validator_for(schema)
     cls.check_schema(schema)
@@ -1,13 +1,20 @@
+import subprocess
 from pathlib import Path
 import pytest
 
 import bluepysnap
+import libsonata
+import morphio
+import numpy as np
+import pandas as pd
 from click.testing import CliRunner
 
 from archngv.app.utils import load_json
 
 from circuit_build.cli import run
+from circuit_build.ngv import split_touches_dir
 from assertions import assert_node_population_morphologies_accessible
+from utils import load_script
 
 
 TEST_DIR = Path(__file__).resolve().parent
@@ -151,3 +158,100 @@ def test_ngv_full___config(build_circuit_full):
     build_sonata_config = load_json(BUILD_DIR / "ngv_config.json")
 
     assert build_sonata_config == expected_sonata_config
+
+
+def test_ngv_full__glia_synthesis_shards(build_circuit_full, tmp_path):
+    """The astrocytes synthesized in shards must be identical to the ones of ngv synthesis."""
+    module = load_script("glia_synthesis_shards.py")
+    module.check_archngv_version()
+
+    astrocytes_path = BUILD_DIR / "sonata/networks/nodes/astrocytes/nodes.h5"
+    n_astrocytes = module.count_astrocytes(astrocytes_path)
+    n_shards = 2
+    for shard in range(n_shards):
+        paths = {
+            "astrocytes": astrocytes_path,
+            "microdomains": BUILD_DIR / "sonata/networks/nodes/astrocytes/microdomains.h5",
+            "neuronal_synapses": BUILD_DIR
+            / "sonata/networks/edges/functional/neocortex_neurons__chemical_synapse/edges.h5",
+            "gliovascular_connectivity": BUILD_DIR / "auxiliary/gliovascular.connectivity.h5",
+            "neuroglial_connectivity": BUILD_DIR / "auxiliary/neuroglial.connectivity.h5",
+            "endfeet_meshes": BUILD_DIR / "sonata/networks/edges/gliovascular/endfeet_meshes.h5",
+            "tns_parameters": BIONAME_DIR / "tns_parameters.json",
+            "tns_distributions": BIONAME_DIR / "tns_distributions.json",
+            "tns_context": BIONAME_DIR / "tns_context.json",
+            "er_data": BIONAME_DIR / "er_data.json",
+            "morphology_directory": tmp_path / f"shard_{shard}",
+        }
+        ids = module.shard_ids(n_astrocytes, n_shards, shard)
+        module.synthesize(ids, paths, BIONAME_DIR / "MANIFEST.yaml", seed=0, parallel=False)
+
+    expected_dir = BUILD_DIR / "morphologies/astrocytes/h5"
+    expected_names = sorted(p.name for p in expected_dir.iterdir())
+    actual_paths = {p.name: p for p in tmp_path.glob("shard_*/*")}
+    assert sorted(actual_paths) == expected_names
+    for name in expected_names:
+        expected = morphio.Morphology(expected_dir / name)
+        actual = morphio.Morphology(actual_paths[name])
+        np.testing.assert_array_equal(actual.points, expected.points)
+        np.testing.assert_array_equal(actual.diameters, expected.diameters)
+        np.testing.assert_array_equal(actual.section_offsets, expected.section_offsets)
+
+
+def _edges_dataframe(path, population_name):
+    """Return the edges with all their attributes, sorted independently of the order in the file."""
+    population = libsonata.EdgeStorage(str(path)).open_population(population_name)
+    selection = population.select_all()
+    df = pd.DataFrame(
+        {
+            "source_node_id": population.source_nodes(selection),
+            "target_node_id": population.target_nodes(selection),
+            **{
+                name: population.get_attribute(name, selection)
+                for name in sorted(population.attribute_names)
+            },
+        }
+    )
+    return df.sort_values(list(df.columns)).reset_index(drop=True)
+
+
+def test_ngv_full__glialglial_shards(build_circuit_full, tmp_path):
+    """The glial-glial edges built in shards must be the same as the ones built without shards."""
+    module = load_script("glialglial_shards.py")
+
+    population_name = "glialglial"
+    astrocytes_path = BUILD_DIR / "sonata/networks/nodes/astrocytes/nodes.h5"
+    touches_dirs = [tmp_path / f"touches_{shard}" for shard in range(2)]
+    split_touches_dir(BUILD_DIR / "connectome/gliovascular/touches", touches_dirs)
+    shard_dirs = []
+    for shard, touches_dir in enumerate(touches_dirs):
+        shard_dir = tmp_path / f"glialglial_{shard}"
+        shard_dir.mkdir()
+        shard_dirs.append(shard_dir)
+        for rank_dir in touches_dir.iterdir():
+            subprocess.run(
+                [
+                    "ngv",
+                    "glialglial-connectivity",
+                    "--astrocytes",
+                    str(astrocytes_path),
+                    "--touches-dir",
+                    str(rank_dir),
+                    "--population-name",
+                    population_name,
+                    "--output-connectivity",
+                    str(shard_dir / f"{rank_dir.name}.h5"),
+                    "--seed",
+                    str(int(rank_dir.name)),
+                ],
+                check=True,
+            )
+    node_count = libsonata.NodeStorage(str(astrocytes_path)).open_population("astrocytes").size
+    out_edges = tmp_path / "edges.h5"
+    module.merge(module.rank_edges(shard_dirs), population_name, node_count, out_edges)
+
+    expected_edges = BUILD_DIR / "sonata/networks/edges/glialglial/edges.h5"
+    pd.testing.assert_frame_equal(
+        _edges_dataframe(out_edges, population_name),
+        _edges_dataframe(expected_edges, population_name),
+    )
@@ -0,0 +1,8 @@
+import pytest
+from utils import load_script
+
+
+@pytest.fixture(scope="module")
+def test_module(request):
+    """Return the module of the script named by ``SCRIPT_NAME`` in the test module."""
+    return load_script(request.module.SCRIPT_NAME)
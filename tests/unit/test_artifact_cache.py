@@ -0,0 +1,63 @@
+import os
+
+from circuit_build import artifact_cache as test_module
+
+
+def test_artifact_key_prefix():
+    env_config = {"modules": ["brainbuilder/0.19.0"]}
+    command = ["cmd", "--input", "/a/b/file.txt", "--seed", "0"]
+
+    result = test_module.artifact_key_prefix(command, env_config, inputs=["/a/b/file.txt"])
+
+    # the key doesn't depend on the location of the inputs
+    command = ["cmd", "--input", "/c/file.txt", "--seed", "0"]
+    assert result == test_module.artifact_key_prefix(command, env_config, inputs=["/c/file.txt"])
+    # but it depends on the other parameters and on the environment
+    command = ["cmd", "--input", "/c/file.txt", "--seed", "1"]
+    assert result != test_module.artifact_key_prefix(command, env_config, inputs=["/c/file.txt"])
+    env_config = {"modules": ["brainbuilder/0.20.0"]}
+    command = ["cmd", "--input", "/c/file.txt", "--seed", "0"]
+    assert result != test_module.artifact_key_prefix(command, env_config, inputs=["/c/file.txt"])
+
+
+def test_artifact_key(tmp_path):
+    path1 = tmp_path / "file1.txt"
+    path2 = tmp_path / "file2.txt"
+    path1.write_text("content")
+    path2.write_text("content")
+
+    result = test_module.artifact_key("prefix", [path1])
+
+    assert result == test_module.artifact_key("prefix", [path2])
+    assert result != test_module.artifact_key("other", [path2])
+    path2.write_text("modified")
+    assert result != test_module.artifact_key("prefix", [path2])
+
+
+def test_fetch_and_store(tmp_path):
+    cache_dir = tmp_path / "cache"
+    output = tmp_path / "circuit1" / "output.h5"
+    output.parent.mkdir()
+    output.write_text("output")
+
+    assert test_module.fetch(cache_dir, "key", [output]) is False
+
+    test_module.store(cache_dir, "key", [output])
+
+    new_output = tmp_path / "circuit2" / "output.h5"
+    assert test_module.fetch(cache_dir, "key", [new_output]) is True
+    assert new_output.read_text() == "output"
+    assert os.path.samefile(output, new_output)
+
+
+def test_build_artifact_cache_cmd():
+    result = test_module.build_artifact_cache_cmd(
+        "( cmd ) >{log} 2>&1", cache_dir="/cache", key_prefix="abc", inputs=["{input}", "/a b"]
+    )
+
+    options = "--cache-dir /cache --key abc --input '{input}' --input '/a b'"
+    assert result == (
+        f"if circuit-build -v artifact-cache fetch {options} {{output}} >{{log}} 2>&1; "
+        f"then true; else ( cmd ) >{{log}} 2>&1 && "
+        f"circuit-build -v artifact-cache store {options} {{output}} >>{{log}} 2>&1; fi"
+    )
@@ -147,6 +147,96 @@ def test_ok_with_report(run_mock, datetime_mock, open_mock, mkdir_mock, snakefil
     ]
 
 
+@patch("circuit_build.cli.update_provenance")
+@patch("circuit_build.cli.restore_mtimes")
+@patch("circuit_build.cli.datetime")
+@patch("circuit_build.cli.subprocess.run")
+def test_ok_with_content_hash(run_mock, datetime_mock, restore_mock, update_mock, snakemake_args):
+    run_mock.return_value.returncode = 0
+    datetime_mock.now.return_value = datetime(2021, 4, 21, 12, 34, 56)
+    restore_mock.return_value = []
+    runner = CliRunner()
+
+    result = runner.invoke(
+        test_module.run, snakemake_args + ["--content-hash"], catch_exceptions=False
+    )
+
+    assert run_mock.call_count == 1
+    assert result.exit_code == 0
+    restore_mock.assert_called_once_with(".")
+    update_mock.assert_called_once_with(".")
+
+
+@patch("circuit_build.cli.datetime")
+@patch("circuit_build.cli.subprocess.run")
+def test_ok_with_artifact_cache(run_mock, datetime_mock, snakefile, snakemake_args, tmp_path):
+    run_mock.return_value.returncode = 0
+    datetime_mock.now.return_value = datetime(2021, 4, 21, 12, 34, 56)
+    expected_timestamp = "20210421T123456"
+    runner = CliRunner()
+
+    result = runner.invoke(
+        test_module.run,
+        snakemake_args + ["--artifact-cache", str(tmp_path)],
+        catch_exceptions=False,
+    )
+
+    assert run_mock.call_count == 1
+    assert result.exit_code == 0
+    args = run_mock.call_args_list[0][0][0]
+    assert args == [
+        "snakemake",
+        "--snakefile",
+        snakefile,
+        "--directory",
+        ".",
+        "--config",
+        f"bioname={TEST_PROJ_TINY}",
+        f"timestamp={expected_timestamp}",
+        f"cluster_config={TEST_PROJ_TINY / 'cluster.yaml'}",
+        f"artifact_cache={tmp_path}",
+        "--jobs",
+        "8",
+        "--printshellcmds",
+    ]
+
+
+@patch("circuit_build.cli.datetime")
+@patch("circuit_build.cli.subprocess.run")
+def test_ok_with_sbatch(run_mock, datetime_mock, snakefile, snakemake_args, tmp_path):
+    run_mock.return_value.returncode = 0
+    datetime_mock.now.return_value = datetime(2021, 4, 21, 12, 34, 56)
+    expected_timestamp = "20210421T123456"
+    expected_profile_dir = tmp_path / "logs" / expected_timestamp / "sbatch_profile"
+    runner = CliRunner()
+
+    result = runner.invoke(
+        test_module.run,
+        snakemake_args + ["--directory", str(tmp_path), "--sbatch"],
+        catch_exceptions=False,
+    )
+
+    assert run_mock.call_count == 1
+    assert result.exit_code == 0
+    args = run_mock.call_args_list[0][0][0]
+    assert args == [
+        "snakemake",
+        "--snakefile",
+        snakefile,
+        "--directory",
+        str(tmp_path),
+        "--config",
+        f"bioname={TEST_PROJ_TINY}",
+        f"timestamp={expected_timestamp}",
+        f"cluster_config={TEST_PROJ_TINY / 'cluster.yaml'}",
+        "sbatch=1",
+        "--profile",
+        str(expected_profile_dir),
+        "--printshellcmds",
+    ]
+    assert (expected_profile_dir / "config.yaml").is_file()
+
+
 def test_config_is_set_already(snakemake_args):
     runner = CliRunner()
     expected_match = "snakemake `--config` option is not allowed"
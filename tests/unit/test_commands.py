@@ -1,3 +1,4 @@
+import subprocess
 from pathlib import Path
 from unittest.mock import patch
 
@@ -10,15 +11,20 @@ from circuit_build.constants import (
     APPTAINER_MODULEPATH,
     APPTAINER_MODULES,
     APPTAINER_OPTIONS,
+    DASK_CLUSTER_SCRIPT,
     SPACK_MODULEPATH,
+    THREADS_ENV_VARS,
 )
+from circuit_build.utils import script_path
 
 VENV_DIR = "/path/to/venv"
 VENV_ACTIVATE_FILE = f"{VENV_DIR}/bin/activate"
-UNSET_CMD = (
-    "unset GOTO_NUM_THREADS MKL_NUM_THREADS NUMEXPR_NUM_THREADS "
-    "OMP_NUM_THREADS OPENBLAS_NUM_THREADS VECLIB_MAXIMUM_THREADS"
+THREADS_VARS = (
+    "GOTO_NUM_THREADS={0} MKL_NUM_THREADS={0} NUMEXPR_NUM_THREADS={0} "
+    "OMP_NUM_THREADS={0} OPENBLAS_NUM_THREADS={0} VECLIB_MAXIMUM_THREADS={0}"
 )
+LOCAL_THREADS_VARS = THREADS_VARS.format("{threads}")
+SLURM_THREADS_VARS = "unset " + " ".join(THREADS_ENV_VARS)
 
 
 def test_get_source_file_with_existing_script(tmp_path):
@@ -89,7 +95,7 @@ def test_get_source_file_with_not_existing_path(tmp_path):
                 },
             },
             (
-                f"set -ex; {UNSET_CMD} && "
+                "set -ex; "
                 ". /etc/profile.d/modules.sh "
                 "&& module purge "
                 f"&& export MODULEPATH={SPACK_MODULEPATH} "
@@ -97,7 +103,7 @@ def test_get_source_file_with_not_existing_path(tmp_path):
                 f"&& echo MODULEPATH={SPACK_MODULEPATH} "
                 "&& module list "
                 "&& salloc -J brainbuilder -A ${{SALLOC_ACCOUNT}} -p prod_small --time 0:10:00 "
-                "srun sh -c 'echo mytest'"
+                f"srun sh -c '{SLURM_THREADS_VARS} && echo mytest'"
             ),
             id="module",
         ),
@@ -112,7 +118,7 @@ def test_get_source_file_with_not_existing_path(tmp_path):
                 },
             },
             (
-                f"set -ex; {UNSET_CMD} && "
+                "set -ex; "
                 ". /etc/profile.d/modules.sh "
                 "&& module purge "
                 f"&& export MODULEPATH={SPACK_MODULEPATH} "
@@ -121,7 +127,7 @@ def test_get_source_file_with_not_existing_path(tmp_path):
                 "&& module list "
                 "&& salloc -J brainbuilder -A ${{SALLOC_ACCOUNT}} -p prod_small --time 0:10:00 "
                 "srun sh -c '"
-                "export MYVAR2=VALUE2 MYVAR3=VALUE4 MYVAR1=VALUE1 "
+                f"{SLURM_THREADS_VARS} && export MYVAR2=VALUE2 MYVAR3=VALUE4 MYVAR1=VALUE1 "
                 "&& echo mytest"
                 "'"
             ),
@@ -138,14 +144,14 @@ def test_get_source_file_with_not_existing_path(tmp_path):
                 },
             },
             (
-                f"set -ex; {UNSET_CMD} && "
+                "set -ex; "
                 ". /etc/profile.d/modules.sh "
                 "&& module purge "
                 f"&& export MODULEPATH={SPACK_MODULEPATH} "
                 "&& module load archive/2022-03 brainbuilder/0.17.0 "
                 f"&& echo MODULEPATH={SPACK_MODULEPATH} "
                 "&& module list "
-                "&& export MYVAR2=VALUE3 MYVAR3=VALUE4 "
+                f"&& export {LOCAL_THREADS_VARS} MYVAR2=VALUE3 MYVAR3=VALUE4 "
                 "&& echo mytest"
             ),
             id="module_with_env_vars_without_slurm",
@@ -160,13 +166,14 @@ def test_get_source_file_with_not_existing_path(tmp_path):
                 },
             },
             (
-                f"set -ex; {UNSET_CMD} && "
+                "set -ex; "
                 ". /etc/profile.d/modules.sh "
                 "&& module purge "
                 f"&& export MODULEPATH={SPACK_MODULEPATH} "
                 "&& module load archive/2022-03 brainbuilder/0.17.0 "
                 f"&& echo MODULEPATH={SPACK_MODULEPATH} "
                 "&& module list "
+                f"&& export {LOCAL_THREADS_VARS} "
                 "&& echo mytest"
             ),
             id="module_without_slurm",
@@ -178,7 +185,7 @@ def test_get_source_file_with_not_existing_path(tmp_path):
                 "brainbuilder": {"env_type": "APPTAINER", "image": "nse/brainbuilder_0.17.1.sif"},
             },
             (
-                f"set -ex; {UNSET_CMD} && "
+                "set -ex; "
                 ". /etc/profile.d/modules.sh "
                 "&& module purge "
                 f"&& module use {APPTAINER_MODULEPATH} "
@@ -186,6 +193,7 @@ def test_get_source_file_with_not_existing_path(tmp_path):
                 f"&& {APPTAINER_EXECUTABLE} --version "
                 "&& salloc -J brainbuilder -A ${{SALLOC_ACCOUNT}} -p prod_small --time 0:10:00 "
                 "srun sh -c '"
+                f"{SLURM_THREADS_VARS} && "
                 f"{APPTAINER_EXECUTABLE} exec {APPTAINER_OPTIONS} "
                 f"{APPTAINER_IMAGEPATH}/nse/brainbuilder_0.17.1.sif "
                 'bash <<EOF\ncd "$(pwd)" && echo mytest\nEOF\n\''
@@ -199,12 +207,13 @@ def test_get_source_file_with_not_existing_path(tmp_path):
                 "brainbuilder": {"env_type": "APPTAINER", "image": "nse/brainbuilder_0.17.1.sif"},
             },
             (
-                f"set -ex; {UNSET_CMD} && "
+                "set -ex; "
                 ". /etc/profile.d/modules.sh "
                 "&& module purge "
                 f"&& module use {APPTAINER_MODULEPATH} "
                 f"&& module load {' '.join(APPTAINER_MODULES)} "
                 f"&& {APPTAINER_EXECUTABLE} --version "
+                f"&& export {LOCAL_THREADS_VARS} "
                 f"&& {APPTAINER_EXECUTABLE} exec {APPTAINER_OPTIONS} "
                 f"{APPTAINER_IMAGEPATH}/nse/brainbuilder_0.17.1.sif "
                 'bash <<EOF\ncd "$(pwd)" && echo mytest\nEOF\n'
@@ -218,10 +227,11 @@ def test_get_source_file_with_not_existing_path(tmp_path):
                 "brainbuilder": {"env_type": "VENV", "path": VENV_DIR},
             },
             (
-                f"set -ex; {UNSET_CMD} && "
+                "set -ex; "
                 "salloc -J brainbuilder -A ${{SALLOC_ACCOUNT}} -p prod_small --time 0:10:00 "
                 "srun sh -c '"
-                f". {VENV_ACTIVATE_FILE} "
+                f"{SLURM_THREADS_VARS} "
+                f"&& . {VENV_ACTIVATE_FILE} "
                 "&& echo mytest'"
             ),
             id="venv",
@@ -237,7 +247,7 @@ def test_get_source_file_with_not_existing_path(tmp_path):
                 },
             },
             (
-                f"set -ex; {UNSET_CMD} && "
+                "set -ex; "
                 ". /etc/profile.d/modules.sh "
                 "&& module purge "
                 f"&& export MODULEPATH={SPACK_MODULEPATH} "
@@ -246,7 +256,8 @@ def test_get_source_file_with_not_existing_path(tmp_path):
                 "&& module list "
                 "&& salloc -J brainbuilder -A ${{SALLOC_ACCOUNT}} -p prod_small --time 0:10:00 "
                 "srun sh -c '"
-                f". {VENV_ACTIVATE_FILE} "
+                f"{SLURM_THREADS_VARS} "
+                f"&& . {VENV_ACTIVATE_FILE} "
                 "&& echo mytest'"
             ),
             id="venv_with_modules",
@@ -263,7 +274,7 @@ def test_get_source_file_with_not_existing_path(tmp_path):
                 },
             },
             (
-                f"set -ex; {UNSET_CMD} && "
+                "set -ex; "
                 ". /etc/profile.d/modules.sh "
                 "&& module purge "
                 f"&& export MODULEPATH={SPACK_MODULEPATH} "
@@ -272,7 +283,7 @@ def test_get_source_file_with_not_existing_path(tmp_path):
                 "&& module list "
                 "&& salloc -J brainbuilder -A ${{SALLOC_ACCOUNT}} -p prod_small --time 0:10:00 "
                 "srun sh -c '"
-                "export MYVAR2=VALUE3 MYVAR3=VALUE4 "
+                f"{SLURM_THREADS_VARS} && export MYVAR2=VALUE3 MYVAR3=VALUE4 "
                 f"&& . {VENV_ACTIVATE_FILE} "
                 "&& echo mytest'"
             ),
@@ -284,7 +295,7 @@ def test_get_source_file_with_not_existing_path(tmp_path):
             {
                 "brainbuilder": {"env_type": "VENV", "path": VENV_DIR},
             },
-            f"set -ex; {UNSET_CMD} && " f". {VENV_ACTIVATE_FILE} && echo mytest",
+            f"set -ex; export {LOCAL_THREADS_VARS} && . {VENV_ACTIVATE_FILE} && echo mytest",
             id="venv_without_slurm",
         ),
         pytest.param(
@@ -294,10 +305,11 @@ def test_get_source_file_with_not_existing_path(tmp_path):
                 "touchdetector": {"env_type": "VENV", "path": VENV_DIR},
             },
             (
-                f"set -ex; {UNSET_CMD} && "
+                "set -ex; "
                 "salloc -J touchdetector -A ${{SALLOC_ACCOUNT}} -p prod_small --time 0:05:00 "
                 "srun sh -c '"
-                f". {VENV_ACTIVATE_FILE} "
+                f"{SLURM_THREADS_VARS} "
+                f"&& . {VENV_ACTIVATE_FILE} "
                 "&& echo mytest'"
             ),
             id="fallback_to_default_cluster",
@@ -334,6 +346,119 @@ def test_build_command(
     assert result == expected
 
 
+@patch(f"{test_module.__name__}._get_source_file", return_value=Path(VENV_ACTIVATE_FILE))
+def test_build_command_with_pre_and_post_cmd(mock_get_source_file, monkeypatch):
+    monkeypatch.delenv("LOG_ALL_TO_STDERR", raising=False)
+    env_config = {"brainbuilder": {"env_type": "VENV", "path": VENV_DIR}}
+    cluster_config = {"brainbuilder": {"salloc": "-p prod_small"}}
+
+    result = test_module.build_command(
+        cmd=["echo", "mytest"],
+        env_config=env_config,
+        env_name="brainbuilder",
+        cluster_config=cluster_config,
+        slurm_env="brainbuilder",
+        options=test_module.CommandOptions(pre_cmd=["echo", "pre"], post_cmd=["echo", "post"]),
+    )
+
+    assert result == (
+        f"( set -ex; export {LOCAL_THREADS_VARS} && "
+        f". {VENV_ACTIVATE_FILE} && echo pre && "
+        "salloc -J brainbuilder -p prod_small srun sh -c '"
+        f"{SLURM_THREADS_VARS} && "
+        f". {VENV_ACTIVATE_FILE} && echo mytest' && "
+        f"export {LOCAL_THREADS_VARS} && "
+        f". {VENV_ACTIVATE_FILE} && echo post ) >{{log}} 2>&1"
+    )
+
+
+@patch(f"{test_module.__name__}._get_source_file", return_value=Path(VENV_ACTIVATE_FILE))
+def test_build_command_with_condition(mock_get_source_file, monkeypatch):
+    monkeypatch.delenv("LOG_ALL_TO_STDERR", raising=False)
+    env_config = {"brainbuilder": {"env_type": "VENV", "path": VENV_DIR}}
+    cluster_config = {"brainbuilder": {"salloc": "-p prod_small"}}
+
+    result = test_module.build_command(
+        cmd=["echo", "mytest"],
+        env_config=env_config,
+        env_name="brainbuilder",
+        cluster_config=cluster_config,
+        slurm_env="brainbuilder",
+        options=test_module.CommandOptions(pre_cmd=["echo", "pre"], condition="[ -s file ]"),
+    )
+
+    assert result == (
+        f"( set -ex; export {LOCAL_THREADS_VARS} && "
+        f". {VENV_ACTIVATE_FILE} && echo pre && "
+        "if [ -s file ]; then\n"
+        "salloc -J brainbuilder -p prod_small srun sh -c '"
+        f"{SLURM_THREADS_VARS} && "
+        f". {VENV_ACTIVATE_FILE} && echo mytest'\nfi ) >{{log}} 2>&1"
+    )
+
+
+@patch(f"{test_module.__name__}._get_source_file", return_value=Path(VENV_ACTIVATE_FILE))
+def test_build_command_with_managed_dask(mock_get_source_file, monkeypatch):
+    monkeypatch.delenv("LOG_ALL_TO_STDERR", raising=False)
+    env_config = {"brainbuilder": {"env_type": "VENV", "path": VENV_DIR}}
+    cluster_config = {
+        "brainbuilder": {
+            "salloc": "-p prod_small",
+            "dask": {"managed": True, "memory_limit": "4GB", "memory_spill": False},
+        }
+    }
+    script = script_path(DASK_CLUSTER_SCRIPT)
+
+    result = test_module.build_command(
+        cmd=["echo", "mytest"],
+        env_config=env_config,
+        env_name="brainbuilder",
+        cluster_config=cluster_config,
+        slurm_env="brainbuilder",
+    )
+
+    assert test_module.is_dask_managed(cluster_config, "brainbuilder") is True
+    assert test_module.is_dask_managed(cluster_config, None) is False
+    assert result == (
+        "( set -ex; "
+        "salloc -J brainbuilder -p prod_small srun sh -c '"
+        f"{SLURM_THREADS_VARS} && export "
+        "DASK_DISTRIBUTED__WORKER__MEMORY__TARGET=0.6 "
+        "DASK_DISTRIBUTED__WORKER__MEMORY__SPILL=False "
+        "DASK_DISTRIBUTED__WORKER__MEMORY__PAUSE=0.85 "
+        "DASK_DISTRIBUTED__WORKER__MEMORY__TERMINATE=0.95 && "
+        f". {VENV_ACTIVATE_FILE} && "
+        f"python {script} --log-path {{log}} --memory-limit 4GB '\\''echo mytest'\\''' "
+        ") >{log} 2>&1"
+    )
+
+
+@patch(f"{test_module.__name__}._get_source_file", return_value=Path(VENV_ACTIVATE_FILE))
+def test_build_command_with_sbatch(mock_get_source_file, monkeypatch):
+    monkeypatch.delenv("LOG_ALL_TO_STDERR", raising=False)
+    env_config = {"brainbuilder": {"env_type": "VENV", "path": VENV_DIR}}
+    cluster_config = {"brainbuilder": {"salloc": "-p prod_small", "cpu_bind": "cores"}}
+
+    result = test_module.build_command(
+        cmd=["echo", "mytest"],
+        env_config=env_config,
+        env_name="brainbuilder",
+        cluster_config=cluster_config,
+        slurm_env="brainbuilder",
+        options=test_module.CommandOptions(sbatch=True),
+    )
+
+    assert result == (
+        "( set -ex; "
+        "srun --cpu-bind=cores sh -c '"
+        f"{SLURM_THREADS_VARS} && export OMP_PROC_BIND=close OMP_PLACES=cores && "
+        f". {VENV_ACTIVATE_FILE} && echo mytest' "
+        ") >{log} 2>&1"
+    )
+    # the cluster config is not modified
+    assert "sbatch" not in cluster_config["brainbuilder"]
+
+
 def test_build_command_raises_when_slurm_env_is_missing():
     env_name = "brainbuilder"
     slurm_env = "brainbuilder"
@@ -411,3 +536,211 @@ def test_load_legacy_env_config_raises_when_environment_is_unknown(custom_module
     match = "Unknown environment: unknown_env, known environments are"
     with pytest.raises(Exception, match=match):
         test_module.load_legacy_env_config(custom_modules)
+
+
+@pytest.mark.parametrize(
+    "salloc, expected",
+    [
+        ("-A ${{SALLOC_ACCOUNT}} -p prod --time 1:00:00", {}),
+        ("-p prod -n100 --mem=300G", {"ntasks": "100", "mem": "300G"}),
+        ("-p prod -n 100 --mem 300G", {"ntasks": "100", "mem": "300G"}),
+        (
+            "-N2 --ntasks=8 -c 4 --mem-per-cpu=2G",
+            {"nodes": "2", "ntasks": "8", "cpus_per_task": "4", "mem_per_cpu": "2G"},
+        ),
+        ("--nodes=1-2 --cpus-per-task=2 -C cpu", {"nodes": "1-2", "cpus_per_task": "2"}),
+        ("-N 2 --ntasks-per-node=4 --exclusive", {"nodes": "2", "ntasks_per_node": "4"}),
+    ],
+)
+def test_parse_salloc(salloc, expected):
+    assert test_module._parse_salloc(salloc) == expected
+
+
+@pytest.mark.parametrize(
+    "salloc, expected",
+    [
+        ("-p prod -n 100", None),
+        ("-p prod -n 100 --mem=0", None),
+        ("-p prod -n 10 --mem=40G", 4096),
+        ("-p prod -N 2 -n 10 --mem=40960", 8192),
+        ("-p prod -N 2 --mem=40G", 40960),
+        ("-p prod -c 4 --mem-per-cpu=1024M", 4096),
+        ("-p prod -N 2 --ntasks-per-node=2 --mem=40G", 20480),
+        ("-p prod -n 10 --mem=lots", None),
+    ],
+)
+def test_get_task_memory_mb(salloc, expected):
+    assert test_module._get_task_memory_mb({"salloc": salloc}) == expected
+
+
+@pytest.mark.parametrize(
+    "cluster_config, slurm_env, expected",
+    [
+        ({}, "place_cells", {}),
+        ({"__default__": {"salloc": "-p prod"}}, None, {}),
+        (
+            {"__default__": {"salloc": "-p prod"}},
+            "place_cells",
+            {"slurm_env": "place_cells", "nodes": 1, "cpus": 1},
+        ),
+        (
+            {"place_cells": {"salloc": "-p prod -N 2 --mem=300G --exclusive"}},
+            "place_cells",
+            {"slurm_env": "place_cells", "nodes": 2, "cpus": 2, "mem_mb": 614400},
+        ),
+        (
+            {"place_cells": {"salloc": "-p prod -n 10 -c 4 --mem-per-cpu=1G"}},
+            "place_cells",
+            {"slurm_env": "place_cells", "nodes": 1, "cpus": 40, "mem_mb": 40960},
+        ),
+        ({"place_cells": {"salloc": "-p prod -n many"}}, "place_cells", {}),
+    ],
+)
+def test_get_slurm_resources(cluster_config, slurm_env, expected):
+    assert test_module.get_slurm_resources(cluster_config, slurm_env) == expected
+
+
+@pytest.mark.parametrize(
+    "cluster_config, expected",
+    [
+        ({"salloc": "-n 10 --mem=40G"}, {}),
+        ({"salloc": "-n 10 --mem=40G", "dask": {"managed": False}}, {}),
+        ({"salloc": "-n 10", "dask": {"managed": True}}, {}),
+        (
+            {"salloc": "-n 10 --mem=40G", "dask": {"managed": True}},
+            {
+                "DASK_DISTRIBUTED__WORKER__MEMORY__TARGET": "0.6",
+                "DASK_DISTRIBUTED__WORKER__MEMORY__SPILL": "0.7",
+                "DASK_DISTRIBUTED__WORKER__MEMORY__PAUSE": "0.85",
+                "DASK_DISTRIBUTED__WORKER__MEMORY__TERMINATE": "0.95",
+            },
+        ),
+        (
+            {"salloc": "-n 10", "dask": {"managed": True, "memory_limit": "4GB"}},
+            {
+                "DASK_DISTRIBUTED__WORKER__MEMORY__TARGET": "0.6",
+                "DASK_DISTRIBUTED__WORKER__MEMORY__SPILL": "0.7",
+                "DASK_DISTRIBUTED__WORKER__MEMORY__PAUSE": "0.85",
+                "DASK_DISTRIBUTED__WORKER__MEMORY__TERMINATE": "0.95",
+            },
+        ),
+        (
+            {"salloc": "-n 10 --mem=40G", "dask": {"memory_terminate": False}},
+            {"DASK_DISTRIBUTED__WORKER__MEMORY__TERMINATE": "False"},
+        ),
+    ],
+)
+def test_get_dask_env_vars(cluster_config, expected):
+    assert test_module._get_dask_env_vars(cluster_config) == expected
+
+
+@pytest.mark.parametrize(
+    "dask_config, expected",
+    [
+        ({"managed": False}, "echo mytest"),
+        ({"managed": True}, "--memory-limit 4096MiB 'echo mytest'"),
+        ({"managed": True, "memory_limit": "2GB"}, "--memory-limit 2GB 'echo mytest'"),
+    ],
+)
+def test_with_dask_cluster(dask_config, expected):
+    cluster_config = {"salloc": "-n 10 --mem=40G", "dask": dask_config}
+
+    result = test_module._with_dask_cluster("echo mytest", cluster_config)
+
+    assert result.endswith(expected)
+
+
+@pytest.mark.parametrize(
+    "cluster_config, expected",
+    [
+        ({}, dict.fromkeys(THREADS_ENV_VARS, "{threads}")),
+        ({"salloc": "-p prod -n 10"}, dict.fromkeys(THREADS_ENV_VARS)),
+        ({"salloc": "-p prod -n 10 -c 4"}, dict.fromkeys(THREADS_ENV_VARS, "4")),
+        (
+            {"salloc": "-p prod --ntasks-per-node=2 --exclusive --mem 0"},
+            dict.fromkeys(THREADS_ENV_VARS, "$(( SLURM_CPUS_ON_NODE / 2 ))"),
+        ),
+        (
+            {"salloc": "-p prod --ntasks-per-node 2 --cpus-per-task=8"},
+            dict.fromkeys(THREADS_ENV_VARS, "8"),
+        ),
+        (
+            {"salloc": "-p prod -n 10 --cpus-per-task=2", "cpu_bind": "cores"},
+            {
+                **dict.fromkeys(THREADS_ENV_VARS, "2"),
+                "OMP_PROC_BIND": "close",
+                "OMP_PLACES": "cores",
+            },
+        ),
+    ],
+)
+def test_get_threads_env_vars(cluster_config, expected):
+    assert test_module._get_threads_env_vars(cluster_config) == expected
+
+
+def test_with_slurm_with_cpu_bind():
+    cluster_config = {"jobname": "job", "salloc": "-p prod -n 10", "cpu_bind": "cores"}
+
+    result = test_module._with_slurm("echo mytest", cluster_config)
+
+    assert result == "salloc -J job -p prod -n 10 srun --cpu-bind=cores sh -c 'echo mytest'"
+
+
+@pytest.mark.parametrize(
+    "cluster_config, expected",
+    [
+        (
+            {},
+            "for batch in 0 1; do\nexport batch && echo $batch\n[ $? -eq 0 ] || exit 1\ndone",
+        ),
+        (
+            {"jobname": "job", "salloc": "-p prod -n 10"},
+            "salloc -J job -p prod -n 10 sh -c 'for batch in 0 1; do\n"
+            "export batch && srun sh -c '\\''echo $batch'\\''\n[ $? -eq 0 ] || exit 1\ndone'",
+        ),
+        (
+            {"jobname": "job", "salloc": "-p prod -n 10", "sbatch": True},
+            "for batch in 0 1; do\n"
+            "export batch && srun sh -c 'echo $batch'\n[ $? -eq 0 ] || exit 1\ndone",
+        ),
+    ],
+)
+def test_with_slurm_with_loop(cluster_config, expected):
+    options = test_module.CommandOptions(loop="batch in 0 1")
+
+    result = test_module._with_slurm("echo $batch", cluster_config, options)
+
+    assert result == expected
+
+
+def test_with_loop_stops_at_first_failure(tmp_path):
+    path = tmp_path / "out.txt"
+    cmd = f"echo $batch >> {path} && [ $batch -lt 1 ] <<EOF\nheredoc\nEOF\n"
+
+    result = subprocess.run(["bash", "-c", test_module._with_loop(cmd, "batch in 0 1 2")])
+
+    assert result.returncode == 1
+    assert path.read_text() == "0\n1\n"
+
+
+@pytest.mark.parametrize(
+    "cluster_config, expected",
+    [
+        ({}, "echo mytest"),
+        (
+            {"jobname": "job", "salloc": "-p prod -n 10"},
+            "salloc -J job -p prod -n 10 sh -c '"
+            "srun --ntasks=1 --cpus-per-task=$SLURM_CPUS_ON_NODE sh -c '\\''echo mytest'\\'''",
+        ),
+        (
+            {"jobname": "job", "salloc": "-p prod -n 10", "sbatch": True},
+            "srun --ntasks=1 --cpus-per-task=$SLURM_CPUS_ON_NODE sh -c 'echo mytest'",
+        ),
+    ],
+)
+def test_with_slurm_with_single_task(cluster_config, expected):
+    options = test_module.CommandOptions(single_task=True)
+
+    result = test_module._with_slurm("echo mytest", cluster_config, options)
+
+    assert result == expected
@@ -17,7 +17,8 @@ from utils import (
 )
 
 from circuit_build import context as test_module
-from circuit_build.constants import ENV_CONFIG
+from circuit_build.artifact_cache import CacheOptions
+from circuit_build.constants import ENV_CONFIG, RECIPE_SECTIONS
 from circuit_build.utils import dump_yaml, load_yaml
 
 
@@ -173,6 +174,18 @@ def test_context_in_isolated_phase(mocked_validate_morphology_release, monkeypat
     assert ctx.skip_morphology_release_validation() is True
 
 
+def test_in_process(monkeypatch):
+    monkeypatch.delenv("CIRCUIT_BUILD_SKIP_IN_PROCESS", raising=False)
+    ctx = _get_context(TEST_PROJ_TINY)
+
+    assert ctx.in_process("yaml") is True
+    assert ctx.in_process("not_existing_module") is False
+
+    monkeypatch.setenv("CIRCUIT_BUILD_SKIP_IN_PROCESS", "true")
+
+    assert ctx.in_process("yaml") is False
+
+
 @pytest.mark.parametrize("spine_morphologies_dir", [None, "", "/path/to/spine_morphologies"])
 @pytest.mark.parametrize("is_partial_config", [False, True])
 def test_write_network_config__release(tmp_path, is_partial_config, spine_morphologies_dir):
@@ -562,6 +575,208 @@ def test_provenance():
     assert context.provenance() == {"provenance": {"bioname_dir": context.paths.bioname_dir}}
 
 
+def test_recipe_digest():
+    context = _get_context(TEST_PROJ_TINY)
+
+    result = {rule: context.recipe_digest(rule) for rule in RECIPE_SECTIONS}
+
+    assert len(set(result.values())) == len(RECIPE_SECTIONS)
+    assert all(len(digest) == 64 for digest in result.values())
+
+
+def test_dask_managed():
+    context = _get_context(TEST_PROJ_TINY)
+    context.cluster_config = {
+        "__default__": {"salloc": ""},
+        "synthesize_morphologies": {"salloc": "", "dask": {"managed": True}},
+    }
+
+    assert context.dask_managed("synthesize_morphologies") is True
+    assert context.dask_managed("adapt_emodels") is False
+
+
+def test_slurm_resources():
+    context = _get_context(TEST_PROJ_TINY)
+    context.cluster_config = {
+        "__default__": {"salloc": "-p prod --time 1:00:00"},
+        "place_cells": {"salloc": "-p prod --mem 300G -N2 -n4 -c8"},
+    }
+
+    assert context.slurm_resources("place_cells") == {
+        "slurm_env": "place_cells",
+        "nodes": 2,
+        "cpus": 32,
+        "mem_mb": 614400,
+    }
+    assert context.slurm_resources("node_sets") == {"slurm_env": "node_sets", "nodes": 1, "cpus": 1}
+    assert context.slurm_resources(None) == {}
+
+
+def test_local_threads():
+    context = _get_context(TEST_PROJ_TINY)
+    context.cluster_config = {"touchdetector": {"salloc": "-p prod -n4 -c8"}}
+
+    assert context.local_threads("touchdetector", 16) == 1
+    assert context.local_threads(None, 16) == 16
+    context.cluster_config = {}
+    assert context.local_threads("touchdetector", 16) == 16
+
+
+def test_rule_groups():
+    context = _get_context(TEST_PROJ_TINY)
+    context.cluster_config = {
+        "__default__": {"salloc": "-p prod --time 1:00:00"},
+        "__groups__": {"small": {"rules": ["init_cells", "node_sets"], "salloc": "-n1"}},
+    }
+
+    assert context.rule_groups == {"init_cells": "small", "node_sets": "small"}
+
+
+def test_emodel_chunks():
+    context = _get_context(TEST_PROJ_TINY, override={"adapt_emodels": {"chunks": 4}})
+
+    assert context.emodel_chunks("adapt_emodels") == 4
+    assert context.emodel_chunks("compute_currents") == 1
+
+
+def test_glia_synthesis_shards():
+    context = _get_context(TEST_PROJ_TINY)
+    assert context.ngv.synthesis_shards == 1
+
+    context = _get_context(TEST_PROJ_TINY, override={"ngv": {"synthesis": {"shards": 4}}})
+    assert context.ngv.synthesis_shards == 4
+
+
+def test_morphologies_container(tmp_path):
+    override = {"synthesize_morphologies": {"container": True}}
+    with cwd(tmp_path):
+        ctx = _get_context(TEST_PROJ_SYNTH)
+        assert ctx.synthesis_container is False
+
+        ctx = _get_context(TEST_PROJ_SYNTH, override=override)
+        assert ctx.synthesis_container is True
+        ctx.write_network_config(connectome_dir="functional", output_file="circuit_config.json")
+        with open("circuit_config.json", "r", encoding="utf-8") as fd:
+            config = json.load(fd)
+
+    population = config["networks"]["nodes"][0]["populations"]["neocortex_neurons"]
+    assert population["alternate_morphologies"] == {
+        "h5v1": "$BASE_DIR/morphologies/neocortex_neurons.h5",
+        "neurolucida-asc": "$BASE_DIR/morphologies/neocortex_neurons",
+    }
+
+    # the container is used only for the synthesized morphologies
+    ctx = _get_context(TEST_PROJ_TINY, override=override)
+    assert ctx.synthesis_container is False
+
+
+def test_write_network_config__ngv_full_containers(tmp_path):
+    override = {
+        "synthesize_morphologies": {"container": True},
+        "ngv": {"synthesis": {"container": True}},
+    }
+    with cwd(tmp_path):
+        ctx = _get_context(TEST_NGV_FULL, override=override)
+        assert ctx.ngv.synthesis_container is True
+        ctx.write_network_ngv_config(output_file="circuit_config.json")
+        with open("circuit_config.json", "r", encoding="utf-8") as fd:
+            config = json.load(fd)
+
+    neurons, astrocytes = config["networks"]["nodes"][:2]
+    assert neurons["populations"]["neocortex_neurons"]["alternate_morphologies"] == {
+        "h5v1": "$BASE_DIR/morphologies/neocortex_neurons.h5",
+        "neurolucida-asc": "$BASE_DIR/morphologies/neocortex_neurons",
+    }
+    assert astrocytes["populations"]["astrocytes"]["alternate_morphologies"] == {
+        "h5v1": "$BASE_DIR/morphologies/astrocytes.h5",
+    }
+
+
+def test_endfeet_tiles():
+    override = {"ngv": {"endfeet_surface_meshes": {"fmm_cutoff_radius": 60.0}}}
+    context = _get_context(TEST_PROJ_TINY, override=override)
+    assert context.ngv.endfeet_tiles == 1
+    assert context.ngv.endfeet_growth_radius == 60.0
+    assert context.ngv.endfeet_tiles_halo == 120.0
+
+    override = {"ngv": {"endfeet_surface_meshes": {"tiles": 4, "halo": 80.0}}}
+    context = _get_context(TEST_PROJ_TINY, override=override)
+    assert context.ngv.endfeet_tiles == 4
+    assert context.ngv.endfeet_tiles_halo == 80.0
+
+
+def test_glia_finalization():
+    context = _get_context(TEST_PROJ_TINY)
+    assert context.ngv.finalization_merged is False
+    assert context.ngv.finalization_staging_dir == "${TMPDIR:-/tmp}"
+
+    override = {"ngv": {"finalize_connectivity": {"merged": True, "staging_dir": "/dev/shm"}}}
+    context = _get_context(TEST_PROJ_TINY, override=override)
+    assert context.ngv.finalization_merged is True
+    assert context.ngv.finalization_staging_dir == "/dev/shm"
+
+    override = {"ngv": {"finalize_connectivity": {"merged": True, "staging_dir": False}}}
+    context = _get_context(TEST_PROJ_TINY, override=override)
+    assert context.ngv.finalization_staging_dir is None
+
+
+def test_neuroglial_synapses_file():
+    context = _get_context(TEST_PROJ_TINY)
+
+    assert context.ngv.neuroglial_synapse_attributes is None
+    assert context.neuroglial_synapses_file == context.edges_neurons_neurons_file("functional")
+
+    attributes = ["afferent_center_x", "afferent_center_y", "afferent_center_z"]
+    override = {"ngv": {"neuroglial_connectivity": {"synapse_attributes": attributes}}}
+    context = _get_context(TEST_PROJ_TINY, override=override)
+
+    assert context.ngv.neuroglial_synapse_attributes == attributes
+    assert str(context.neuroglial_synapses_file).endswith("auxiliary/ngv_neuronal_synapses.h5")
+
+
+@pytest.mark.parametrize("artifact_cache", [None, "/path/to/cache"])
+@pytest.mark.parametrize("cache_inputs", [None, ["{input}"]])
+def test_bbp_env_with_artifact_cache(artifact_cache, cache_inputs):
+    context = _get_context(TEST_PROJ_TINY)
+    context.conf._config["artifact_cache"] = artifact_cache
+
+    cache = CacheOptions(inputs=cache_inputs) if cache_inputs is not None else None
+    result = context.bbp_env("brainbuilder", ["cmd", "{input}"], cache=cache)
+
+    if artifact_cache and cache_inputs:
+        assert result.startswith(
+            "if circuit-build -v artifact-cache fetch --cache-dir /path/to/cache --key "
+        )
+        assert "; else ( set -ex; " in result
+        assert "artifact-cache store" in result
+    else:
+        assert result.startswith("( set -ex; ")
+        assert "artifact-cache" not in result
+
+
+def test_bbp_env_with_cache_dir():
+    context = _get_context(TEST_PROJ_TINY)
+
+    result = context.bbp_env(
+        "brainbuilder",
+        ["cmd", "{input}"],
+        cache=CacheOptions(inputs=["{input}"], cache_dir="/path/to/dir"),
+    )
+
+    assert result.startswith("if circuit-build -v artifact-cache fetch --cache-dir /path/to/dir ")
+
+
+@pytest.mark.parametrize("artifact_cache", [None, "/path/to/cache"])
+def test_ngv_artifact_cache_dir(artifact_cache):
+    context = _get_context(TEST_PROJ_TINY)
+    context.conf._config["artifact_cache"] = artifact_cache
+
+    if artifact_cache:
+        assert context.ngv.artifact_cache_dir == artifact_cache
+    else:
+        assert str(context.ngv.artifact_cache_dir).endswith("auxiliary/artifact_cache")
+
+
 def test_run_spykfunc_s2s():
     context = _get_context(TEST_PROJ_TINY)
 
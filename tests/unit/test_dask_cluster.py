@@ -0,0 +1,26 @@
+from pathlib import Path
+
+import pytest
+
+SCRIPT_NAME = "dask_cluster.py"
+
+
+def test_cluster_paths(test_module):
+    scheduler_file, report_path = test_module.cluster_paths(
+        "logs/20240101T000000/synthesize_morphologies_1.log", "12345"
+    )
+
+    assert scheduler_file == Path(
+        "logs/20240101T000000/synthesize_morphologies_1_dask_scheduler_12345.json"
+    )
+    assert report_path == Path("logs/20240101T000000/synthesize_morphologies_1_dask_report.html")
+
+
+def test_main_raises_with_too_few_tasks(test_module, monkeypatch):
+    monkeypatch.setattr("sys.argv", ["dask_cluster.py", "--log-path", "job.log", "echo test"])
+    monkeypatch.setenv("SLURM_PROCID", "0")
+    monkeypatch.setenv("SLURM_NTASKS", "2")
+    monkeypatch.setenv("SLURM_JOB_ID", "12345")
+
+    with pytest.raises(ValueError, match="At least 3 tasks are needed"):
+        test_module.main()
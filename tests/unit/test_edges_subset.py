@@ -0,0 +1,52 @@
+import h5py
+import libsonata
+import numpy as np
+import pytest
+
+SCRIPT_NAME = "edges_subset.py"
+
+
+def _write_edges(path):
+    source_ids = [0, 2, 1, 2]
+    with h5py.File(path, "w") as h5:
+        population = h5.create_group("edges/neuronal")
+        population.create_dataset("source_node_id", data=source_ids)
+        population["source_node_id"].attrs["node_population"] = "neurons"
+        population.create_dataset("target_node_id", data=[1, 0, 2, 1])
+        population["target_node_id"].attrs["node_population"] = "neurons"
+        population.create_dataset("edge_type_id", data=np.full(len(source_ids), -1))
+        population.create_dataset("edge_group_id", data=np.zeros(len(source_ids), dtype=int))
+        population.create_dataset("edge_group_index", data=np.arange(len(source_ids)))
+        population.create_dataset("0/afferent_center_x", data=[1.0, 2.0, 3.0, 4.0])
+        population.create_dataset("0/syn_weight", data=[0.1, 0.2, 0.3, 0.4], compression="gzip")
+    libsonata.EdgePopulation.write_indices(str(path), "neuronal", 3, 3)
+
+
+def test_write_subset(tmp_path, test_module):
+    edges_path = tmp_path / "edges.h5"
+    _write_edges(edges_path)
+    out_path = tmp_path / "subset.h5"
+
+    test_module.write_subset(edges_path, "neuronal", ["afferent_center_x"], out_path, block_size=3)
+
+    population = libsonata.EdgeStorage(out_path).open_population("neuronal")
+    assert population.size == 4
+    assert population.source == "neurons"
+    assert population.attribute_names == {"afferent_center_x"}
+    selection = libsonata.Selection([[0, 4]])
+    np.testing.assert_array_equal(population.source_nodes(selection), [0, 2, 1, 2])
+    np.testing.assert_array_equal(population.target_nodes(selection), [1, 0, 2, 1])
+    np.testing.assert_array_equal(
+        population.get_attribute("afferent_center_x", selection), [1.0, 2.0, 3.0, 4.0]
+    )
+    np.testing.assert_array_equal(population.afferent_edges([1]).flatten(), [0, 3])
+    with h5py.File(out_path, "r") as h5:
+        assert h5["edges/neuronal/0/afferent_center_x"].chunks is None
+
+
+def test_write_subset_missing_attribute(tmp_path, test_module):
+    edges_path = tmp_path / "edges.h5"
+    _write_edges(edges_path)
+
+    with pytest.raises(KeyError, match="Attribute missing not found"):
+        test_module.write_subset(edges_path, "neuronal", ["missing"], tmp_path / "subset.h5")
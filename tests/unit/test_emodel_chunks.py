@@ -0,0 +1,19 @@
+import numpy as np
+import pytest
+
+SCRIPT_NAME = "emodel_chunks.py"
+
+
+@pytest.mark.parametrize(
+    "n_cells, n_chunks, expected",
+    [
+        (10, 1, [0, 10]),
+        (10, 2, [0, 5, 10]),
+        (10, 3, [0, 3, 7, 10]),
+        (2, 3, [0, 1, 1, 2]),
+    ],
+)
+def test_chunk_bounds(test_module, n_cells, n_chunks, expected):
+    result = test_module.chunk_bounds(n_cells, n_chunks)
+
+    np.testing.assert_array_equal(result, expected)
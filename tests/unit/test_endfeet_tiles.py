@@ -0,0 +1,129 @@
+import h5py
+import libsonata
+import numpy as np
+import pytest
+
+SCRIPT_NAME = "endfeet_tiles.py"
+
+
+def _write_connectivity(path, x):
+    n_edges = len(x)
+    with h5py.File(path, "w") as h5:
+        population = h5.create_group("edges/gliovascular")
+        population.create_dataset("source_node_id", data=np.arange(n_edges))
+        population["source_node_id"].attrs["node_population"] = "vasculature"
+        population.create_dataset("target_node_id", data=np.arange(n_edges) // 2)
+        population["target_node_id"].attrs["node_population"] = "astrocytes"
+        population.create_dataset("edge_type_id", data=np.full(n_edges, -1))
+        population.create_dataset("edge_group_id", data=np.zeros(n_edges, dtype=int))
+        population.create_dataset("edge_group_index", data=np.arange(n_edges))
+        population.create_dataset("0/endfoot_surface_x", data=x)
+        population.create_dataset("0/endfoot_surface_y", data=np.zeros(n_edges))
+        population.create_dataset("0/endfoot_surface_z", data=np.zeros(n_edges))
+
+
+def _write_endfeet_meshes(path, n_endfeet, values):
+    points = [np.full((i % 3 + 1, 3), value) for i, value in enumerate(values)]
+    with h5py.File(path, "w") as h5:
+        h5.create_dataset("attributes/surface_area", data=values)
+        h5.create_dataset("data/points", data=np.concatenate(points))
+        offsets = np.cumsum([0] + [len(p) for p in points])
+        h5.create_dataset("offsets/points", data=offsets)
+    assert len(values) == n_endfeet
+
+
+def test_tile_bounds(test_module):
+    positions = np.array([[5, 0, 0], [0, 1, 0], [10, 0, 1], [2, 0, 0]], dtype=float)
+
+    axis, cores, intervals = test_module.tile_bounds(positions, 2, halo=1.5)
+
+    assert axis == 0
+    np.testing.assert_array_equal(cores[0], [False, True, False, True])
+    np.testing.assert_array_equal(cores[1], [True, False, True, False])
+    assert intervals == [(-1.5, 3.5), (3.5, 11.5)]
+
+
+def test_submesh(test_module):
+    vertices = np.array([[0, 0, 0], [1, 0, 0], [2, 0, 0], [3, 0, 0], [4, 0, 0]], dtype=float)
+    triangles = np.array([[0, 1, 2], [1, 2, 3], [2, 3, 4]])
+
+    result_vertices, result_triangles = test_module.submesh(vertices, triangles, 0, (0, 0.5))
+
+    np.testing.assert_array_equal(result_vertices, vertices[:3])
+    np.testing.assert_array_equal(result_triangles, [[0, 1, 2]])
+
+
+def test_obj_roundtrip(tmp_path, test_module):
+    vertices = np.array([[0, 0, 0], [1, 0, 0], [0, 1, 0]], dtype=float)
+    triangles = np.array([[0, 1, 2]])
+    path = tmp_path / "mesh.obj"
+
+    test_module.write_obj(path, vertices, triangles)
+    result_vertices, result_triangles = test_module.read_obj(path)
+
+    np.testing.assert_allclose(result_vertices, vertices)
+    np.testing.assert_array_equal(result_triangles, triangles)
+
+
+def test_split(tmp_path, test_module):
+    connectivity_path = tmp_path / "gliovascular.h5"
+    _write_connectivity(connectivity_path, [0.0, 20.0, 1.0, 21.0])
+    mesh_path = tmp_path / "vasculature.obj"
+    vertices = np.column_stack([np.arange(0, 25, 5.0), np.zeros(5), np.arange(5) % 2])
+    test_module.write_obj(mesh_path, vertices, np.array([[0, 1, 2], [2, 3, 4]]))
+    out_tiles = [
+        (
+            tmp_path / f"gliovascular_{i}.h5",
+            tmp_path / f"vasculature_{i}.obj",
+            tmp_path / f"ids_{i}.npz",
+        )
+        for i in range(2)
+    ]
+
+    test_module.split(connectivity_path, "gliovascular", mesh_path, 1.0, 2.0, out_tiles)
+
+    ids = np.load(out_tiles[0][2])
+    np.testing.assert_array_equal(ids["ids"], [0, 2])
+    np.testing.assert_array_equal(ids["core"], [True, True])
+    assert ids["n_endfeet"] == 4
+    population = libsonata.EdgeStorage(out_tiles[1][0]).open_population("gliovascular")
+    assert population.size == 2
+    assert population.source == "vasculature"
+    np.testing.assert_array_equal(
+        population.get_attribute("endfoot_surface_x", libsonata.Selection([[0, 2]])), [20, 21]
+    )
+    np.testing.assert_array_equal(population.source_nodes(libsonata.Selection([[0, 2]])), [1, 3])
+    _, triangles = test_module.read_obj(out_tiles[0][1])
+    assert len(triangles) == 1
+
+
+def test_merge(tmp_path, test_module):
+    tile_meshes = [tmp_path / "endfeet_meshes_0.h5", tmp_path / "endfeet_meshes_1.h5"]
+    tile_ids = [tmp_path / "ids_0.npz", tmp_path / "ids_1.npz"]
+    # the endfoot 1 is in the halo of the tile 0, and in the core of the tile 1
+    np.savez(tile_ids[0], ids=[0, 1, 2], core=[True, False, True], n_endfeet=4)
+    np.savez(tile_ids[1], ids=[1, 3], core=[True, True], n_endfeet=4)
+    _write_endfeet_meshes(tile_meshes[0], 3, [10.0, -1.0, 12.0])
+    _write_endfeet_meshes(tile_meshes[1], 2, [11.0, 13.0])
+    out_path = tmp_path / "endfeet_meshes.h5"
+
+    test_module.merge(tile_meshes, tile_ids, out_path)
+
+    with h5py.File(out_path, "r") as h5:
+        np.testing.assert_array_equal(h5["attributes/surface_area"], [10, 11, 12, 13])
+        offsets = h5["offsets/points"][:]
+        points = h5["data/points"][:]
+    assert len(offsets) == 5
+    for i, value in enumerate([10, 11, 12, 13]):
+        start, stop = offsets[i], offsets[i + 1]
+        np.testing.assert_array_equal(points[start:stop], value)
+
+
+def test_merge_missing_endfoot(tmp_path, test_module):
+    tile_meshes = [tmp_path / "endfeet_meshes_0.h5"]
+    tile_ids = [tmp_path / "ids_0.npz"]
+    np.savez(tile_ids[0], ids=[0, 1], core=[True, False], n_endfeet=2)
+    _write_endfeet_meshes(tile_meshes[0], 2, [10.0, 11.0])
+
+    with pytest.raises(RuntimeError, match="Each endfoot must be in the core of exactly one tile"):
+        test_module.merge(tile_meshes, tile_ids, tmp_path / "endfeet_meshes.h5")
@@ -0,0 +1,53 @@
+import os
+
+import h5py
+import numpy as np
+import pytest
+
+from circuit_build.constants import ENV_CONFIG
+
+SCRIPT_NAME = "glia_synthesis_shards.py"
+
+
+def test_shard_ids(test_module):
+    shards = [test_module.shard_ids(10, 3, shard) for shard in range(3)]
+
+    assert [len(ids) for ids in shards] == [3, 4, 3]
+    np.testing.assert_array_equal(np.concatenate(shards), np.arange(10))
+
+
+def test_shard_ids_more_shards_than_astrocytes(test_module):
+    shards = [test_module.shard_ids(2, 4, shard) for shard in range(4)]
+
+    np.testing.assert_array_equal(np.concatenate(shards), [0, 1])
+
+
+def test_count_astrocytes(tmp_path, test_module):
+    path = tmp_path / "nodes.h5"
+    with h5py.File(path, "w") as h5:
+        h5.create_dataset("nodes/astrocytes/node_type_id", data=np.full(5, -1))
+
+    assert test_module.count_astrocytes(path) == 5
+
+
+def test_archngv_version_in_default_env(test_module):
+    modules = ENV_CONFIG["synthesize-glia"]["modules"]
+
+    assert f"py-archngv/{test_module.ARCHNGV_VERSION}" in modules
+
+
+def test_check_archngv_version(test_module, monkeypatch):
+    monkeypatch.setattr("importlib.metadata.version", lambda name: test_module.ARCHNGV_VERSION)
+    test_module.check_archngv_version()
+
+    monkeypatch.setattr("importlib.metadata.version", lambda name: "0.0.1")
+    with pytest.raises(RuntimeError, match="requires archngv"):
+        test_module.check_archngv_version()
+
+
+def test_cpu_count(test_module, monkeypatch):
+    monkeypatch.setenv("SLURM_CPUS_PER_TASK", "8")
+    assert test_module.cpu_count() == 8
+
+    monkeypatch.delenv("SLURM_CPUS_PER_TASK")
+    assert test_module.cpu_count() == len(os.sched_getaffinity(0))
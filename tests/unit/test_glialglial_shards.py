@@ -0,0 +1,54 @@
+import h5py
+import libsonata
+import numpy as np
+
+SCRIPT_NAME = "glialglial_shards.py"
+
+
+def _write_edges(path, source_ids, target_ids, section_ids):
+    with h5py.File(path, "w") as h5:
+        population = h5.create_group("edges/glialglial")
+        population.create_dataset("source_node_id", data=source_ids)
+        population["source_node_id"].attrs["node_population"] = "astrocytes"
+        population.create_dataset("target_node_id", data=target_ids)
+        population["target_node_id"].attrs["node_population"] = "astrocytes"
+        population.create_dataset("edge_type_id", data=np.full(len(source_ids), -1))
+        population.create_dataset("edge_group_id", data=np.zeros(len(source_ids), dtype=int))
+        population.create_dataset("edge_group_index", data=np.arange(len(source_ids)))
+        population.create_dataset("0/efferent_section_id", data=section_ids)
+        population.create_dataset("indices/source_to_target/node_id_to_ranges", data=[[0, 0]])
+
+
+def test_merge(tmp_path, test_module):
+    shard_edges = [tmp_path / "shard_0.h5", tmp_path / "shard_1.h5", tmp_path / "shard_2.h5"]
+    _write_edges(shard_edges[0], [0, 2], [1, 0], [10, 11])
+    _write_edges(shard_edges[1], [], [], [])
+    _write_edges(shard_edges[2], [1], [2], [12])
+    out_edges = tmp_path / "edges.h5"
+
+    test_module.merge(shard_edges, "glialglial", 3, out_edges)
+
+    population = libsonata.EdgeStorage(out_edges).open_population("glialglial")
+    assert population.size == 3
+    assert population.source == "astrocytes"
+    selection = libsonata.Selection([[0, 3]])
+    np.testing.assert_array_equal(population.source_nodes(selection), [0, 2, 1])
+    np.testing.assert_array_equal(population.target_nodes(selection), [1, 0, 2])
+    np.testing.assert_array_equal(
+        population.get_attribute("efferent_section_id", selection), [10, 11, 12]
+    )
+    np.testing.assert_array_equal(population.afferent_edges([0]).flatten(), [1])
+    with h5py.File(out_edges, "r") as h5:
+        np.testing.assert_array_equal(h5["edges/glialglial/edge_group_index"], [0, 1, 2])
+
+
+def test_rank_edges(tmp_path, test_module):
+    shard_dirs = [tmp_path / "shard_0", tmp_path / "shard_1"]
+    for shard_dir, ranks in zip(shard_dirs, [[0, 2, 10], [1]]):
+        shard_dir.mkdir()
+        for rank in ranks:
+            (shard_dir / f"{rank}.h5").touch()
+
+    result = test_module.rank_edges(shard_dirs)
+
+    assert [p.name for p in result] == ["0.h5", "1.h5", "2.h5", "10.h5"]
@@ -0,0 +1,34 @@
+import subprocess
+import sys
+import time
+
+# packages that are slow to import, and that must be imported only when needed
+HEAVY_PACKAGES = [
+    "bluepysnap",
+    "h5py",
+    "jsonschema",
+    "libsonata",
+    "numpy",
+    "pandas",
+    "snakemake",
+    "voxcell",
+]
+
+
+def test_heavy_packages_not_imported():
+    # a new interpreter is needed, because the packages may be already imported by the tests
+    code = (
+        "import sys, circuit_build.cli, circuit_build.context;"
+        "print(' '.join(sorted({m.split('.')[0] for m in sys.modules})))"
+    )
+
+    start = time.monotonic()
+    result = subprocess.run(
+        [sys.executable, "-c", code], check=True, capture_output=True, text=True
+    )
+    elapsed = time.monotonic() - start
+
+    imported = set(result.stdout.split())
+    assert imported.isdisjoint(HEAVY_PACKAGES), sorted(imported.intersection(HEAVY_PACKAGES))
+    # generous limit, including the startup of the interpreter
+    assert elapsed < 5
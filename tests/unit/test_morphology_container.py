@@ -0,0 +1,38 @@
+import h5py
+import morphio
+import numpy as np
+from morphio import PointLevel, SectionType
+from morphio.mut import Morphology
+
+SCRIPT_NAME = "morphology_container.py"
+
+
+def _write_morphology(path, length):
+    morph = Morphology()
+    morph.soma.points = [[0, 0, 0], [1, 0, 0], [0, 1, 0]]
+    morph.soma.diameters = [1, 1, 1]
+    morph.append_root_section(
+        PointLevel([[0, 0, 0], [0, length, 0]], [1, 1]), SectionType.basal_dendrite
+    )
+    morph.write(path)
+
+
+def test_pack(test_module, tmp_path):
+    morph_dir = tmp_path / "morphologies"
+    (morph_dir / "shards" / "0").mkdir(parents=True)
+    _write_morphology(morph_dir / "b.h5", 2)
+    _write_morphology(morph_dir / "a.h5", 1)
+    _write_morphology(morph_dir / "shards" / "0" / "c.h5", 3)
+    out_path = tmp_path / "morphologies.h5"
+
+    test_module.pack(morph_dir, out_path)
+
+    with h5py.File(out_path, "r") as h5:
+        assert list(h5) == ["a", "b", "shards"]
+    collection = morphio.Collection(str(out_path))
+    for name, length in [("a", 1), ("b", 2), ("shards/0/c", 3)]:
+        expected = morphio.Morphology(morph_dir / f"{name}.h5")
+        result = collection.load(name)
+        np.testing.assert_allclose(result.points, expected.points)
+        np.testing.assert_allclose(result.section_offsets, expected.section_offsets)
+        assert result.points[-1][1] == length
@@ -4,8 +4,10 @@ import json
 import shutil
 from pathlib import Path
 from copy import deepcopy
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
 
+import h5py
+import numpy as np
 import pytest
 
 from circuit_build import ngv as test_module
@@ -373,6 +375,46 @@ def test_stage_ngv_base_circuit__relative_paths(
     assert not Path(mock_context.nodes_spatial_index_dir).exists()
 
 
+def test_stage_ngv_base_circuit__manifest(
+    tmp_path, base_config__with_indices, mock_context, nodes_file, spatial_segment_index_dir
+):
+    """Test that the base circuit is staged again only when it differs from the manifest."""
+    manifest_file = tmp_path / "auxiliary" / "staging.json"
+
+    test_module.stage_ngv_base_circuit(base_config__with_indices, mock_context, manifest_file)
+
+    manifest = json.loads(manifest_file.read_text())
+    assert manifest["base_circuit"] == base_config__with_indices
+    assert len(manifest["links"]) == 6
+    assert manifest["links"][0]["source"] == nodes_file
+    assert manifest["links"][0]["target"] == mock_context.nodes_neurons_file
+    assert manifest["links"][0]["size"] == Path(nodes_file).stat().st_size
+
+    with patch.object(test_module, "_get_components") as mocked:
+        test_module.stage_ngv_base_circuit(base_config__with_indices, mock_context, manifest_file)
+    assert mocked.call_count == 0
+
+    # a removed link is staged again
+    Path(mock_context.nodes_spatial_index_dir).unlink()
+    test_module.stage_ngv_base_circuit(base_config__with_indices, mock_context, manifest_file)
+    assert Path(mock_context.nodes_spatial_index_dir).resolve() == Path(spatial_segment_index_dir)
+
+    # a different base circuit is staged again
+    modified_config = {**base_config__with_indices, "edge_population_name": "Other"}
+    with pytest.raises(RuntimeError, match="Edge population name 'Other'"):
+        test_module.stage_ngv_base_circuit(modified_config, mock_context, manifest_file)
+
+
+def test_is_staged__invalid_manifest(tmp_path, base_config__with_indices):
+    config_path = Path(base_config__with_indices["config"])
+    manifest_file = tmp_path / "staging.json"
+
+    assert test_module._is_staged(manifest_file, base_config__with_indices, config_path) is False
+
+    manifest_file.write_text("{}")
+    assert test_module._is_staged(manifest_file, base_config__with_indices, config_path) is False
+
+
 def test_stage_path__raises():
     """Test that nonexisting source path raises an error."""
     with pytest.raises(RuntimeError, match="Source path foo/bar.txt does not exist."):
@@ -523,3 +565,91 @@ def test_get_components(
     assert res.morphologies_dir == Path(morphologies_dir)
     assert res.synapse_index_dir is None
     assert res.segment_index_dir is None
+
+
+def test_gmsh_refine_script(tmp_path):
+    result = test_module.gmsh_refine_script(
+        input_mesh=tmp_path / "mesh.msh", output_mesh=tmp_path / "refined.msh", steps=2
+    )
+
+    lines = result.splitlines()
+    assert lines[0] == f'Merge "{tmp_path}/mesh.msh";'
+    assert lines.count("RefineMesh;") == 2
+    assert 'Printf("Refinement step 2/2: %g s, %g Mb, %g tetrahedra"' in result
+    assert lines[-1] == f'Save "{tmp_path}/refined.msh";'
+
+
+def test_split_touches_dir(tmp_path):
+    touches_dir = tmp_path / "touches"
+    touches_dir.mkdir()
+    names = ["_SUCCESS", "touches.0", "touchesData.0", "touches.1", "touchesData.1", "touches.2"]
+    for name in names:
+        (touches_dir / name).touch()
+    out_dirs = [tmp_path / "shard_0", tmp_path / "shard_1"]
+
+    test_module.split_touches_dir(touches_dir, out_dirs)
+
+    assert sorted(p.name for p in out_dirs[0].iterdir()) == ["0", "2"]
+    assert sorted(p.name for p in out_dirs[1].iterdir()) == ["1"]
+    assert sorted(p.name for p in (out_dirs[0] / "0").iterdir()) == [
+        "_SUCCESS",
+        "touches.0",
+        "touchesData.0",
+    ]
+    assert sorted(p.name for p in (out_dirs[0] / "2").iterdir()) == ["_SUCCESS", "touches.2"]
+    assert (out_dirs[1] / "1" / "touches.1").resolve() == touches_dir / "touches.1"
+
+
+def test_merge_morphology_dirs(tmp_path):
+    shard_dirs = [tmp_path / "shard_0", tmp_path / "shard_1"]
+    for shard_dir, names in zip(shard_dirs, [["GLIA_0.h5", "GLIA_1.h5"], ["GLIA_2.h5"]]):
+        shard_dir.mkdir()
+        for name in names:
+            (shard_dir / name).write_text(name)
+    out_dir = tmp_path / "morphologies"
+
+    test_module.merge_morphology_dirs(shard_dirs, out_dir)
+
+    assert sorted(p.name for p in out_dir.iterdir()) == ["GLIA_0.h5", "GLIA_1.h5", "GLIA_2.h5"]
+    assert (out_dir / "GLIA_2.h5").read_text() == "GLIA_2.h5"
+    assert (shard_dirs[1] / "GLIA_2.h5").exists()
+
+
+def test_merge_morphology_dirs_duplicated(tmp_path):
+    shard_dirs = [tmp_path / "shard_0", tmp_path / "shard_1"]
+    for shard_dir in shard_dirs:
+        shard_dir.mkdir()
+        (shard_dir / "GLIA_0.h5").touch()
+
+    with pytest.raises(RuntimeError, match="Morphology GLIA_0.h5 found in more than one shard"):
+        test_module.merge_morphology_dirs(shard_dirs, tmp_path / "morphologies")
+
+
+def _write_astrocytes(path, x, me_combo):
+    with h5py.File(path, "w") as h5:
+        population = h5.create_group("nodes/astrocytes")
+        population.create_dataset("node_type_id", data=np.full(len(x), -1))
+        population.create_dataset("0/x", data=np.asarray(x, dtype=np.float32))
+        population.create_dataset("0/y", data=np.zeros(len(x), dtype=np.float32))
+        population.create_dataset("0/z", data=np.zeros(len(x), dtype=np.float32))
+        population.create_dataset("0/radius", data=np.ones(len(x), dtype=np.float32))
+        population.create_dataset("0/me_combo", data=me_combo)
+
+
+def test_write_microdomains_key(tmp_path):
+    config = {"overlap_distribution": {"type": "normal", "values": [0.1, 1e-7]}}
+    # only me_combo is changed in the second file, and the positions in the third file
+    cases = [([1, 2], [b"a", b"b"]), ([1, 2], [b"c", b"d"]), ([1, 3], [b"a", b"b"])]
+    keys = []
+    for n, (x, me_combo) in enumerate(cases):
+        nodes_file, key_file = tmp_path / f"nodes_{n}.h5", tmp_path / f"key_{n}.json"
+        _write_astrocytes(nodes_file, x, me_combo)
+        test_module.write_microdomains_key(nodes_file, config, key_file)
+        keys.append(key_file.read_text())
+
+    assert keys[0] == keys[1]
+    assert keys[0] != keys[2]
+    key = json.loads(keys[0])
+    assert key["population_name"] == "astrocytes"
+    assert key["size"] == 2
+    assert key["config"] == config
@@ -0,0 +1,124 @@
+import json
+import os
+from base64 import urlsafe_b64encode
+
+import pytest
+
+from circuit_build import provenance as test_module
+
+
+def _write_metadata(directory, output, record):
+    path = directory / test_module.METADATA_DIR / urlsafe_b64encode(output.encode()).decode()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(record))
+
+
+def _set_mtime(path, mtime):
+    os.utime(path, (mtime, mtime))
+
+
+@pytest.fixture
+def workdir(tmp_path):
+    (tmp_path / "input.txt").write_text("input")
+    (tmp_path / "outdir").mkdir()
+    (tmp_path / "outdir" / "a.txt").write_text("a")
+    (tmp_path / "final.txt").write_text("final")
+    _set_mtime(tmp_path / "input.txt", 1000)
+    _set_mtime(tmp_path / "outdir", 2000)
+    _set_mtime(tmp_path / "final.txt", 3000)
+    record = {"rule": "r1", "input": ["input.txt"], "params": [], "endtime": 2000}
+    _write_metadata(tmp_path, "outdir", record)
+    record = {"rule": "r2", "input": ["outdir"], "params": ["p"], "endtime": 3000}
+    _write_metadata(tmp_path, "final.txt", record)
+    return tmp_path
+
+
+def test_file_digest(tmp_path):
+    (tmp_path / "a").mkdir()
+    (tmp_path / "a" / "b.txt").write_text("b")
+    (tmp_path / "c").mkdir()
+    (tmp_path / "c" / "b.txt").write_text("b")
+    (tmp_path / "c" / test_module.SNAKEMAKE_TIMESTAMP).touch()
+
+    assert test_module.file_digest(tmp_path / "a") == test_module.file_digest(tmp_path / "c")
+    assert test_module.file_digest(tmp_path / "a" / "b.txt") != test_module.file_digest(
+        tmp_path / "a"
+    )
+    assert test_module.file_digest(tmp_path / "missing") is None
+
+
+def test_update_provenance(workdir):
+    test_module.update_provenance(workdir)
+
+    result = test_module.load_provenance(workdir)
+    assert set(result["outputs"]) == {"outdir", "final.txt"}
+    assert result["outputs"]["final.txt"]["rule"] == "r2"
+    assert result["outputs"]["final.txt"]["inputs"] == {
+        "outdir": test_module.file_digest(workdir / "outdir")
+    }
+
+
+def test_restore_mtimes(workdir):
+    test_module.update_provenance(workdir)
+    # simulate a copy of the files, modifying only the mtimes
+    _set_mtime(workdir / "input.txt", 5000)
+    _set_mtime(workdir / "outdir", 4000)
+    _set_mtime(workdir / "final.txt", 3000)
+
+    result = test_module.restore_mtimes(workdir)
+
+    assert result == ["outdir", "final.txt"]
+    assert os.stat(workdir / "outdir").st_mtime == 5000
+    assert os.stat(workdir / "final.txt").st_mtime == 5000
+
+
+def test_restore_mtimes_with_modified_input(workdir):
+    test_module.update_provenance(workdir)
+    (workdir / "input.txt").write_text("modified")
+    _set_mtime(workdir / "input.txt", 5000)
+
+    result = test_module.restore_mtimes(workdir)
+
+    assert result == []
+    assert os.stat(workdir / "outdir").st_mtime == 2000
+
+
+def test_update_provenance_after_failed_execution(workdir):
+    test_module.update_provenance(workdir)
+    # the input is modified, and the execution fails before executing the job again
+    (workdir / "input.txt").write_text("modified")
+    _set_mtime(workdir / "input.txt", 5000)
+    test_module.update_provenance(workdir)
+
+    result = test_module.restore_mtimes(workdir)
+
+    assert result == []
+    assert os.stat(workdir / "outdir").st_mtime == 2000
+
+
+def test_update_provenance_after_new_execution(workdir):
+    test_module.update_provenance(workdir)
+    (workdir / "input.txt").write_text("modified")
+    _set_mtime(workdir / "input.txt", 5000)
+    # the job is executed again with the modified input
+    (workdir / "outdir" / "a.txt").write_text("new")
+    record = {"rule": "r1", "input": ["input.txt"], "params": [], "endtime": 6000}
+    _write_metadata(workdir, "outdir", record)
+    test_module.update_provenance(workdir)
+
+    result = test_module.load_provenance(workdir)["outputs"]["outdir"]
+    assert result["endtime"] == 6000
+    assert result["digest"] == test_module.file_digest(workdir / "outdir")
+    assert result["inputs"] == {"input.txt": test_module.file_digest(workdir / "input.txt")}
+
+
+def test_dump_provenance_drops_deleted_files(workdir):
+    test_module.update_provenance(workdir)
+    assert str(workdir / "input.txt") in test_module.load_provenance(workdir)["files"]
+    (workdir / "input.txt").unlink()
+
+    test_module.restore_mtimes(workdir)
+
+    result = test_module.load_provenance(workdir)
+    assert str(workdir / "input.txt") not in result["files"]
+    assert str(workdir / "final.txt") in result["files"]
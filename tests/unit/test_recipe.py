@@ -0,0 +1,98 @@
+import shutil
+
+import pytest
+from utils import TEST_PROJ_TINY
+
+from circuit_build import recipe as test_module
+from circuit_build.constants import RECIPE_SECTIONS
+
+RECIPE = "builderRecipeAllPathways.xml"
+CONNECTIVITY_RECIPE = "builderConnectivityRecipeAllPathways.xml"
+
+
+@pytest.fixture
+def recipe_dir(tmp_path):
+    for name in [RECIPE, CONNECTIVITY_RECIPE]:
+        shutil.copyfile(TEST_PROJ_TINY / name, tmp_path / name)
+    return tmp_path
+
+
+def _replace(path, old, new):
+    content = path.read_text(encoding="iso-8859-1")
+    assert old in content
+    path.write_text(content.replace(old, new, 1), encoding="iso-8859-1")
+
+
+def _digests(recipe_dir):
+    sections_digests = test_module.recipe_sections_digests(recipe_dir / RECIPE)
+    return {
+        rule: test_module.recipe_digest(sections_digests, sections)
+        for rule, sections in RECIPE_SECTIONS.items()
+    }
+
+
+def test_recipe_sections_digests(recipe_dir):
+    result = test_module.recipe_sections_digests(recipe_dir / RECIPE)
+
+    assert set(result) == {
+        "InterBoutonInterval",
+        "InitialBoutonDistance",
+        "column",
+        "NeuronTypes",
+        "SynapsesProperties",
+        "SynapsesClassification",
+        "ConnectionRules",
+        "TouchRules",
+    }
+
+
+def test_recipe_digest_ignores_formatting(recipe_dir):
+    expected = _digests(recipe_dir)
+
+    _replace(recipe_dir / RECIPE, "<blueColumn>", "<blueColumn>\n<!-- comment -->\n\n")
+
+    assert _digests(recipe_dir) == expected
+
+
+def test_recipe_digest_synapse_properties_changed(recipe_dir):
+    expected = _digests(recipe_dir)
+
+    _replace(recipe_dir / RECIPE, "</SynapsesProperties>", "<synapse/>\n</SynapsesProperties>")
+    result = _digests(recipe_dir)
+
+    assert result["touchdetector"] == expected["touchdetector"]
+    assert result["spykfunc_s2s"] == expected["spykfunc_s2s"]
+    assert result["spykfunc_s2f"] != expected["spykfunc_s2f"]
+
+
+def test_recipe_digest_connection_rules_changed(recipe_dir):
+    expected = _digests(recipe_dir)
+
+    _replace(
+        recipe_dir / CONNECTIVITY_RECIPE, 'cv_syns_connection="0.320"', 'cv_syns_connection="1"'
+    )
+    result = _digests(recipe_dir)
+
+    assert result["touchdetector"] == expected["touchdetector"]
+    assert result["spykfunc_s2s"] == expected["spykfunc_s2s"]
+    assert result["spykfunc_s2f"] != expected["spykfunc_s2f"]
+
+
+def test_recipe_digest_touch_rules_changed(recipe_dir):
+    expected = _digests(recipe_dir)
+
+    _replace(recipe_dir / RECIPE, "<TouchRules>", "<TouchRules>\n<touchRule/>")
+    result = _digests(recipe_dir)
+
+    assert result["touchdetector"] != expected["touchdetector"]
+    assert result["spykfunc_s2s"] != expected["spykfunc_s2s"]
+    assert result["spykfunc_s2f"] != expected["spykfunc_s2f"]
+
+
+def test_recipe_digest_missing_section():
+    sections_digests = {"A": "1", "B": "2"}
+
+    result = test_module.recipe_digest(sections_digests, ["A", "C"])
+
+    assert result != test_module.recipe_digest(sections_digests, ["A"])
+    assert result != test_module.recipe_digest(sections_digests)
@@ -0,0 +1,202 @@
+import json
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from circuit_build import sbatch as test_module
+from circuit_build.utils import dump_yaml, load_yaml
+
+
+@pytest.mark.parametrize(
+    "snakemake_version, expected_keys",
+    [
+        (
+            9,
+            {
+                "executor": "cluster-generic",
+                "cluster-generic-submit-cmd": "submit",
+                "cluster-generic-status-cmd": "circuit-build sbatch status",
+                "retries": 2,
+            },
+        ),
+        (
+            7,
+            {
+                "cluster": "submit",
+                "cluster-status": "circuit-build sbatch status",
+                "restart-times": 2,
+            },
+        ),
+    ],
+)
+def test_write_profile(tmp_path, snakemake_version, expected_keys):
+    dump_yaml(tmp_path / "cluster.yaml", {"__default__": {"salloc": "-p prod"}})
+    expected_submit_cmd = (
+        f"circuit-build -v sbatch submit --cluster-config {tmp_path}/cluster.yaml "
+        f"--log-dir {tmp_path}/logs"
+    )
+
+    path = test_module.write_profile(
+        tmp_path / "profile",
+        cluster_config=tmp_path / "cluster.yaml",
+        log_dir=tmp_path / "logs",
+        snakemake_version=snakemake_version,
+    )
+
+    assert path == tmp_path / "profile" / "config.yaml"
+    result = load_yaml(path)
+    assert result["jobs"] == 500
+    assert "groups" not in result
+    for key, value in expected_keys.items():
+        assert result[key] == (expected_submit_cmd if value == "submit" else value)
+
+
+def test_write_profile_with_groups(tmp_path):
+    cluster_config = {
+        "__default__": {"salloc": "-p prod"},
+        "__groups__": {
+            "small": {"rules": ["init_cells", "node_sets"], "components": 2, "salloc": "-n1"},
+            "ngv": {"rules": ["ngv_config"], "salloc": "-n1"},
+        },
+    }
+    dump_yaml(tmp_path / "cluster.yaml", cluster_config)
+
+    path = test_module.write_profile(
+        tmp_path / "profile",
+        cluster_config=tmp_path / "cluster.yaml",
+        log_dir=tmp_path / "logs",
+        snakemake_version=9,
+    )
+
+    result = load_yaml(path)
+    assert result["groups"] == ["init_cells=small", "node_sets=small", "ngv_config=ngv"]
+    assert result["group-components"] == ["small=2"]
+
+
+def test_get_rule_groups():
+    cluster_config = {
+        "__groups__": {
+            "small": {"rules": ["init_cells", "node_sets"], "salloc": "-n1"},
+            "ngv": {"rules": ["ngv_config"], "salloc": "-n1"},
+        },
+    }
+
+    result = test_module.get_rule_groups(cluster_config)
+
+    assert result == {"init_cells": "small", "node_sets": "small", "ngv_config": "ngv"}
+    assert test_module.get_rule_groups({"__default__": {"salloc": "-p prod"}}) == {}
+
+
+def test_get_rule_groups_raises_with_duplicated_rules():
+    cluster_config = {
+        "__groups__": {
+            "small": {"rules": ["init_cells", "node_sets"], "salloc": "-n1"},
+            "other": {"rules": ["node_sets"], "salloc": "-n1"},
+        },
+    }
+
+    with pytest.raises(ValueError, match="Rule node_sets cannot be in groups small and other"):
+        test_module.get_rule_groups(cluster_config)
+
+
+@pytest.mark.parametrize(
+    "properties, expected",
+    [
+        (
+            {"type": "single", "rule": "place_cells", "resources": {}},
+            {"jobname": "place_cells", "salloc": "-p prod"},
+        ),
+        (
+            {
+                "type": "single",
+                "rule": "synthesize_morphologies_shard",
+                "resources": {"slurm_env": "synthesize_morphologies"},
+            },
+            {"jobname": "synthesize_morphologies", "salloc": "-p prod -n 20"},
+        ),
+        (
+            {"type": "group", "groupid": "small", "resources": {}},
+            {"jobname": "small", "salloc": "-p prod -n 1"},
+        ),
+    ],
+)
+def test_get_job_slurm_config(properties, expected):
+    cluster_config = {
+        "__default__": {"salloc": "-p prod"},
+        "__groups__": {"small": {"rules": ["init_cells"], "salloc": "-p prod -n 1"}},
+        "synthesize_morphologies": {"salloc": "-p prod -n 20"},
+    }
+
+    assert test_module.get_job_slurm_config(cluster_config, properties) == expected
+
+
+def test_get_group_config_raises_with_missing_group():
+    with pytest.raises(ValueError, match="Group small must be defined in __groups__"):
+        test_module.get_group_config({"__default__": {"salloc": "-p prod"}}, "small")
+
+
+def test_sbatch_args(monkeypatch):
+    monkeypatch.setenv("SALLOC_ACCOUNT", "proj1")
+    slurm_config = {"jobname": "td", "salloc": "-A ${{SALLOC_ACCOUNT}} -p prod -n 100"}
+
+    result = test_module.sbatch_args(slurm_config, "/path/to/logs")
+
+    assert result == [
+        "--parsable",
+        "--job-name=td",
+        "--output=/path/to/logs/%x-%j.out",
+        *["-A", "proj1", "-p", "prod", "-n", "100"],
+    ]
+
+
+@patch("circuit_build.sbatch.subprocess.run")
+def test_submit(run_mock, tmp_path):
+    run_mock.return_value.stdout = "1234;cluster\n"
+    cluster_config = tmp_path / "cluster.yaml"
+    dump_yaml(cluster_config, {"__default__": {"salloc": "-p prod"}})
+    jobscript = tmp_path / "jobscript.sh"
+    properties = {"type": "single", "rule": "node_sets", "resources": {"slurm_env": "node_sets"}}
+    jobscript.write_text(f"#!/bin/sh\n# properties = {json.dumps(properties)}\nsnakemake\n")
+
+    result = test_module.submit(jobscript, cluster_config=cluster_config, log_dir=tmp_path / "logs")
+
+    assert result == "1234"
+    assert run_mock.call_args[0][0] == [
+        "sbatch",
+        "--parsable",
+        "--job-name=node_sets",
+        f"--output={tmp_path}/logs/%x-%j.out",
+        *["-p", "prod"],
+        str(jobscript),
+    ]
+
+
+def test_submit_without_properties(tmp_path):
+    jobscript = tmp_path / "jobscript.sh"
+    jobscript.write_text("#!/bin/sh\nsnakemake\n")
+
+    with pytest.raises(ValueError, match="Job properties not found"):
+        test_module.submit(jobscript, cluster_config=None, log_dir=tmp_path)
+
+
+@pytest.mark.parametrize(
+    "sacct, squeue, expected",
+    [
+        ((0, "COMPLETED\n"), None, "success"),
+        ((0, "RUNNING\n"), None, "running"),
+        ((0, "REQUEUED\n"), None, "running"),
+        ((0, "PREEMPTED\n"), None, "failed"),
+        ((0, "CANCELLED by 123\n"), None, "failed"),
+        ((0, ""), (0, "PENDING\n"), "running"),
+        ((0, ""), (1, ""), "failed"),
+        ((1, ""), (0, ""), "running"),
+    ],
+)
+@patch("circuit_build.sbatch.subprocess.run")
+def test_job_status(run_mock, sacct, squeue, expected):
+    run_mock.side_effect = [
+        MagicMock(returncode=returncode, stdout=stdout, stderr="")
+        for returncode, stdout in filter(None, [sacct, squeue])
+    ]
+
+    assert test_module.job_status("1234") == expected
@@ -0,0 +1,93 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+SCRIPT_NAME = "synthesis_checkpoint.py"
+
+
+@pytest.mark.parametrize(
+    "n_ids, batch_size, expected",
+    [
+        (0, 2, []),
+        (5, 2, [2, 2, 1]),
+        (5, None, [5]),
+    ],
+)
+def test_split(test_module, n_ids, batch_size, expected):
+    result = test_module._split(np.arange(n_ids), batch_size)
+
+    assert [len(ids) for ids in result] == expected
+    np.testing.assert_array_equal(np.concatenate([[], *result]), np.arange(n_ids))
+
+
+class _Cells:
+    def save(self, path):
+        path.touch()
+
+
+@pytest.fixture
+def synthesized(test_module, monkeypatch):
+    """Return the morphology names written by region-grower for each output cells file."""
+    result = {}
+
+    def _load_cells(path):
+        if path not in result:
+            return None
+        return SimpleNamespace(properties={"morphology": result[path]})
+
+    monkeypatch.setattr(test_module, "_load_cells", _load_cells)
+    return result
+
+
+def _synthesize(checkpoint, batch, names, synthesized, exts=("h5", "asc")):
+    for name in names:
+        for ext in exts:
+            path = checkpoint.batch_morph_dir(batch) / f"{name}.{ext}"
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.touch()
+    synthesized[checkpoint.batch_dir(batch) / "synthesized.h5"] = names
+
+
+def test_checkpoint(test_module, tmp_path, synthesized):
+    exts = ["h5", "asc"]
+    morph_dir = tmp_path / "morphologies"
+    checkpoint = test_module.Checkpoint(tmp_path, morph_dir, digest="abc", seed=10)
+
+    # first execution: the first batch is complete, dropping the cell 1,
+    # while the morphologies of the second batch are written only partially
+    assert checkpoint.add_batch(_Cells(), np.array([0, 1])) == 0
+    assert checkpoint.add_batch(_Cells(), np.array([2, 3])) == 1
+    assert (checkpoint.batch_dir(1) / "seed.txt").read_text(encoding="utf-8") == "12\n"
+    checkpoint.save()
+    _synthesize(checkpoint, 0, ["a"], synthesized)
+    _synthesize(checkpoint, 1, ["b"], synthesized, exts=["h5"])
+    checkpoint.update(exts)
+
+    assert checkpoint.batches == {0: True}
+    assert not checkpoint.batch_morph_dir(1).exists()
+    np.testing.assert_array_equal(checkpoint.done_ids(), [0, 1])
+
+    # second execution: the cells of the incomplete batch are synthesized with a new seed
+    checkpoint.save()
+    checkpoint = test_module.Checkpoint(tmp_path, morph_dir, digest="abc", seed=10)
+    assert checkpoint.add_batch(_Cells(), np.array([2, 3])) == 2
+    assert (checkpoint.batch_dir(2) / "seed.txt").read_text(encoding="utf-8") == "14\n"
+    _synthesize(checkpoint, 2, ["b", "c"], synthesized)
+    checkpoint.update(exts)
+
+    assert checkpoint.batches == {0: True, 2: True}
+    np.testing.assert_array_equal(checkpoint.done_ids(), [0, 1, 2, 3])
+
+
+def test_checkpoint_reset(test_module, tmp_path, synthesized):
+    morph_dir = tmp_path / "morphologies"
+    checkpoint = test_module.Checkpoint(tmp_path, morph_dir, digest="abc", seed=10)
+    checkpoint.add_batch(_Cells(), np.arange(4))
+    _synthesize(checkpoint, 0, ["a"], synthesized)
+    checkpoint.update(["h5", "asc"])
+    checkpoint.save()
+
+    assert test_module.Checkpoint(tmp_path, morph_dir, "abc", seed=10).done_ids().size == 4
+    assert test_module.Checkpoint(tmp_path, morph_dir, "abc", seed=11).done_ids().size == 0
+    assert not (morph_dir / "batches").exists()
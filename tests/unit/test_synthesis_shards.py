@@ -0,0 +1,20 @@
+import numpy as np
+import pytest
+
+SCRIPT_NAME = "synthesis_shards.py"
+
+
+@pytest.mark.parametrize(
+    "mtypes, n_shards, expected_order, expected_bounds",
+    [
+        (["B", "A", "B", "A"], 1, [1, 3, 0, 2], [0, 4]),
+        (["B", "A", "B", "A"], 2, [1, 3, 0, 2], [0, 2, 4]),
+        (["B", "A", "C", "A", "B"], 3, [1, 3, 0, 4, 2], [0, 2, 3, 5]),
+        (["A", "A"], 3, [0, 1], [0, 1, 1, 2]),
+    ],
+)
+def test_shard_bounds(test_module, mtypes, n_shards, expected_order, expected_bounds):
+    order, bounds = test_module.shard_bounds(mtypes, n_shards)
+
+    np.testing.assert_array_equal(order, expected_order)
+    np.testing.assert_array_equal(bounds, expected_bounds)
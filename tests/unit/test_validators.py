@@ -1,9 +1,11 @@
 import re
 import warnings
+from pathlib import Path
 
 import pytest
 from utils import TEST_PROJ_SYNTH, TEST_PROJ_TINY, UNIT_TESTS_DATA
 
+import circuit_build
 from circuit_build import validators as test_module
 from circuit_build.constants import ENV_CONFIG
 from circuit_build.utils import load_yaml
@@ -144,3 +146,14 @@ def test_validate_morphology_release(tmp_path):
     p.touch()
 
     assert test_module.validate_morphology_release(path) == path
+
+
+def test_slurm_envs_are_valid_cluster_keys():
+    rules_dir = Path(circuit_build.__file__).parent / "snakemake" / "rules"
+    pattern = r"(?:slurm_env=|slurm_resources\(|local_threads\()\"([\w-]+)\""
+    slurm_envs = {
+        name for path in rules_dir.glob("*.smk") for name in re.findall(pattern, path.read_text())
+    }
+    assert slurm_envs
+    config = {name: {"salloc": "-p prod"} for name in slurm_envs}
+    test_module.validate_config(config, "cluster.yaml")
@@ -1,8 +1,9 @@
+import importlib.util
 import os
 from contextlib import contextmanager
 from pathlib import Path
 
-from circuit_build.utils import dump_yaml, load_yaml
+from circuit_build.utils import dump_yaml, load_yaml, script_path
 
 TESTS_DIR = Path(__file__).resolve().parent
 UNIT_TESTS_DATA = TESTS_DIR / "unit" / "data"
@@ -40,3 +41,11 @@ def edit_yaml(yaml_file):
         yield config
     finally:
         dump_yaml(yaml_file, config)
+
+
+def load_script(name):
+    """Import and return the module of the given script in the snakemake scripts directory."""
+    spec = importlib.util.spec_from_file_location(Path(name).stem, script_path(name))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module